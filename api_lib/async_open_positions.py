@@ -0,0 +1,55 @@
+import asyncio
+import time
+
+from api_lib import open_positions
+
+# Every call runs the blocking client in a worker thread, so the pooled session,
+# timeouts and retries of open_positions apply unchanged. Keep HTTP_POOL_SIZE at
+# least as large as the concurrency used by the caller.
+
+
+async def get_open_positions_demo(as_frame=True):
+    return await asyncio.to_thread(open_positions.get_open_positions_demo, as_frame)
+
+
+async def get_full_orders(limit=500):
+    return await asyncio.to_thread(open_positions.get_full_orders, limit)
+
+
+async def close_position(position):
+    return await asyncio.to_thread(open_positions.close_position, position)
+
+
+async def cancel_and_set_new(symbol, position_side, amount, sl_price, cancel_order):
+    return await asyncio.to_thread(
+        open_positions.cancel_and_set_new, symbol, position_side, amount, sl_price, cancel_order
+    )
+
+
+async def create_stop_order(symbol, position_side, amount, sl_price):
+    return await asyncio.to_thread(
+        open_positions.create_stop_order, symbol, position_side, amount, sl_price
+    )
+
+
+async def get_price(symbol):
+    return await asyncio.to_thread(open_positions.get_price, symbol)
+
+
+class AsyncRateLimiter:
+    """Spaces request starts so that at most `rate` requests start per second"""
+
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate > 0 else 0
+        self.next_slot = 0
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        if not self.interval:
+            return
+        async with self.lock:
+            now = time.monotonic()
+            wait = self.next_slot - now
+            self.next_slot = max(now, self.next_slot) + self.interval
+        if wait > 0:
+            await asyncio.sleep(wait)
@@ -1,38 +1,71 @@
-from hashlib import sha256
-import hmac
+import contextlib
+import contextvars
+import json
+import logging
 import os
-import pandas as pd
-import requests
 import time
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from utils.log_config import logging_config
+from api_lib.rate_limiter import PRIORITY_PROTECTIVE, PRIORITY_ROUTINE, RequestBudget
+from api_lib.signer import encode_params, get_signer
+from utils import metrics
 
-log = logging_config()
+# Configured by the entry point (logging_config), not at import time
+log = logging.getLogger('main_log')
 load_dotenv()
 APIURL = os.getenv('APIURL')
 API_KEY = os.getenv('API_KEY')
 API_SECRET = os.getenv('API_SECRET')
 POST='POST'
 GET='GET'
+HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', 10))
+HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', 3.05))
+HTTP_READ_TIMEOUT = float(os.getenv('HTTP_READ_TIMEOUT', 10))
+HTTP_RETRIES = int(os.getenv('HTTP_RETRIES', 3))
+HTTP_BACKOFF = float(os.getenv('HTTP_BACKOFF', 0.3))
+# Orders per batchOrders request accepted by the exchange
+BATCH_ORDERS_MAX = 5
 
-def get_open_positions_demo():
+session = None
+# (api_key, api_secret) of the account the current thread/task works for, None means API_KEY/API_SECRET
+credentials = contextvars.ContextVar('credentials', default=None)
+# Requests per second, 0 disables the limit
+request_budget = RequestBudget(
+    read_rate=float(os.getenv('RATE_LIMIT_READ', 10)),
+    trade_rate=float(os.getenv('RATE_LIMIT_TRADE', 5)),
+    read_burst=float(os.getenv('RATE_LIMIT_READ_BURST', 0)) or None,
+    trade_burst=float(os.getenv('RATE_LIMIT_TRADE_BURST', 0)) or None,
+)
+api_request_seconds = metrics.histogram(
+    'order_tracker_api_request_seconds', 'Exchange request latency, rate limit waits excluded', ('method', 'endpoint'),
+)
+api_request_errors = metrics.counter(
+    'order_tracker_api_request_errors_total', 'Exchange requests that raised', ('method', 'endpoint'),
+)
+
+def get_open_positions_demo(as_frame=True):
+    """Open positions as a DataFrame, or as the list of position dicts with as_frame=False"""
     payload = {}
     path = '/openApi/swap/v2/user/positions'
     method = GET
+    now = int(time.time() * 1000)
     paramsMap = {
-        "startTime": int((pd.Timestamp.now() - pd.Timedelta(days=1)).timestamp() * 1000),
-        "endTime": int(pd.Timestamp.now().timestamp() * 1000),
+        "startTime": now - 24 * 60 * 60 * 1000,
+        "endTime": now,
         "limit": "1000",
-        "timestamp": str(int(time.time() * 1000))
+        "timestamp": str(now)
     }
     paramsStr = parseParam(paramsMap)
     try:
         response = send_request_demo(method, path, paramsStr, payload)
-        df = pd.DataFrame(response['data'])
-        return df
+        positions = response['data']
     except:
         log.error("Error retrieving income data")
-        return pd.DataFrame([])
+        positions = []
+    if not as_frame:
+        return positions
+    import pandas as pd
+    return pd.DataFrame(positions)
     
 
 def close_position(position):
@@ -49,12 +82,13 @@ def close_position(position):
     paramsStr = parseParam(paramsMap)
     log.info(f'Close position {symbol}, {position_side}, {positionAmt}')
 
-    response = send_request_demo(method, path, paramsStr, payload)
+    response = send_request_demo(method, path, paramsStr, payload, priority=PRIORITY_PROTECTIVE)
     if (response['code'] != 0):
         log.error(response)
     return response       
 
-def get_full_orders(limit=500):
+def get_full_orders(limit=500, startTime=None, endTime=None):
+    """Order history, newest first, of the orders updated between startTime and endTime (ms, inclusive) when given"""
     payload = {}
     path = '/openApi/swap/v1/trade/fullOrder'
     method = GET
@@ -62,6 +96,10 @@ def get_full_orders(limit=500):
         "timestamp": str(int(time.time() * 1000)),
         "limit": limit
     }
+    if startTime is not None:
+        paramsMap['startTime'] = startTime
+    if endTime is not None:
+        paramsMap['endTime'] = endTime
     paramsStr = parseParam(paramsMap)
 
     orders = send_request_demo(method, path, paramsStr, payload)
@@ -69,6 +107,18 @@ def get_full_orders(limit=500):
         log.error(orders)
     return orders
 
+def get_all_open_orders():
+    """Every open order of the account, without a limit"""
+    payload = {}
+    path = '/openApi/swap/v2/trade/openOrders'
+    method = GET
+    paramsStr = parseParam({})
+
+    orders = send_request_demo(method, path, paramsStr, payload)
+    if (orders['code'] != 0):
+        log.error(orders)
+    return orders
+
 def cancel_and_set_new(symbol, position_side, amount, sl_price, cancel_order):
     payload = {}
     path = '/openApi/swap/v1/trade/cancelReplace'
@@ -114,6 +164,107 @@ def create_stop_order(symbol, position_side, amount, sl_price):
         log.error(response)
     return response    
 
+def create_stop_orders_batch(orders):
+    """
+    Create STOP_MARKET orders for [(symbol, position_side, amount, sl_price)] with one
+    batchOrders request per BATCH_ORDERS_MAX orders.
+    :return: a response per order, in order, {'code': 0, 'data': {'order': ...}} for created orders
+    """
+    payload = {}
+    path = '/openApi/swap/v2/trade/batchOrders'
+    method = POST
+    responses = []
+    for start in range(0, len(orders), BATCH_ORDERS_MAX):
+        chunk = orders[start:start + BATCH_ORDERS_MAX]
+        batch = [
+            {
+                "symbol": symbol,
+                "side": "BUY" if position_side == "SHORT" else "SELL",
+                "positionSide": position_side,
+                "type": "STOP_MARKET",
+                "quantity": amount,
+                "stopPrice": sl_price
+            }
+            for symbol, position_side, amount, sl_price in chunk
+        ]
+        paramsStr = parseParam({"batchOrders": json.dumps(batch, separators=(',', ':'))})
+        log.info(f'Create {len(chunk)} STOP orders: ' + ', '.join(
+            f'{symbol} {position_side} SL: {sl_price}' for symbol, position_side, _, sl_price in chunk
+        ))
+
+        try:
+            response = send_request_demo(method, path, paramsStr, payload)
+        except Exception as e:
+            response = {'code': -1, 'msg': str(e)}
+        responses.extend(split_batch_response(response, len(chunk)))
+    return responses
+
+def split_batch_response(response, count):
+    # Orders come back in request order, an order without orderId or with its own code was rejected
+    if response.get('code') != 0:
+        log.error(response)
+        return [response] * count
+
+    orders = (response.get('data') or {}).get('orders') or []
+    responses = []
+    for i in range(count):
+        order = orders[i] if i < len(orders) else {}
+        if order.get('orderId') and not order.get('code'):
+            responses.append({'code': 0, 'msg': '', 'data': {'order': order}})
+        else:
+            failed = {'code': order.get('code') or -1, 'msg': order.get('msg', 'Order missing from batch response'), 'data': order}
+            log.error(failed)
+            responses.append(failed)
+    return responses
+
+def submit_stop_orders(mutations, max_workers=HTTP_POOL_SIZE):
+    """
+    Send the stop-loss changes of a cycle at once.
+    :param mutations: [(symbol, position_side, amount, sl_price, cancel_order)], cancel_order
+                      None creates a new stop order, otherwise it is replaced
+    :return: a response per mutation, in order. New orders go through batchOrders,
+             cancelReplace has no batch form and is sent concurrently over the pooled session.
+    """
+    responses = [None] * len(mutations)
+    creates = [i for i, mutation in enumerate(mutations) if mutation[4] is None]
+    replaces = [i for i, mutation in enumerate(mutations) if mutation[4] is not None]
+
+    def replace(i):
+        try:
+            return cancel_and_set_new(*mutations[i])
+        except Exception as e:
+            log.error(f'Replace STOP order {mutations[i][0]} failed: {e}')
+            return {'code': -1, 'msg': str(e)}
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(replaces)))) as executor:
+        # Every worker thread signs with the credentials of the caller
+        futures = [(i, executor.submit(contextvars.copy_context().run, replace, i)) for i in replaces]
+        if creates:
+            created = create_stop_orders_batch([mutations[i][:4] for i in creates])
+            for i, response in zip(creates, created):
+                responses[i] = response
+        for i, future in futures:
+            responses[i] = future.result()
+    return responses
+
+def create_listen_key():
+    payload = {}
+    path = '/openApi/user/auth/userDataStream'
+    method = POST
+    paramsStr = parseParam({})
+
+    response = send_request_demo(method, path, paramsStr, payload)
+    return response.get('listenKey')
+
+def extend_listen_key(listenKey):
+    # Listen keys expire after 60 minutes without an extension
+    payload = {}
+    path = '/openApi/user/auth/userDataStream'
+    method = 'PUT'
+    paramsStr = parseParam({"listenKey": listenKey})
+
+    return send_request_demo(method, path, paramsStr, payload)
+
 def get_price(symbol):
     payload = {}
     path = '/openApi/swap/v1/ticker/price'
@@ -131,26 +282,74 @@ def get_price(symbol):
     except Exception:
         return 0
 
-def send_request_demo(method, path, urlpa, payload):
-    url = "%s%s?%s&signature=%s" % (APIURL, path, urlpa, get_sign(API_SECRET, urlpa))
+def create_session(pool_size=HTTP_POOL_SIZE, retries=HTTP_RETRIES, backoff=HTTP_BACKOFF):
+    # requests is imported with the first session, a run without requests does not load it
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    # Only GETs are retried after the request was sent, connection errors are retried for every method
+    retry = Retry(
+        total=retries,
+        backoff_factor=backoff,
+        status_forcelist=(500, 502, 503, 504),
+        allowed_methods=frozenset([GET]),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    new_session = requests.Session()
+    new_session.mount('https://', adapter)
+    new_session.mount('http://', adapter)
+    return new_session
+
+def get_session():
+    global session
+    if session is None:
+        session = create_session()
+    return session
+
+@contextlib.contextmanager
+def use_credentials(api_key, api_secret):
+    """Sign every request made inside the block with the given account credentials"""
+    token = credentials.set((api_key, api_secret))
+    try:
+        yield
+    finally:
+        credentials.reset(token)
+
+def get_credentials():
+    return credentials.get() or (API_KEY, API_SECRET)
+
+def send_request_demo(method, path, urlpa, payload, priority=PRIORITY_ROUTINE):
+    request_budget.acquire(method, priority)
+    api_key, api_secret = get_credentials()
+    url = "%s%s?%s" % (APIURL, path, get_signer(api_secret).signed_query(urlpa))
     headers = {
-        'X-BX-APIKEY': API_KEY,
+        'X-BX-APIKEY': api_key,
     }
-    response = requests.request(method, url, headers=headers, data=payload)
-    return response.json()
+    start = time.perf_counter()
+    try:
+        response = get_session().request(
+            method, url, headers=headers, data=payload,
+            timeout=(HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT),
+        )
+        return response.json()
+    except Exception:
+        api_request_errors.inc(method=method, endpoint=path)
+        raise
+    finally:
+        api_request_seconds.observe(time.perf_counter() - start, method=method, endpoint=path)
+
+def get_rate_limit_stats(reset=False):
+    # Requests sent and seconds spent waiting for tokens, per endpoint class
+    return request_budget.stats(reset)
 
 def get_sign(api_secret, payload):
-    signature = hmac.new(api_secret.encode("utf-8"), payload.encode("utf-8"), digestmod=sha256).hexdigest()
-    
-    return signature
+    return get_signer(api_secret).sign(payload)
 
 def parseParam(paramsMap):
-    sortedKeys = sorted(paramsMap)
-    paramsStr = "&".join(["%s=%s" % (x, paramsMap[x]) for x in sortedKeys])
-    if paramsStr != "": 
-     return paramsStr+"&timestamp="+str(int(time.time() * 1000))
-    else:
-     return paramsStr+"timestamp="+str(int(time.time() * 1000))
+    # Sorted params with a single timestamp, the URL-escaped form is sent by send_request_demo
+    return encode_params(paramsMap)
 
 def get_klines_data(symbol, interval, limit=500, startTime=None, endTime=None, exch=None):
     payload = {}
@@ -171,6 +370,8 @@ def get_klines_data(symbol, interval, limit=500, startTime=None, endTime=None, e
     return send_request_demo(method, path, paramsStr, payload)
 
 def get_klines_data_df(symbol, interval, limit=1000):
+    import pandas as pd
+
     response = get_klines_data(symbol, interval, limit)
     df = pd.DataFrame(response['data'])
     if df.empty:
@@ -0,0 +1,93 @@
+import heapq
+import itertools
+import threading
+import time
+
+# Lower value is served first when several requests wait for the same budget
+PRIORITY_PROTECTIVE = 0
+PRIORITY_ROUTINE = 1
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: `rate` tokens per second, at most `capacity` saved up.
+    Waiting callers are served by priority, then in arrival order.
+    """
+
+    def __init__(self, rate, capacity=None):
+        if capacity is not None and capacity < 1:
+            # acquire() waits for a whole token, it would never be available
+            raise ValueError(f"Token bucket capacity must be at least 1, got {capacity}")
+        self.rate = rate
+        self.capacity = capacity or max(rate, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.condition = threading.Condition()
+        self.waiters = []
+        self.sequence = itertools.count()
+        self.requests = 0
+        self.waited = 0.0
+        self.max_wait = 0.0
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, priority=PRIORITY_ROUTINE):
+        """Take one token, blocking until it is available. Returns the seconds waited."""
+        if self.rate <= 0:
+            return 0.0
+
+        start = time.monotonic()
+        with self.condition:
+            ticket = (priority, next(self.sequence))
+            heapq.heappush(self.waiters, ticket)
+            try:
+                while True:
+                    self.refill()
+                    if self.waiters[0] == ticket:
+                        if self.tokens >= 1:
+                            self.tokens -= 1
+                            break
+                        self.condition.wait((1 - self.tokens) / self.rate)
+                    else:
+                        self.condition.wait()
+            finally:
+                self.waiters.remove(ticket)
+                heapq.heapify(self.waiters)
+                self.condition.notify_all()
+
+            waited = time.monotonic() - start
+            self.requests += 1
+            self.waited += waited
+            self.max_wait = max(self.max_wait, waited)
+        return waited
+
+    def stats(self, reset=False):
+        with self.condition:
+            stats = {'requests': self.requests, 'waited': self.waited, 'max_wait': self.max_wait}
+            if reset:
+                self.requests = 0
+                self.waited = 0.0
+                self.max_wait = 0.0
+        return stats
+
+
+class RequestBudget:
+    """Separate token buckets for read (GET) and trade (everything else) requests"""
+
+    def __init__(self, read_rate, trade_rate, read_burst=None, trade_burst=None):
+        self.buckets = {
+            'read': TokenBucket(read_rate, read_burst),
+            'trade': TokenBucket(trade_rate, trade_burst),
+        }
+
+    def endpoint_class(self, method):
+        return 'read' if method == 'GET' else 'trade'
+
+    def acquire(self, method, priority=PRIORITY_ROUTINE):
+        return self.buckets[self.endpoint_class(method)].acquire(priority)
+
+    def stats(self, reset=False):
+        return {name: bucket.stats(reset) for name, bucket in self.buckets.items()}
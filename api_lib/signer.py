@@ -0,0 +1,79 @@
+import bisect
+import functools
+import hmac
+import re
+import time
+from hashlib import sha256
+from urllib.parse import quote
+
+
+# Characters that need no escaping in a query value (RFC 3986 unreserved)
+needs_escape = re.compile(r'[^A-Za-z0-9_.~-]').search
+# key=value pairs of unreserved characters only, the query can be sent as it is signed
+plain_query = re.compile(r'[A-Za-z0-9_.~-]+=[A-Za-z0-9_.~-]*(?:&[A-Za-z0-9_.~-]+=[A-Za-z0-9_.~-]*)*').fullmatch
+# Each ASCII byte as itself or %XX
+ascii_escapes = [chr(code) if not needs_escape(chr(code)) else f'%{code:02X}' for code in range(128)]
+
+
+def escape(value):
+    if not needs_escape(value):
+        return value
+    if value.isascii():
+        return ''.join([ascii_escapes[code] for code in value.encode('ascii')])
+    return quote(value, safe='')
+
+
+class Query(str):
+    """
+    Query string in the form the signature is computed over, for queries with values
+    that need escaping. `encoded` holds the same pairs with URL-escaped values, as they are sent.
+    """
+
+    encoded = None
+
+
+def encode_params(paramsMap, timestamp=None):
+    """
+    Query of the sorted params with exactly one timestamp, the given one, paramsMap['timestamp']
+    or the current time in ms. A plain str when no value needs escaping, a Query otherwise.
+    """
+    keys = sorted(paramsMap)
+    pairs = ["%s=%s" % (key, paramsMap[key]) for key in keys]
+    if 'timestamp' not in paramsMap:
+        timestamp = timestamp if timestamp is not None else int(time.time() * 1000)
+        index = bisect.bisect(keys, 'timestamp')
+        keys.insert(index, 'timestamp')
+        pairs.insert(index, "timestamp=%s" % timestamp)
+    query = '&'.join(pairs)
+    # Most requests (symbols, numbers) need no escaping and are sent as signed.
+    # An & inside a value adds a pair, an = inside a value fails the pattern
+    if plain_query(query) and query.count('&') == len(keys) - 1:
+        return query
+    query = Query(query)
+    # Keys are plain names, the value of a pair is everything after its first =
+    query.encoded = '&'.join([
+        "%s=%s" % (key, escape(value)) for key, _, value in (pair.partition('=') for pair in pairs)
+    ])
+    return query
+
+
+class RequestSigner:
+    """HMAC-SHA256 keyed once with the API secret, a copy of it signs each request"""
+
+    def __init__(self, api_secret):
+        self.mac = hmac.new(api_secret.encode('utf-8'), digestmod=sha256)
+
+    def sign(self, payload):
+        mac = self.mac.copy()
+        mac.update(payload.encode('utf-8'))
+        return mac.hexdigest()
+
+    def signed_query(self, query):
+        """URL query with the signature of `query` appended"""
+        return f"{getattr(query, 'encoded', None) or query}&signature={self.sign(query)}"
+
+
+@functools.lru_cache(maxsize=64)
+def get_signer(api_secret):
+    # One signer per secret, shared between threads, sign() does not change it
+    return RequestSigner(api_secret)
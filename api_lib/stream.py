@@ -0,0 +1,63 @@
+import gzip
+import json
+import os
+import uuid
+from dotenv import load_dotenv
+
+try:
+    import websockets
+except ImportError:
+    websockets = None
+
+load_dotenv()
+STREAM_URL = os.getenv('STREAM_URL', 'wss://open-api-swap.bingx.com/swap-market')
+
+
+def decode_message(raw):
+    # Market and account streams send gzip compressed frames, pings come as plain text
+    if isinstance(raw, bytes):
+        try:
+            raw = gzip.decompress(raw)
+        except OSError:
+            pass
+        raw = raw.decode('utf-8')
+    return raw
+
+
+def mark_price_data_type(symbol):
+    return f"{symbol}@markPrice"
+
+
+async def stream_messages(url, data_types=()):
+    """
+    Connect to `url`, subscribe to `data_types` and yield every decoded JSON message.
+    Pings are answered here. Returns when the server closes the connection.
+    """
+    if websockets is None:
+        raise RuntimeError("websockets package is required for the streaming mode")
+
+    async with websockets.connect(url, max_size=None) as ws:
+        for data_type in data_types:
+            await ws.send(json.dumps({'id': str(uuid.uuid4()), 'reqType': 'sub', 'dataType': data_type}))
+
+        async for raw in ws:
+            message = decode_message(raw)
+            if message == 'Ping':
+                await ws.send('Pong')
+                continue
+            try:
+                yield json.loads(message)
+            except ValueError:
+                continue
+
+
+def parse_mark_price(message):
+    """Return (symbol, markPrice) of a mark price update or None for anything else"""
+    data = message.get('data')
+    if not isinstance(data, dict) or data.get('e') != 'markPriceUpdate':
+        return None
+    return data['s'], float(data['p'])
+
+
+def user_stream_url(listenKey, url=None):
+    return f"{url or STREAM_URL}?listenKey={listenKey}"
@@ -0,0 +1,176 @@
+import asyncio
+import functools
+import os
+import sys
+import time
+import traceback
+
+from dotenv import load_dotenv
+
+from api_lib import async_open_positions as async_api
+from api_lib.async_open_positions import AsyncRateLimiter
+from api_lib.open_positions import api_request_seconds
+from records import Position
+from order_tracker import OrderTracker, create_scheduler, cycle_errors, positions_open, start_metrics_endpoint
+
+load_dotenv()
+async_concurrency = int(os.getenv('ASYNC_CONCURRENCY', 8))
+# Every request also passes the read/trade budget of api_lib, 0 leaves the pacing to it
+async_rate_limit = float(os.getenv('ASYNC_RATE_LIMIT', 0))
+
+# Closing a position is sent before any stop-loss update
+PRIORITY_CLOSE = 0
+PRIORITY_STOP_LOSS = 1
+
+
+class AsyncOrderTracker(OrderTracker):
+    """
+    OrderTracker that fetches positions and orders concurrently and sends the
+    close/stop-loss requests of a cycle concurrently. The decisions and the cycle
+    bookkeeping are the same as in OrderTracker.run, for every DECISION_ENGINE,
+    STOP_LOSS_DISPATCH and ORDERS_SYNC.
+    """
+
+    def __init__(self, concurrency=None, rate_limit=None, **kwargs):
+        super().__init__(**kwargs)
+        self.concurrency = concurrency or async_concurrency
+        self.rate_limit = async_rate_limit if rate_limit is None else rate_limit
+        # Requests decided in the current cycle, None outside of run_async
+        self.pending_actions = None
+
+    def run(self, re_raise_exception=False, mark=None, near_only=False):
+        """One cycle on its own event loop, for create_scheduler and other callers of OrderTracker.run"""
+        asyncio.run(self.run_async(re_raise_exception, mark, near_only))
+
+    async def run_async(self, re_raise_exception=False, mark=None, near_only=False):
+        if not mark is None:
+            self.run_with_mark = mark
+        start = time.perf_counter()
+        api_start = api_request_seconds.total_sum()
+        try:
+            with self.account_credentials():
+                await self.run_cycle_async(near_only)
+        except Exception as e:
+            cycle_errors.inc()
+            self.log.error(f"{self.m}Exception occurred: {e}\n{traceback.format_exc()}")
+            if re_raise_exception:
+                raise
+        finally:
+            self.log_rate_limit_waits()
+            self.observe_cycle(time.perf_counter() - start, api_request_seconds.total_sum() - api_start)
+
+    async def run_cycle_async(self, near_only=False):
+        requests = [async_api.get_open_positions_demo(as_frame=False)]
+        if self.needs_orders(near_only):
+            requests.append(self.fetch_open_orders_async())
+        positions, *orders = await asyncio.gather(*requests)
+        self.position_records = Position.from_rows(positions)
+        positions_open.set(len(self.position_records))
+        await asyncio.to_thread(self.sync_saved_locally)
+        if orders:
+            self.set_open_orders(self.attach_position_ids(orders[0]))
+        await asyncio.to_thread(self.refresh_coefficients)
+
+        self.pending_actions = []
+        try:
+            pending = self.decide_positions(self.positions_to_evaluate(near_only))
+            actions = self.pending_actions
+        finally:
+            self.pending_actions = None
+        await self.dispatch_actions(actions)
+        if pending:
+            # One batch request after the closes, as in OrderTracker.run
+            await asyncio.to_thread(self.dispatch_stop_losses, pending)
+        self.end_cycle()
+
+        await asyncio.to_thread(self.save_saved_locally)
+
+    async def fetch_open_orders_async(self):
+        """Open orders without positionIds, fetched before the positions of the cycle are known"""
+        if self.order_book is not None:
+            # The book pages through the order history with the blocking client
+            return await asyncio.to_thread(self.order_book.sync)
+        return self.orders_from_response(await async_api.get_full_orders(limit=30))
+
+    async def dispatch_actions(self, actions):
+        if not actions:
+            return
+        semaphore = asyncio.Semaphore(self.concurrency)
+        limiter = AsyncRateLimiter(self.rate_limit)
+
+        async def dispatch(action):
+            async with semaphore:
+                await limiter.acquire()
+                await action()
+
+        # sort is stable, positions keep their order within a priority
+        actions = sorted(actions, key=lambda item: item[0])
+        results = await asyncio.gather(
+            *(dispatch(action) for priority, action in actions), return_exceptions=True
+        )
+        for result in results:
+            if isinstance(result, Exception):
+                self.log.error(
+                    f"{self.m}Order request failed: {result}\n"
+                    f"{''.join(traceback.format_exception(result))}"
+                )
+
+    def close_position_order(self, position_row):
+        if self.pending_actions is None:
+            return super().close_position_order(position_row)
+        self.pending_actions.append(
+            (PRIORITY_CLOSE, functools.partial(self.close_position_order_async, position_row))
+        )
+
+    def set_stop_loss(self, position, new_sl_price, stop_order, markPrice):
+        if self.pending_actions is None or self.pending_stop_losses is not None:
+            # Sent right away, or in one batch by dispatch_stop_losses
+            return super().set_stop_loss(position, new_sl_price, stop_order, markPrice)
+        self.pending_actions.append((
+            PRIORITY_STOP_LOSS,
+            functools.partial(self.set_stop_loss_async, position, new_sl_price, stop_order, markPrice),
+        ))
+
+    async def close_position_order_async(self, position_row):
+        self.log.info(
+            f"{self.m}Trying to close {position_row['symbol']}, {position_row['positionSide']}, amount: {position_row['positionAmt']}"
+        )
+        order = await async_api.close_position(position_row)
+        self.log.info(f"{self.m}Closed position with order {order}")
+
+    async def set_stop_loss_async(self, position, new_sl_price, stop_order, markPrice):
+        response = await self.update_stop_loss_async(position, new_sl_price, stop_order)
+        self.record_stop_order(position, new_sl_price, stop_order, response)
+        self.update_saved_entry(position, new_sl_price, stop_order, markPrice)
+
+    async def update_stop_loss_async(self, position, new_sl_price, stop_order):
+        symbol = position['symbol']
+        positionSide = position['positionSide']
+        positionAmt = float(position['positionAmt'])
+
+        if stop_order is not None:
+            return await async_api.cancel_and_set_new(
+                symbol,
+                positionSide,
+                positionAmt,
+                new_sl_price,
+                stop_order,
+            )
+        else:
+            return await async_api.create_stop_order(
+                symbol, positionSide, positionAmt, new_sl_price
+            )
+
+
+def main(loop_mode):
+    order_manager = AsyncOrderTracker()
+    if loop_mode:
+        start_metrics_endpoint(order_manager.log, order_manager.m)
+        # Same drift-free full/near-threshold cadence as order_tracker.py loop
+        create_scheduler(order_manager).run()
+    else:
+        order_manager.run()
+
+
+if __name__ == '__main__':
+    main(len(sys.argv) > 1 and sys.argv[1] == 'loop')
@@ -0,0 +1,275 @@
+import itertools
+import logging
+import multiprocessing
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+
+from api_lib.open_positions import get_klines_data_df
+from decision_engine import LONG_PROFIT_FACTOR, LONG_STOP_FACTOR, SHORT_STOP_FACTOR, SL_ADJUSTMENT
+from order_tracker import OrderTracker
+from records import Order
+from utils.saved_store import MemoryStore
+
+load_dotenv()
+backtest_data_dir = os.getenv('BACKTEST_DATA_DIR', 'backtest_data')
+backtest_processes = int(os.getenv('BACKTEST_PROCESSES', os.cpu_count() or 1))
+
+DEFAULT_PARAMS = {
+    'side': 'LONG',
+    'short_stop_factor': SHORT_STOP_FACTOR,
+    'long_stop_factor': LONG_STOP_FACTOR,
+    'long_profit_factor': LONG_PROFIT_FACTOR,
+    'sl_adjustment': SL_ADJUSTMENT,
+    # Distance of the stop and take profit orders placed with a new position, as in OrderTracker's defaults
+    'stop_distance': 0.015,
+    'take_profit_distance': 0.015,
+    # Taker fee per side
+    'fee': 0.0005,
+}
+
+# Per process, jobs of the same symbol reuse the klines
+loaded_klines = {}
+
+
+def kline_cache_path(symbol, interval, data_dir=None):
+    return os.path.join(data_dir or backtest_data_dir, f"{symbol}_{interval}.csv")
+
+
+def load_klines(symbol, interval, limit=1000, data_dir=None, refresh=False):
+    """Klines from the local file cache, fetched with get_klines_data_df when missing"""
+    path = kline_cache_path(symbol, interval, data_dir)
+    if refresh or not os.path.exists(path):
+        df = get_klines_data_df(symbol, interval, limit)
+        if df.empty:
+            raise ValueError(f"No {interval} klines for {symbol}")
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        df.to_csv(path)
+        return df
+    return pd.read_csv(path, index_col='time', parse_dates=['time'])
+
+
+def parameter_grid(**values):
+    """DEFAULT_PARAMS with every combination of the given value lists, e.g. parameter_grid(side=['LONG', 'SHORT'])"""
+    names = list(values)
+    return [
+        dict(DEFAULT_PARAMS, **dict(zip(names, combination)))
+        for combination in itertools.product(*(values[name] for name in names))
+    ]
+
+
+class SimulatedExchange:
+    """
+    One symbol with at most one open position, filled against kline highs/lows.
+    Implements the order functions of api_lib.open_positions the tracker calls.
+    """
+
+    def __init__(self, symbol, fee=DEFAULT_PARAMS['fee']):
+        self.symbol = symbol
+        self.fee = fee
+        self.position = None
+        # Same shape as OrderTracker.build_orders_index
+        self.orders_index = {}
+        self.trades = []
+        self.mutations = 0
+        self.next_id = 0
+
+    def new_id(self):
+        self.next_id += 1
+        return self.next_id
+
+    def new_order(self, position_side, type, stopPrice):
+        return {'orderId': self.new_id(), 'symbol': self.symbol, 'positionSide': position_side,
+                'type': type, 'stopPrice': stopPrice}
+
+    def open_position(self, position_side, price, stop_distance, take_profit_distance):
+        direction = 1 if position_side == 'LONG' else -1
+        self.position = {
+            'symbol': self.symbol,
+            'positionSide': position_side,
+            'positionId': self.new_id(),
+            'positionAmt': 1.0,
+            'avgPrice': price,
+            'markPrice': price,
+        }
+        self.orders_index[(self.symbol, position_side)] = {
+            'stop': self.new_order(position_side, 'STOP_MARKET', price * (1 - direction * stop_distance)),
+            'take_profit': self.new_order(position_side, 'TAKE_PROFIT', price * (1 + direction * take_profit_distance)),
+        }
+        return self.position
+
+    def step(self, high, low, close):
+        """Fill the stop or take profit touched by the bar, then mark the position at the close"""
+        position = self.position
+        if position is None:
+            return
+        orders = self.orders_index[(self.symbol, position['positionSide'])]
+        stopPrice = orders['stop']['stopPrice']
+        take_profit_price = orders['take_profit']['stopPrice']
+        if position['positionSide'] == 'LONG':
+            stop_hit, take_profit_hit = low <= stopPrice, high >= take_profit_price
+        else:
+            stop_hit, take_profit_hit = high >= stopPrice, low <= take_profit_price
+        # Without intrabar data a bar touching both counts as stopped out
+        if stop_hit:
+            self.settle(stopPrice)
+        elif take_profit_hit:
+            self.settle(take_profit_price)
+        else:
+            position['markPrice'] = close
+
+    def settle(self, price):
+        position = self.position
+        direction = 1 if position['positionSide'] == 'LONG' else -1
+        self.trades.append(direction * (price - position['avgPrice']) / position['avgPrice'] - 2 * self.fee)
+        del self.orders_index[(self.symbol, position['positionSide'])]
+        self.position = None
+
+    def close_position(self, position):
+        self.mutations += 1
+        self.settle(position['markPrice'])
+        return {'code': 0}
+
+    def create_stop_order(self, symbol, position_side, amount, sl_price):
+        self.mutations += 1
+        order = self.new_order(position_side, 'STOP_MARKET', sl_price)
+        self.orders_index[(symbol, position_side)]['stop'] = order
+        return {'code': 0, 'data': {'order': order}}
+
+    def cancel_and_set_new(self, symbol, position_side, amount, sl_price, cancel_order):
+        self.mutations += 1
+        order = self.new_order(position_side, cancel_order['type'], sl_price)
+        self.orders_index[(symbol, position_side)]['stop'] = order
+        return {'code': 0, 'data': {'newOrderResponse': order}}
+
+
+class BacktestTracker(OrderTracker):
+    """
+    OrderTracker deciding with process_position against a SimulatedExchange.
+    Thresholds and the trailing factor come from `params`, saved entries are kept in a dict.
+    """
+
+    def __init__(self, exchange, params):
+        super().__init__(saved_store=MemoryStore())
+        self.log = logging.getLogger('main_log.backtest')
+        self.log.setLevel(logging.WARNING)
+        self.exchange = exchange
+        self.params = params
+        self.saved_entries = {}
+        self.orders_index = exchange.orders_index
+        # get_stop_order/get_take_profit_price only look at orders_index when there are open orders
+        self.order_records = [Order()]
+
+    def close_position_order(self, position_row):
+        self.exchange.close_position(position_row)
+
+    def update_stop_loss(self, position, new_sl_price, stop_order):
+        positionAmt = float(position['positionAmt'])
+        if stop_order is not None:
+            self.exchange.cancel_and_set_new(
+                position['symbol'], position['positionSide'], positionAmt, new_sl_price, stop_order
+            )
+        else:
+            self.exchange.create_stop_order(position['symbol'], position['positionSide'], positionAmt, new_sl_price)
+
+    def get_short_stop_threshold(self, avgPrice, stopPrice):
+        return avgPrice + (stopPrice - avgPrice) * self.params['short_stop_factor']
+
+    def get_long_thresholds(self, avgPrice, stopPrice, take_profit_price):
+        return (
+            avgPrice - (avgPrice - stopPrice) * self.params['long_stop_factor'],
+            avgPrice + (take_profit_price - avgPrice) * self.params['long_profit_factor'],
+        )
+
+    def get_sl_adjustment(self, symbol):
+        return self.params['sl_adjustment']
+
+    def get_saved_entry(self, positionId):
+        return self.saved_entries.get(positionId)
+
+    def update_saved_entry(self, position, new_sl_price, stop_order, markPrice):
+        self.saved_entries[position['positionId']] = {'stopPrice': new_sl_price, 'markPrice': markPrice}
+
+    def remove_saved_entry(self, positionId):
+        self.saved_entries.pop(positionId, None)
+
+
+def replay(symbol, high, low, close, params=None):
+    """
+    Trade `symbol` bar by bar: open a position at the close when none is open,
+    fill its orders against the following bars and let the tracker decide at every close.
+    """
+    params = dict(DEFAULT_PARAMS, **(params or {}))
+    exchange = SimulatedExchange(symbol, params['fee'])
+    tracker = BacktestTracker(exchange, params)
+    high, low, close = (np.asarray(values, dtype=np.float64).tolist() for values in (high, low, close))
+
+    for i in range(len(close)):
+        position = exchange.position
+        if position is None:
+            tracker.position_snapshots.clear()
+            tracker.saved_entries.clear()
+            exchange.open_position(params['side'], close[i], params['stop_distance'], params['take_profit_distance'])
+            continue
+        exchange.step(high[i], low[i], close[i])
+        if exchange.position is not None:
+            tracker.process_position(position)
+
+    if exchange.position is not None:
+        exchange.settle(close[-1])
+    return summarize(exchange.trades, exchange.mutations, len(close))
+
+
+def summarize(trades, mutations, bars):
+    equity = np.cumsum(trades) if trades else np.zeros(1)
+    drawdown = np.maximum.accumulate(np.maximum(equity, 0)) - equity
+    return {
+        'bars': bars,
+        'trades': len(trades),
+        'pnl': float(equity[-1]),
+        'max_drawdown': float(drawdown.max()),
+        'win_rate': float(np.mean(np.asarray(trades) > 0)) if trades else 0.0,
+        'mutations': mutations,
+    }
+
+
+def run_job(job):
+    symbol, interval, params = job
+    key = (symbol, interval)
+    if key not in loaded_klines:
+        df = load_klines(symbol, interval)
+        loaded_klines[key] = (df['high'].to_numpy(), df['low'].to_numpy(), df['close'].to_numpy())
+    high, low, close = loaded_klines[key]
+    result = replay(symbol, high, low, close, params)
+    return dict(result, symbol=symbol, interval=interval, **params)
+
+
+def run_backtests(jobs, processes=backtest_processes):
+    """Replay (symbol, interval, params) jobs, spread over `processes` worker processes"""
+    jobs = list(jobs)
+    if processes <= 1 or len(jobs) <= 1:
+        return [run_job(job) for job in jobs]
+    context = multiprocessing.get_context('spawn')
+    # Jobs of a symbol stay together so that every process loads few kline files
+    jobs.sort(key=lambda job: (job[0], job[1]))
+    with context.Pool(min(processes, len(jobs))) as pool:
+        return pool.map(run_job, jobs, chunksize=max(1, len(jobs) // (processes * 4)))
+
+
+if __name__ == '__main__':
+    symbols = sys.argv[1].split(',') if len(sys.argv) > 1 else ['BTC-USDT']
+    interval = sys.argv[2] if len(sys.argv) > 2 else '5m'
+    jobs = [
+        (symbol, interval, params)
+        for symbol in symbols
+        for params in parameter_grid(side=['LONG', 'SHORT'])
+    ]
+    start = time.monotonic()
+    results = pd.DataFrame(run_backtests(jobs))
+    elapsed = time.monotonic() - start
+    print(results[['symbol', 'side', 'bars', 'trades', 'pnl', 'max_drawdown', 'win_rate', 'mutations']].to_string())
+    print(f"{results['bars'].sum()} bars in {elapsed:.2f}s")
@@ -0,0 +1,187 @@
+"""
+Benchmark of OrderTracker.run against an in-process fake exchange.
+
+    python -m benchmarks.bench_cycle                    # 10/100/1k/10k positions
+    python -m benchmarks.bench_cycle --save             # store the results as the baseline
+    python -m benchmarks.bench_cycle --compare          # fail on regressions against the baseline
+    python -m benchmarks.bench_cycle --orders-sync book # order book instead of refetching the orders
+"""
+import argparse
+import contextlib
+import json
+import logging
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from api_lib import open_positions
+from api_lib.rate_limiter import RequestBudget
+from benchmarks.fake_exchange import FakeExchange, FakeExchangeServer
+import order_tracker
+from order_tracker import OrderTracker
+from utils.saved_store import MemoryStore
+
+DEFAULT_SCALES = (10, 100, 1000, 10000)
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), 'baselines', 'cycle.json')
+
+
+@contextlib.contextmanager
+def patched(module, **values):
+    saved = {name: getattr(module, name) for name in values}
+    for name, value in values.items():
+        setattr(module, name, value)
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            setattr(module, name, value)
+
+
+@contextlib.contextmanager
+def fake_exchange_api(url):
+    """Point api_lib at the fake exchange with a fresh session and no rate limit"""
+    with patched(
+        open_positions,
+        APIURL=url,
+        API_KEY='bench-key',
+        API_SECRET='bench-secret',
+        session=open_positions.create_session(),
+        request_budget=RequestBudget(read_rate=0, trade_rate=0),
+    ):
+        yield
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) if values else 0.0
+
+
+def bench_scale(positions, cycles, engine='rows', seed=0, orders_sync='full'):
+    """Run `cycles` tracker cycles against `positions` synthetic positions"""
+    exchange = FakeExchange(positions, seed=seed)
+    latencies = []
+    cpu_times = []
+    with FakeExchangeServer(exchange) as server, fake_exchange_api(server.url), \
+            patched(order_tracker, decision_engine=engine, orders_sync=orders_sync):
+        tracker = OrderTracker(saved_store=MemoryStore())
+        # Keep the per-position and per-request logging out of the measurement
+        log_level = tracker.log.level
+        tracker.log.setLevel(logging.WARNING)
+
+        # Warm up the connection pool and imports
+        tracker.run(re_raise_exception=True)
+        exchange.requests.clear()
+        exchange.orders_sent = 0
+
+        for _ in range(cycles):
+            start, cpu_start = time.perf_counter(), time.process_time()
+            tracker.run(re_raise_exception=True)
+            latencies.append(time.perf_counter() - start)
+            # Includes the fake exchange threads, they run in this process
+            cpu_times.append(time.process_time() - cpu_start)
+        requests = dict(exchange.requests)
+        orders_sent = exchange.orders_sent
+
+        tracemalloc.start()
+        tracker.run(re_raise_exception=True)
+        allocated, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        tracker.log.setLevel(log_level)
+
+    return {
+        'positions': positions,
+        'engine': engine,
+        'orders_sync': orders_sync,
+        'cycles': cycles,
+        'p50': percentile(latencies, 50),
+        'p95': percentile(latencies, 95),
+        'p99': percentile(latencies, 99),
+        'max': max(latencies),
+        'cpu_per_cycle': sum(cpu_times) / cycles,
+        'peak_alloc_bytes': peak,
+        'requests_per_cycle': {endpoint: count / cycles for endpoint, count in sorted(requests.items())},
+        'orders_per_cycle': orders_sent / cycles,
+    }
+
+
+def cycles_for(positions, cycles=None):
+    # Enough cycles for stable percentiles without making 10k positions take minutes
+    return cycles or max(3, min(50, 20000 // positions))
+
+
+def run_benchmarks(scales=DEFAULT_SCALES, cycles=None, engine='rows', orders_sync='full'):
+    return {
+        str(positions): bench_scale(positions, cycles_for(positions, cycles), engine, orders_sync=orders_sync)
+        for positions in scales
+    }
+
+
+def compare(results, baseline, tolerance=0.2):
+    """
+    Regressions of `results` against `baseline`: latency or CPU more than `tolerance`
+    above the baseline, or more requests per cycle
+    """
+    regressions = []
+    for scale, result in results.items():
+        reference = baseline.get(scale)
+        if reference is None:
+            continue
+        for metric in ('p50', 'p95', 'cpu_per_cycle'):
+            if result[metric] > reference[metric] * (1 + tolerance):
+                regressions.append(f"{scale} positions: {metric} {result[metric]:.4f}s > {reference[metric]:.4f}s")
+        for endpoint, count in result['requests_per_cycle'].items():
+            if count > reference['requests_per_cycle'].get(endpoint, 0):
+                regressions.append(
+                    f"{scale} positions: {endpoint} requests {count} > {reference['requests_per_cycle'].get(endpoint, 0)}"
+                )
+    return regressions
+
+
+def format_results(results):
+    lines = [
+        f"{'positions':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'cpu ms':>9} {'peak KiB':>9} "
+        f"{'orders':>9}  requests/cycle"
+    ]
+    for result in results.values():
+        lines.append(
+            f"{result['positions']:>9} {result['p50'] * 1000:>9.1f} {result['p95'] * 1000:>9.1f} "
+            f"{result['p99'] * 1000:>9.1f} {result['cpu_per_cycle'] * 1000:>9.1f} "
+            f"{result['peak_alloc_bytes'] / 1024:>9.0f} {result.get('orders_per_cycle', 0):>9.1f}  "
+            f"{result['requests_per_cycle']}"
+        )
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scales', default=','.join(map(str, DEFAULT_SCALES)))
+    parser.add_argument('--cycles', type=int)
+    parser.add_argument('--engine', choices=('rows', 'vectorized'), default='rows')
+    parser.add_argument('--orders-sync', choices=('full', 'book'), default='full')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save', action='store_true')
+    parser.add_argument('--compare', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks([int(scale) for scale in args.scales.split(',')], args.cycles, args.engine, args.orders_sync)
+    print(format_results(results))
+
+    if args.save:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Saved baseline to {args.baseline}")
+    if args.compare:
+        with open(args.baseline, 'r') as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
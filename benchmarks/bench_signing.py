@@ -0,0 +1,113 @@
+"""
+Throughput of request signing: parameter encoding plus HMAC signature, per request.
+The 'sent' columns add the URL preparation of requests, which every request goes through.
+
+    python -m benchmarks.bench_signing                  # legacy parseParam/get_sign vs the signer
+    python -m benchmarks.bench_signing --requests 50000
+"""
+import argparse
+import hmac
+import json
+import sys
+import time
+from hashlib import sha256
+
+from api_lib.signer import encode_params, get_signer
+
+SECRET = 'bench-secret-' + 'x' * 51
+
+PARAMS = {
+    'fullOrder': {"timestamp": "1700000000000", "limit": 30},
+    'cancelReplace': {
+        "cancelReplaceMode": "STOP_ON_FAILURE", "cancelOrderId": 1736011869418901234, "cancelRestrictions": "ONLY_NEW",
+        "symbol": "BTC-USDT", "side": "SELL", "positionSide": "LONG", "type": "STOP_MARKET",
+        "quantity": 0.0125, "stopPrice": 64123.5,
+    },
+    'batchOrders': {"batchOrders": json.dumps([
+        {"symbol": f"C{i}-USDT", "side": "SELL", "positionSide": "LONG", "type": "STOP_MARKET",
+         "quantity": 1, "stopPrice": 90 + i}
+        for i in range(5)
+    ], separators=(',', ':'))},
+}
+
+
+def legacy_get_sign(api_secret, payload):
+    # api_lib.open_positions.get_sign before the signer
+    return hmac.new(api_secret.encode("utf-8"), payload.encode("utf-8"), digestmod=sha256).hexdigest()
+
+
+def legacy_parse_param(paramsMap):
+    # api_lib.open_positions.parseParam before the signer, appends a timestamp even if one is given
+    sortedKeys = sorted(paramsMap)
+    paramsStr = "&".join(["%s=%s" % (x, paramsMap[x]) for x in sortedKeys])
+    if paramsStr != "":
+        return paramsStr + "&timestamp=" + str(int(time.time() * 1000))
+    return paramsStr + "timestamp=" + str(int(time.time() * 1000))
+
+
+def legacy_request(paramsMap):
+    paramsStr = legacy_parse_param(paramsMap)
+    return "%s&signature=%s" % (paramsStr, legacy_get_sign(SECRET, paramsStr))
+
+
+def signer_request(paramsMap):
+    return get_signer(SECRET).signed_query(encode_params(paramsMap))
+
+
+def sent(function):
+    from requests.models import PreparedRequest
+
+    def request(paramsMap):
+        PreparedRequest().prepare_url(f"https://open-api.example.com/openApi/swap/v1/trade/order?{function(paramsMap)}", None)
+    return request
+
+
+def throughput(function, paramsMap, requests, repeat=3):
+    # Best of `repeat` runs
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(requests):
+            function(paramsMap)
+        best = min(best, time.perf_counter() - start)
+    return requests / best
+
+
+def run_benchmarks(requests):
+    results = {}
+    for name, paramsMap in PARAMS.items():
+        result = {
+            'legacy_per_s': throughput(legacy_request, paramsMap, requests),
+            'signer_per_s': throughput(signer_request, paramsMap, requests),
+            'legacy_sent_per_s': throughput(sent(legacy_request), paramsMap, requests),
+            'signer_sent_per_s': throughput(sent(signer_request), paramsMap, requests),
+        }
+        result['speedup'] = result['signer_per_s'] / result['legacy_per_s']
+        result['sent_speedup'] = result['signer_sent_per_s'] / result['legacy_sent_per_s']
+        results[name] = result
+    return results
+
+
+def format_results(results):
+    lines = [
+        f"{'params':>14} {'legacy/s':>11} {'signer/s':>11} {'speedup':>8}"
+        f" {'legacy sent/s':>14} {'signer sent/s':>14} {'speedup':>8}"
+    ]
+    for name, result in results.items():
+        lines.append(
+            f"{name:>14} {result['legacy_per_s']:>11.0f} {result['signer_per_s']:>11.0f} {result['speedup']:>7.2f}x"
+            f" {result['legacy_sent_per_s']:>14.0f} {result['signer_sent_per_s']:>14.0f} {result['sent_speedup']:>7.2f}x"
+        )
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=20000)
+    args = parser.parse_args(argv)
+    print(format_results(run_benchmarks(args.requests)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
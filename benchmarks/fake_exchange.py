@@ -0,0 +1,206 @@
+import bisect
+import collections
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+
+class FakeExchange:
+    """
+    In-memory exchange state with synthetic positions and their stop/take profit orders.
+    Every call to positions() moves the mark prices a little, so that some positions
+    cross their thresholds from one cycle to the next.
+    """
+
+    def __init__(self, positions=100, seed=0, volatility=0.004):
+        self.rng = random.Random(seed)
+        self.volatility = volatility
+        self.lock = threading.Lock()
+        self.positions = {}
+        self.orders = {}
+        # Order snapshots in updateTime order, for fullOrder with startTime/endTime
+        self.history = []
+        self.next_id = 0
+        self.requests = collections.Counter()
+        # Orders returned by fullOrder and openOrders
+        self.orders_sent = 0
+        for i in range(positions):
+            # Two positions per symbol, one per side, as (symbol, positionSide) is unique on the exchange
+            self.open_position(f"SYM{i // 2}-USDT", 'LONG' if i % 2 == 0 else 'SHORT')
+        # The initial orders were placed before the tracker started
+        placed = int(time.time() * 1000) - 60000
+        for order in self.history:
+            order['time'] = order['updateTime'] = placed
+
+    def new_id(self):
+        self.next_id += 1
+        return str(self.next_id)
+
+    def open_position(self, symbol, positionSide, price=None):
+        price = price or self.rng.uniform(1, 1000)
+        direction = 1 if positionSide == 'LONG' else -1
+        position = {
+            'symbol': symbol,
+            'positionId': self.new_id(),
+            'positionSide': positionSide,
+            'positionAmt': str(round(self.rng.uniform(0.1, 10), 3)),
+            'avgPrice': str(price),
+            'markPrice': str(price),
+        }
+        self.positions[(symbol, positionSide)] = position
+        self.add_order(symbol, positionSide, 'STOP_MARKET', price * (1 - direction * 0.015))
+        self.add_order(symbol, positionSide, 'TAKE_PROFIT', price * (1 + direction * 0.015))
+        return position
+
+    def add_order(self, symbol, positionSide, type, stopPrice):
+        now = int(time.time() * 1000)
+        order = {
+            'orderId': self.new_id(),
+            'symbol': symbol,
+            'positionSide': positionSide,
+            'type': type,
+            'stopPrice': str(stopPrice),
+            'status': 'NEW',
+            'time': now,
+            'updateTime': now,
+        }
+        self.orders[order['orderId']] = order
+        self.history.append(order)
+        return order
+
+    def cancel_order(self, orderId):
+        order = self.orders.pop(orderId, None)
+        if order is not None:
+            self.history.append(dict(order, status='CANCELLED', updateTime=int(time.time() * 1000)))
+        return order
+
+    def handle(self, method, path, params):
+        """Response body for a request to `path`, as api_lib.open_positions expects it"""
+        endpoint = path.rsplit('/', 1)[-1]
+        with self.lock:
+            self.requests[endpoint] += 1
+            handler = getattr(self, f"on_{endpoint}", None)
+            if handler is None:
+                return {'code': 100400, 'msg': f"Unknown endpoint {path}"}
+            return handler(method, params)
+
+    def on_positions(self, method, params):
+        for position in self.positions.values():
+            markPrice = float(position['markPrice']) * (1 + self.rng.gauss(0, self.volatility))
+            position['markPrice'] = str(markPrice)
+        return {'code': 0, 'data': list(self.positions.values())}
+
+    def on_fullOrder(self, method, params):
+        limit = int(params.get('limit', 500))
+        if 'startTime' in params or 'endTime' in params:
+            # The latest `limit` updates in the window, newest first
+            update_time = lambda order: order['updateTime']
+            start = bisect.bisect_left(self.history, int(params.get('startTime', 0)), key=update_time)
+            end = len(self.history)
+            if 'endTime' in params:
+                end = bisect.bisect_right(self.history, int(params['endTime']), key=update_time)
+            orders = self.history[max(start, end - limit):end][::-1]
+        else:
+            orders = list(self.orders.values())[:limit]
+        self.orders_sent += len(orders)
+        return {'code': 0, 'data': {'orders': orders}}
+
+    def on_openOrders(self, method, params):
+        orders = list(self.orders.values())
+        self.orders_sent += len(orders)
+        return {'code': 0, 'data': {'orders': orders}}
+
+    def on_closePosition(self, method, params):
+        for key, position in list(self.positions.items()):
+            if position['positionId'] == params['positionId']:
+                self.remove_orders(*key)
+                # Keep the number of positions constant between cycles
+                self.open_position(*key, price=float(position['markPrice']))
+                return {'code': 0, 'data': {'positionId': params['positionId']}}
+        return {'code': 101205, 'msg': 'No position to close'}
+
+    def remove_orders(self, symbol, positionSide):
+        for orderId, order in list(self.orders.items()):
+            if order['symbol'] == symbol and order['positionSide'] == positionSide:
+                self.cancel_order(orderId)
+
+    def on_cancelReplace(self, method, params):
+        if self.cancel_order(params['cancelOrderId']) is None:
+            return {'code': 109400, 'msg': 'Order not found'}
+        order = self.add_order(params['symbol'], params['positionSide'], params['type'], float(params['stopPrice']))
+        return {'code': 0, 'data': {'newOrderResponse': order}}
+
+    def on_order(self, method, params):
+        order = self.add_order(params['symbol'], params['positionSide'], params['type'], float(params['stopPrice']))
+        return {'code': 0, 'data': {'order': order}}
+
+    def on_batchOrders(self, method, params):
+        orders = [
+            self.add_order(order['symbol'], order['positionSide'], order['type'], float(order['stopPrice']))
+            for order in json.loads(params['batchOrders'])
+        ]
+        return {'code': 0, 'data': {'orders': orders}}
+
+    def on_price(self, method, params):
+        for position in self.positions.values():
+            if position['symbol'] == params['symbol']:
+                return {'code': 0, 'data': {'symbol': params['symbol'], 'price': position['markPrice']}}
+        return {'code': 0, 'data': {'symbol': params['symbol'], 'price': '100'}}
+
+    def on_klines(self, method, params):
+        return {'code': 0, 'data': []}
+
+    def on_userDataStream(self, method, params):
+        return {'listenKey': 'fake-listen-key'}
+
+
+class FakeExchangeHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Buffer the headers and the body into one write, otherwise every keep-alive response waits for a delayed ACK
+    wbufsize = -1
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            self.rfile.read(length)
+        body = self.server.exchange.handle(self.command, url.path, dict(parse_qsl(url.query)))
+        data = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_POST = do_GET
+    do_PUT = do_GET
+    do_DELETE = do_GET
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeExchangeServer:
+    """Serves a FakeExchange over HTTP on a local port from a background thread"""
+
+    def __init__(self, exchange):
+        self.exchange = exchange
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), FakeExchangeHandler)
+        self.server.exchange = exchange
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
@@ -1,6 +1,12 @@
-import pandas as pd
+import math
+from collections import deque
+
 from api_lib.open_positions import get_klines_data_df
 import numpy as np
+from indicators import atr_last, rsi_last
+
+# Running sums are recomputed from the window every so many candles to keep rounding errors bounded
+RESUM_EVERY = 1000
 
 class CoefficientCalculator:
     def __init__(self, atr_period=14, rsi_period=14, threshold=0.01):
@@ -9,23 +15,12 @@ class CoefficientCalculator:
         self.threshold = threshold    # Пороговое значение волатильности
 
     def calculate_atr(self, df):
-        """Расчёт ATR на основе OHLCV данных"""
-        df['tr'] = np.maximum(df['high'] - df['low'], 
-                              np.maximum(abs(df['high'] - df['close'].shift(1)), 
-                                         abs(df['low'] - df['close'].shift(1))))
-        df['atr'] = df['tr'].rolling(self.atr_period).mean()
-        return df['atr'].iloc[-1]  # Возвращаем последнее значение ATR
+        """Расчёт ATR на основе OHLCV данных, df не изменяется"""
+        return float(atr_last(df['high'].to_numpy(), df['low'].to_numpy(), df['close'].to_numpy(), self.atr_period))
 
     def calculate_rsi(self, df):
         """Расчёт RSI на основе цен закрытия"""
-        delta = df['close'].diff()
-        gain = np.where(delta > 0, delta, 0)
-        loss = np.where(delta < 0, -delta, 0)
-        avg_gain = pd.Series(gain).rolling(self.rsi_period).mean()
-        avg_loss = pd.Series(loss).rolling(self.rsi_period).mean()
-        rs = avg_gain / avg_loss
-        rsi = 100 - (100 / (1 + rs))
-        return rsi.iloc[-1]  # Возвращаем последнее значение RSI
+        return float(rsi_last(df['close'].to_numpy(), self.rsi_period))
 
     def calculate_coefficients(self, df, mark_price):
         """
@@ -36,7 +31,31 @@ class CoefficientCalculator:
         """
         atr = self.calculate_atr(df)
         rsi = self.calculate_rsi(df)
+        return self.coefficients_from_indicators(atr, rsi, mark_price)
+
+    def calculate_coefficients_stacked(self, high, low, close, mark_price):
+        """
+        Коэффициенты сразу для многих символов.
+        :param high, low, close: 2-D массивы (символы x свечи)
+        :param mark_price: 1-D массив текущих цен
+        :return: тот же словарь, что и calculate_coefficients, с массивами по символам
+        """
+        atr = atr_last(high, low, close, self.atr_period)
+        rsi = rsi_last(close, self.rsi_period)
+        volatility = atr / np.asarray(mark_price)
+        stop_loss_coefficient = np.where(volatility > self.threshold, 0.15, np.where(rsi > 70, 0.10, 0.20))
+        return {
+            "stop_loss_coefficient": stop_loss_coefficient,
+            "volatility": volatility,
+            "rsi": rsi,
+            "atr": atr
+        }
+
+    def new_indicator_state(self):
+        return IndicatorState(self.atr_period, self.rsi_period)
 
+    def coefficients_from_indicators(self, atr, rsi, mark_price):
+        """Коэффициенты по уже рассчитанным ATR и RSI"""
         # Рассчитываем относительную волатильность
         volatility = atr / mark_price
 
@@ -55,6 +74,99 @@ class CoefficientCalculator:
             "atr": atr
         }
 
+class IndicatorState:
+    """
+    ATR and RSI of a kline stream, updated in O(1) per new candle from rolling windows.
+    The last candle is still forming, it is kept apart and replaced when it is fetched again.
+    atr()/rsi() return the same values as calculate_atr/calculate_rsi on the full frame.
+    """
+
+    def __init__(self, atr_period=14, rsi_period=14):
+        self.trs = deque(maxlen=atr_period)
+        self.gains = deque(maxlen=rsi_period)
+        self.losses = deque(maxlen=rsi_period)
+        self.tr_sum = 0.0
+        self.gain_sum = 0.0
+        self.loss_sum = 0.0
+        self.prev_close = None
+        # (time, high, low, close) of the forming candle
+        self.last_candle = None
+        self.candles = 0
+
+    @property
+    def last_time(self):
+        return None if self.last_candle is None else self.last_candle[0]
+
+    def update(self, candles):
+        """Apply (time, high, low, close) candles sorted by time, older candles than the forming one are ignored"""
+        for candle in candles:
+            if self.last_candle is not None:
+                if candle[0] < self.last_candle[0]:
+                    continue
+                if candle[0] > self.last_candle[0]:
+                    self.commit(self.last_candle)
+            self.last_candle = candle
+
+    def commit(self, candle):
+        tr, gain, loss = self.candle_values(candle)
+        if tr is not None:
+            self.tr_sum = self.push(self.trs, self.tr_sum, tr)
+        self.gain_sum = self.push(self.gains, self.gain_sum, gain)
+        self.loss_sum = self.push(self.losses, self.loss_sum, loss)
+        self.prev_close = candle[3]
+
+        self.candles += 1
+        if self.candles % RESUM_EVERY == 0:
+            self.tr_sum = math.fsum(self.trs)
+            self.gain_sum = math.fsum(self.gains)
+            self.loss_sum = math.fsum(self.losses)
+
+    def candle_values(self, candle):
+        # True range, gain and loss against the previous close, the first candle has no true range
+        _, high, low, close = candle
+        if self.prev_close is None:
+            return None, 0.0, 0.0
+        tr = max(high - low, abs(high - self.prev_close), abs(low - self.prev_close))
+        delta = close - self.prev_close
+        return tr, max(delta, 0.0), max(-delta, 0.0)
+
+    @staticmethod
+    def push(window, total, value):
+        if len(window) == window.maxlen:
+            total -= window[0]
+        window.append(value)
+        return total + value
+
+    @staticmethod
+    def window_sum(window, total, value):
+        # Sum of the window once the forming candle's value is appended, None while it is too short
+        if len(window) + 1 < window.maxlen:
+            return None
+        if len(window) == window.maxlen:
+            total -= window[0]
+        return total + value
+
+    def atr(self):
+        if self.last_candle is None:
+            return np.nan
+        tr, _, _ = self.candle_values(self.last_candle)
+        total = None if tr is None else self.window_sum(self.trs, self.tr_sum, tr)
+        return np.nan if total is None else total / self.trs.maxlen
+
+    def rsi(self):
+        if self.last_candle is None:
+            return np.nan
+        _, gain, loss = self.candle_values(self.last_candle)
+        gain_total = self.window_sum(self.gains, self.gain_sum, gain)
+        loss_total = self.window_sum(self.losses, self.loss_sum, loss)
+        if gain_total is None:
+            return np.nan
+        if loss_total == 0:
+            return 100.0 if gain_total > 0 else np.nan
+        rs = gain_total / loss_total
+        return 100 - (100 / (1 + rs))
+
+
 # Пример использования
 if __name__ == "__main__":
     calculator = CoefficientCalculator()
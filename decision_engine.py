@@ -0,0 +1,66 @@
+
+ACTION_NONE = 0
+ACTION_CLOSE = 1
+ACTION_UPDATE_STOP_LOSS = 2
+
+# Same factors as OrderTracker.process_short_position / process_long_position
+SHORT_STOP_FACTOR = 0.35
+LONG_STOP_FACTOR = 0.5
+LONG_PROFIT_FACTOR = 0.5
+SL_ADJUSTMENT = 0.12
+
+
+def evaluate_positions(is_short, markPrice, avgPrice, stopPrice, take_profit_price, saved_markPrice,
+                       sl_adjustment=SL_ADJUSTMENT, short_stop_factor=SHORT_STOP_FACTOR,
+                       long_stop_factor=LONG_STOP_FACTOR, long_profit_factor=LONG_PROFIT_FACTOR):
+    """
+    Vectorized close/trail decisions for many positions at once.
+    All arguments are 1-D arrays of the same length, saved_markPrice is NaN where
+    the position has no saved entry. sl_adjustment and the threshold factors are
+    scalars or per-position arrays.
+    :return: (actions, new_sl_price) - action codes and the new stop loss for
+             ACTION_UPDATE_STOP_LOSS rows (NaN elsewhere)
+    """
+    # NumPy is only loaded by the vectorized engine
+    import numpy as np
+
+    is_short = np.asarray(is_short, dtype=bool)
+    markPrice = np.asarray(markPrice, dtype=np.float64)
+    avgPrice = np.asarray(avgPrice, dtype=np.float64)
+    stopPrice = np.asarray(stopPrice, dtype=np.float64)
+    take_profit_price = np.asarray(take_profit_price, dtype=np.float64)
+    saved_markPrice = np.asarray(saved_markPrice, dtype=np.float64)
+    sl_adjustment = np.asarray(sl_adjustment, dtype=np.float64)
+    has_saved = ~np.isnan(saved_markPrice)
+
+    with np.errstate(invalid='ignore'):
+        # SHORT: close above the threshold, trail while below avgPrice and below the saved markPrice
+        short_threshold = avgPrice + (stopPrice - avgPrice) * short_stop_factor
+        short_close = (markPrice > avgPrice) & (markPrice > short_threshold)
+        short_update = (
+            ~short_close
+            & (markPrice < avgPrice)
+            & (~has_saved | (markPrice < saved_markPrice))
+        )
+        short_sl = markPrice + (markPrice - take_profit_price) * sl_adjustment
+
+        # LONG: close below the threshold, set the stop loss once above profitThreshold
+        long_threshold = avgPrice - (avgPrice - stopPrice) * long_stop_factor
+        profit_threshold = avgPrice + (take_profit_price - avgPrice) * long_profit_factor
+        long_close = (markPrice < avgPrice) & (markPrice < long_threshold)
+        long_update = (
+            ~long_close
+            & (markPrice > avgPrice)
+            & (markPrice > profit_threshold)
+            & ~has_saved
+        )
+        long_sl = markPrice - (take_profit_price - markPrice) * sl_adjustment
+
+    close = np.where(is_short, short_close, long_close)
+    update = np.where(is_short, short_update, long_update)
+
+    actions = np.full(markPrice.shape, ACTION_NONE, dtype=np.int8)
+    actions[update] = ACTION_UPDATE_STOP_LOSS
+    actions[close] = ACTION_CLOSE
+    new_sl_price = np.where(update, np.where(is_short, short_sl, long_sl), np.nan)
+    return actions, new_sl_price
@@ -0,0 +1,82 @@
+"""
+Last values of ATR and RSI from NumPy arrays of high/low/close prices.
+Arrays are either 1-D (one symbol) or 2-D stacked (symbols x candles, oldest candle first),
+float32 and float64 inputs are used as they are. Only the last `period` + 1 candles are read,
+the inputs are never written to.
+"""
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+def as_prices(values):
+    values = np.asarray(values)
+    if values.dtype not in (np.float32, np.float64):
+        values = values.astype(np.float64)
+    return values
+
+
+def atr_last(high, low, close, period=14):
+    """Mean true range of the last `period` candles, NaN when there are not `period` + 1 candles"""
+    high, low, close = as_prices(high), as_prices(low), as_prices(close)
+    if close.shape[-1] < period + 1:
+        return np.full(close.shape[:-1], np.nan, dtype=close.dtype)[()]
+
+    prev_close = close[..., -period - 1:-1]
+    high = high[..., -period:]
+    low = low[..., -period:]
+    tr = high - low
+    np.maximum(tr, np.abs(high - prev_close), out=tr)
+    np.maximum(tr, np.abs(low - prev_close), out=tr)
+    return tr.mean(axis=-1)[()]
+
+
+def rsi_last(close, period=14):
+    """
+    RSI of the last `period` price changes with simple averages, NaN when there are
+    fewer than `period` candles. The change before the first candle counts as 0.
+    """
+    close = as_prices(close)
+    count = close.shape[-1]
+    if count < period:
+        return np.full(close.shape[:-1], np.nan, dtype=close.dtype)[()]
+
+    delta = np.diff(close[..., -min(count, period + 1):], axis=-1)
+    gain = np.where(delta > 0, delta, 0).sum(axis=-1)
+    loss = np.where(delta < 0, -delta, 0).sum(axis=-1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rs = gain / loss
+        return (100 - (100 / (1 + rs)))[()]
+
+
+def atr_series(high, low, close, period=14):
+    """atr_last for every candle along the last axis, NaN for the first `period` candles"""
+    high, low, close = as_prices(high), as_prices(low), as_prices(close)
+    out = np.full(close.shape, np.nan, dtype=close.dtype)
+    if close.shape[-1] < period + 1:
+        return out
+
+    # tr[..., k] is the true range of candle k + 1
+    prev_close = close[..., :-1]
+    high = high[..., 1:]
+    low = low[..., 1:]
+    tr = high - low
+    np.maximum(tr, np.abs(high - prev_close), out=tr)
+    np.maximum(tr, np.abs(low - prev_close), out=tr)
+    out[..., period:] = sliding_window_view(tr, period, axis=-1).mean(axis=-1)
+    return out
+
+
+def rsi_series(close, period=14):
+    """rsi_last for every candle along the last axis, NaN for the first `period` - 1 candles"""
+    close = as_prices(close)
+    out = np.full(close.shape, np.nan, dtype=close.dtype)
+    if close.shape[-1] < period:
+        return out
+
+    delta = np.zeros_like(close)
+    delta[..., 1:] = np.diff(close, axis=-1)
+    gain = sliding_window_view(np.where(delta > 0, delta, 0), period, axis=-1).sum(axis=-1)
+    loss = sliding_window_view(np.where(delta < 0, -delta, 0), period, axis=-1).sum(axis=-1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        out[..., period - 1:] = 100 - (100 / (1 + gain / loss))
+    return out
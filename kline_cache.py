@@ -0,0 +1,145 @@
+import contextvars
+import math
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+
+from api_lib.open_positions import HTTP_POOL_SIZE, get_klines_data
+from coefficient_calculator import CoefficientCalculator
+from utils.log_config import logging_config
+
+load_dotenv()
+# Candles fetched the first time a (symbol, interval) is seen
+kline_backfill = int(os.getenv('KLINE_BACKFILL', 1000))
+# Page size of the incremental requests
+kline_page_limit = int(os.getenv('KLINE_PAGE_LIMIT', 500))
+
+INTERVAL_UNITS = {'m': 60, 'h': 3600, 'd': 86400, 'w': 604800, 'M': 2592000}
+
+
+def interval_seconds(interval):
+    """'5m' -> 300, '4h' -> 14400"""
+    return int(interval[:-1]) * INTERVAL_UNITS[interval[-1]]
+
+
+def parse_klines(response):
+    """(time, high, low, close) tuples sorted by time"""
+    return sorted(
+        (int(kline['time']), float(kline['high']), float(kline['low']), float(kline['close']))
+        for kline in response['data']
+    )
+
+
+class KlineCache:
+    """
+    Indicator state per (symbol, interval). The first update backfills KLINE_BACKFILL
+    candles, later updates only fetch the candles from the forming one on with startTime.
+    """
+
+    def __init__(self, calculator=None, backfill=None, page_limit=None):
+        self.calculator = calculator or CoefficientCalculator()
+        self.backfill = backfill or kline_backfill
+        self.page_limit = page_limit or kline_page_limit
+        self.states = {}
+        self.requests = 0
+        self.log = logging_config()
+        self.m = "Kline cache: "
+
+    def fetch(self, symbol, interval, limit, startTime=None):
+        self.requests += 1
+        response = get_klines_data(symbol, interval, limit, startTime=startTime)
+        if response.get('code') != 0:
+            self.log.error(f"{self.m}Failed to fetch {symbol} {interval} klines: {response}")
+            return []
+        return parse_klines(response)
+
+    def update(self, symbol, interval):
+        key = (symbol, interval)
+        state = self.states.get(key)
+        if state is None or state.last_time is None:
+            state = self.calculator.new_indicator_state()
+            state.update(self.fetch(symbol, interval, self.backfill))
+            self.states[key] = state
+            return state
+
+        while True:
+            startTime = state.last_time
+            candles = self.fetch(symbol, interval, self.page_limit, startTime=startTime)
+            state.update(candles)
+            # A full page means more candles after it, e.g. after a long pause
+            if len(candles) < self.page_limit or state.last_time == startTime:
+                return state
+
+    def coefficients(self, symbol, interval, mark_price):
+        state = self.update(symbol, interval)
+        return self.calculator.coefficients_from_indicators(state.atr(), state.rsi(), mark_price)
+
+
+class CoefficientCache:
+    """
+    Coefficients per symbol, computed at most once per kline interval. refresh() updates
+    the expired symbols concurrently, positions on the same symbol share one entry.
+    """
+
+    def __init__(self, kline_cache=None, interval='5m', ttl=None, max_workers=None):
+        self.kline_cache = kline_cache or KlineCache()
+        self.interval = interval
+        self.ttl = interval_seconds(interval) if ttl is None else ttl
+        self.max_workers = max_workers or HTTP_POOL_SIZE
+        # symbol -> (expires, coefficients)
+        self.entries = {}
+        self.log = self.kline_cache.log
+        self.m = "Coefficient cache: "
+
+    def get(self, symbol):
+        entry = self.entries.get(symbol)
+        return None if entry is None else entry[1]
+
+    def refresh(self, mark_prices):
+        """
+        :param mark_prices: {symbol: markPrice} of the open positions
+        :return: number of symbols computed
+        """
+        now = time.monotonic()
+        expired = [
+            symbol for symbol in mark_prices
+            if symbol not in self.entries or self.entries[symbol][0] <= now
+        ]
+        if not expired:
+            return 0
+
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(expired))) as executor:
+            # Klines are signed with the credentials of the caller
+            futures = [
+                (symbol, executor.submit(contextvars.copy_context().run, self.compute, symbol, mark_prices[symbol]))
+                for symbol in expired
+            ]
+            expires = time.monotonic() + self.ttl
+            for symbol, future in futures:
+                coefficients = future.result()
+                # Failed symbols keep their last coefficients and are retried next time
+                if coefficients is not None:
+                    self.entries[symbol] = (expires, coefficients)
+        return len(expired)
+
+    def compute(self, symbol, mark_price):
+        try:
+            coefficients = self.kline_cache.coefficients(symbol, self.interval, mark_price)
+        except Exception as e:
+            self.log.error(f"{self.m}Failed to compute coefficients for {symbol}: {e}")
+            return None
+        if math.isnan(coefficients['atr']):
+            self.log.error(f"{self.m}Not enough {self.interval} klines for {symbol}")
+            return None
+        return coefficients
+
+    def prune(self, symbols):
+        """Forget symbols without open positions, klines included"""
+        symbols = set(symbols)
+        for symbol in set(self.entries) - symbols:
+            del self.entries[symbol]
+        for symbol, interval in list(self.kline_cache.states):
+            if interval == self.interval and symbol not in symbols:
+                del self.kline_cache.states[(symbol, interval)]
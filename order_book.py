@@ -0,0 +1,141 @@
+import os
+import time
+
+from dotenv import load_dotenv
+
+from api_lib.open_positions import get_all_open_orders, get_full_orders
+from records import Order
+from utils.log_config import logging_config
+
+load_dotenv()
+# Orders per fullOrder page of an incremental sync
+order_book_page_limit = int(os.getenv('ORDER_BOOK_PAGE_LIMIT', 500))
+# Syncs between two full reloads of the open orders, which catch changes the history does not show
+order_book_full_sync_every = int(os.getenv('ORDER_BOOK_FULL_SYNC_EVERY', 60))
+# Milliseconds the first incremental sync after a reload reaches back, for the skew of our clock
+order_book_overlap = int(os.getenv('ORDER_BOOK_OVERLAP', 1000))
+
+CLOSED_STATUSES = ('CANCELLED', 'CANCELED', 'FILLED', 'EXPIRED', 'REJECTED')
+
+
+def update_time(order):
+    return int(order.get('updateTime') or order.get('time') or 0)
+
+
+def order_key(orderId):
+    # orderIds come back as int or str depending on the endpoint
+    return str(orderId)
+
+
+class OrderBook:
+    """
+    Open orders of the account keyed by orderId. The first sync loads every open order,
+    later syncs only page through the orders updated since the last one (startTime cursor),
+    so a cycle transfers the changes instead of the order list. Our own stop order changes
+    are applied from their responses with add()/remove().
+
+    fullOrder returns the newest updates first: a sync pages backwards from now with endTime
+    until it reaches the cursor, and applies the updates oldest first once all pages arrived.
+    """
+
+    def __init__(self, page_limit=None, full_sync_every=None, overlap=None, max_pages=20):
+        self.page_limit = page_limit or order_book_page_limit
+        self.full_sync_every = order_book_full_sync_every if full_sync_every is None else full_sync_every
+        self.overlap = order_book_overlap if overlap is None else overlap
+        self.max_pages = max_pages
+        self.orders = {}
+        # updateTime (ms) the next incremental sync starts from, None until the first full sync
+        self.cursor = None
+        self.syncs_since_full = 0
+        self.needs_full_sync = True
+        self.requests = 0
+        # Orders received by the last sync
+        self.transferred = 0
+        self.log = logging_config()
+        self.m = "Order book: "
+
+    def open_orders(self):
+        return list(self.orders.values())
+
+    def add(self, order):
+        self.orders[order_key(order['orderId'])] = order
+
+    def remove(self, orderId):
+        self.orders.pop(order_key(orderId), None)
+
+    def invalidate(self):
+        """Reload every open order on the next sync, e.g. after changes we cannot follow"""
+        self.needs_full_sync = True
+
+    def apply(self, order):
+        if order.get('status') in CLOSED_STATUSES:
+            self.remove(order['orderId'])
+        else:
+            self.add(Order.from_dict(order))
+
+    def sync(self):
+        if self.needs_full_sync or self.cursor is None or self.syncs_since_full >= self.full_sync_every:
+            self.full_sync()
+        else:
+            self.incremental_sync()
+        return self.open_orders()
+
+    def full_sync(self):
+        # Stays invalid until the reload succeeded
+        self.needs_full_sync = True
+        started = int(time.time() * 1000)
+        orders = self.fetch(get_all_open_orders)
+        self.orders = {}
+        for order in orders:
+            self.apply(order)
+        self.transferred = len(orders)
+        # Later changes have an exchange updateTime after the reload, our clock may be off by the overlap
+        self.cursor = started - self.overlap
+        self.syncs_since_full = 0
+        self.needs_full_sync = False
+
+    def incremental_sync(self):
+        # startTime and endTime are inclusive, updates in the millisecond of a bound are fetched again
+        startTime = self.cursor
+        endTime = None
+        updates = []
+        self.transferred = 0
+        for _ in range(self.max_pages):
+            params = {'limit': self.page_limit, 'startTime': startTime}
+            if endTime is not None:
+                params['endTime'] = endTime
+            orders = self.fetch(get_full_orders, **params)
+            updates.extend(orders)
+            self.transferred += len(orders)
+            # A full page means older updates before it
+            if len(orders) < self.page_limit:
+                break
+            oldest_update = min(update_time(order) for order in orders)
+            if endTime is not None and oldest_update >= endTime:
+                # A page of updates within one millisecond, endTime cannot move past it
+                self.log.warning(f"{self.m}Cannot page past {endTime}, reloading the open orders")
+                self.full_sync()
+                return
+            endTime = oldest_update
+        else:
+            self.log.warning(f"{self.m}More than {self.max_pages} pages of updates, reloading the open orders")
+            self.full_sync()
+            return
+        # Oldest update first, so the latest state of an order wins. sort is stable,
+        # within a millisecond the exchange order (newest first) is reversed
+        updates.reverse()
+        updates.sort(key=update_time)
+        for order in updates:
+            self.apply(order)
+        if updates:
+            # Exchange time of the newest update seen, the next sync continues from there
+            self.cursor = max(self.cursor, update_time(updates[-1]))
+        self.syncs_since_full += 1
+
+    def fetch(self, request, **params):
+        self.requests += 1
+        response = request(**params)
+        if response.get('code') != 0:
+            self.needs_full_sync = True
+            raise RuntimeError(f"{self.m}Failed to fetch orders: {response}")
+        return list(response['data']['orders'])
@@ -1,15 +1,12 @@
-import json
-import pandas as pd
-import os
-import sys
 import time
+# Start of the imports, for the startup timing of single-shot runs
+import_started = time.perf_counter()
+import argparse
+import contextlib
+import hashlib
+import os
 import traceback
 
-try:
-    import redis
-except ImportError:
-    redis = None
-    
 from dotenv import load_dotenv
 
 from api_lib.open_positions import (
@@ -18,88 +15,337 @@ from api_lib.open_positions import (
     get_full_orders,
     cancel_and_set_new,
     create_stop_order,
+    api_request_seconds,
+    get_credentials,
+    get_rate_limit_stats,
+    submit_stop_orders,
+    use_credentials,
 )
 
+from order_book import OrderBook
+from decision_engine import ACTION_CLOSE, ACTION_NONE, ACTION_UPDATE_STOP_LOSS, SL_ADJUSTMENT, evaluate_positions
+from records import Order, Position, SavedEntry, to_frame
+from scheduler import CycleScheduler
+from utils import metrics
 from utils.log_config import logging_config
+from utils.saved_store import RedisHashStore, SavedLocallyJournal, entry_key
 
 load_dotenv()
 sleep_interval = int(os.getenv('SLEEP_INTERVAL', 60))
+saved_locally_file = os.getenv('SAVED_LOCALLY_FILE', 'saved_locally.json')
+saved_locally_compact_every = int(os.getenv('SAVED_LOCALLY_COMPACT_EVERY', 500))
+saved_locally_redis_key = os.getenv('SAVED_LOCALLY_REDIS_KEY', 'saved_locally:positions')
+saved_locally_retention = int(os.getenv('SAVED_LOCALLY_RETENTION', 86400))
+saved_locally_gc_every = int(os.getenv('SAVED_LOCALLY_GC_EVERY', 60))
+# 'auto' uses Redis when it is reachable and the file otherwise, 'file' never connects to Redis, 'redis' requires it
+saved_locally_backend = os.getenv('SAVED_LOCALLY_BACKEND', 'auto')
+# 'rows' evaluates positions one by one, 'vectorized' decides for all positions in one NumPy pass
+decision_engine = os.getenv('DECISION_ENGINE', 'rows')
+# 'each' sends a stop-loss change as soon as it is decided, 'batch' sends all changes of a cycle together
+stop_loss_dispatch = os.getenv('STOP_LOSS_DISPATCH', 'each')
+# 'fixed' trails the stop loss by SL_ADJUSTMENT, 'adaptive' by the stop_loss_coefficient of CoefficientCalculator
+trailing_mode = os.getenv('TRAILING_MODE', 'fixed')
+adaptive_kline_interval = os.getenv('ADAPTIVE_KLINE_INTERVAL', '5m')
+# 'skip' or 'coalesce' the cycles missed while a cycle overran
+schedule_overrun = os.getenv('SCHEDULE_OVERRUN', 'skip')
+# Seconds between cycles that only evaluate positions near a threshold, 0 disables them
+near_interval = float(os.getenv('NEAR_INTERVAL', 0))
+# Distance of markPrice to the no-action range of a position, as a share of markPrice, that counts as near
+near_threshold_distance = float(os.getenv('NEAR_THRESHOLD_DISTANCE', 0.002))
+# 'full' fetches the last 30 orders every cycle, 'book' keeps an order book of all open orders
+# and only fetches the orders updated since the last cycle
+orders_sync = os.getenv('ORDERS_SYNC', 'full')
+# Port of the Prometheus metrics endpoint in loop mode, 0 disables it
+metrics_port = int(os.getenv('METRICS_PORT', 0))
+metrics_host = os.getenv('METRICS_HOST', '127.0.0.1')
+
+cycle_seconds = metrics.histogram('order_tracker_cycle_seconds', 'Duration of a tracker cycle')
+cycle_api_seconds = metrics.histogram(
+    'order_tracker_cycle_api_seconds', 'Time spent in exchange requests during a cycle, summed over threads',
+)
+cycle_compute_seconds = metrics.histogram(
+    'order_tracker_cycle_compute_seconds', 'Cycle time outside of exchange requests (pandas, decisions, storage)',
+)
+cycle_overruns = metrics.counter('order_tracker_cycle_overruns_total', 'Cycles that took longer than SLEEP_INTERVAL')
+cycle_errors = metrics.counter('order_tracker_cycle_errors_total', 'Cycles that ended with an exception')
+phase_seconds = metrics.histogram('order_tracker_phase_seconds', 'Duration of the steps of a cycle', ('phase',))
+position_seconds = metrics.histogram(
+    'order_tracker_process_position_seconds', 'Duration of a process_position call',
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+position_decisions = metrics.counter('order_tracker_decisions_total', 'Decisions taken for positions', ('decision',))
+positions_skipped = metrics.counter('order_tracker_positions_skipped_total', 'Unchanged positions that were not evaluated')
+positions_open = metrics.gauge('order_tracker_open_positions', 'Open positions in the last cycle')
+
+def connect_redis(log, m=""):
+    try:
+        # Imported on demand, it is one of the slowest imports and often not used
+        import redis
+    except ImportError:
+        return None
+    try:
+        redis_client = redis.Redis(
+            host=os.getenv('REDIS_HOST'), port=os.getenv('REDIS_PORT')
+        )
+        redis_client.ping()
+        log.info(f"{m}Connected to Redis")
+        return redis_client
+    except redis.RedisError as e:
+        log.error(f"{m}Redis error: {e}")
+        return None
+    except (TypeError, ValueError) as e:
+        # REDIS_PORT missing or not a number
+        log.error(f"{m}Invalid Redis settings: {e}")
+        return None
+
+def start_metrics_endpoint(log, m=""):
+    if not metrics_port:
+        return None
+    server = metrics.start_metrics_server(metrics_port, metrics_host)
+    log.info(f"{m}Serving metrics on http://{metrics_host}:{metrics_port}/metrics")
+    return server
+
+def create_scheduler(order_manager):
+    """Full cycles every SLEEP_INTERVAL seconds, near-threshold cycles every NEAR_INTERVAL seconds in between"""
+    scheduler = CycleScheduler(overrun=schedule_overrun, log=order_manager.log)
+    scheduler.add('cycle', sleep_interval, order_manager.run, supersedes=('near',) if near_interval else ())
+    if near_interval:
+        scheduler.add('near', near_interval, lambda: order_manager.run(near_only=True))
+    return scheduler
+
+def store_owner(api_key):
+    """Short id of an API key, tags the entries of its tracker in a shared Redis hash"""
+    return hashlib.sha256(str(api_key).encode('utf-8')).hexdigest()[:16]
+
+def account_file_path(path, account_name):
+    root, ext = os.path.splitext(path)
+    return f"{root}_{account_name}{ext}"
 
 class OrderTracker:
-    def __init__(self):
+    def __init__(self, account=None, redis_client=None, saved_store=None):
+        """
+        :param account: optional {'name', 'api_key', 'api_secret'} to track a sub-account
+                        with its own credentials and its own saved_locally namespace
+        :param redis_client: connected client to share between trackers, connects on its own when None
+        :param saved_store: store for saved_locally instead of Redis or the file, no Redis connection is made
+        """
+        self.account = account
         self.run_with_mark = None
-        self.open_orders = None
-        self.open_positions = None
+        # Core state as records, open_orders/open_positions/saved_locally are DataFrame views of it
+        self.order_records = None
+        self.position_records = None
+        self.saved_entries = {}
+        self.orders_index = None
+        # positionId -> (inputs, no-action markPrice range) of the last cycle that did nothing
+        self.position_snapshots = {}
+        self.skipped_positions = 0
+        # Our own requests changed the open orders since they were fetched
+        self.orders_stale = False
+        # Open orders by orderId in the 'book' orders sync
+        self.order_book = OrderBook() if orders_sync == 'book' else None
+        # (position, new_sl_price, stop_order, markPrice) decided in the current cycle, None when sent right away
+        self.pending_stop_losses = None
+        # Per-symbol coefficients of the adaptive trailing mode
+        self.coefficient_cache = None
+        if trailing_mode == 'adaptive':
+            from kline_cache import CoefficientCache
+            self.coefficient_cache = CoefficientCache(interval=adaptive_kline_interval)
         
         # Initialize logging
         self.log = logging_config()
-        self.m = "Order tracking: "
-
-        # Initialize Redis if available
-        self.redis_client = None
-        if redis:
-            try:
-                self.redis_client = redis.Redis(
-                    host=os.getenv('REDIS_HOST'), port=os.getenv('REDIS_PORT')
-                )
-                self.redis_client.ping()
-                self.log.info(f"{self.m}Connected to Redis")
-            except redis.RedisError as e:
-                self.log.error(f"{self.m}Redis error: {e}")
-                self.redis_client = None
-
-        # Load saved_locally data
-        self.saved_locally = self.load_saved_locally()
-
-    def load_saved_locally(self):
+        self.m = "Order tracking: " if account is None else f"Order tracking [{account['name']}]: "
+
+        # Redis and the saved_locally store are set up when a cycle first needs them,
+        # a run without open positions does not touch them
+        self.redis_client = redis_client
+        self.store = saved_store
+        self.saved_changes = {}
+        self.cycles_since_store_gc = 0
+        self.saved_entries_loaded = False
+
+    @property
+    def saved_store(self):
+        if self.store is None:
+            self.store = self.open_saved_store()
+        return self.store
+
+    @saved_store.setter
+    def saved_store(self, store):
+        self.store = store
+
+    def open_saved_store(self):
+        redis_key = saved_locally_redis_key
+        snapshot_path = saved_locally_file
+        if self.account is not None:
+            redis_key = f"{redis_key}:{self.account['name']}"
+            snapshot_path = account_file_path(snapshot_path, self.account['name'])
+        if self.redis_client is None and saved_locally_backend != 'file':
+            self.redis_client = connect_redis(self.log, self.m)
+            if self.redis_client is None and saved_locally_backend == 'redis':
+                raise RuntimeError("SAVED_LOCALLY_BACKEND is redis but Redis is not available")
         if self.redis_client:
-            # Load from Redis
-            saved_data = self.redis_client.get('saved_locally')
-            if saved_data:
-                data = json.loads(saved_data)
-                return pd.DataFrame(data)
-            else:
-                return pd.DataFrame()
-        else:
-            # Load from JSON file
-            if os.path.exists('saved_locally.json'):
-                with open('saved_locally.json', 'r') as f:
-                    return pd.read_json(f)
-            else:
-                return pd.DataFrame()
+            api_key = self.account['api_key'] if self.account is not None else get_credentials()[0]
+            return RedisHashStore(self.redis_client, redis_key, owner=store_owner(api_key))
+        return SavedLocallyJournal(snapshot_path, compact_every=saved_locally_compact_every)
+
+    @property
+    def open_positions(self):
+        """Open positions as a DataFrame, built on access"""
+        return None if self.position_records is None else to_frame(self.position_records)
+
+    @open_positions.setter
+    def open_positions(self, positions):
+        self.position_records = None if positions is None else Position.from_rows(positions)
+
+    @property
+    def open_orders(self):
+        """Open orders as a DataFrame, built on access"""
+        return None if self.order_records is None else to_frame(self.order_records)
+
+    @open_orders.setter
+    def open_orders(self, orders):
+        self.order_records = None if orders is None else Order.from_rows(orders)
+
+    @property
+    def saved_locally(self):
+        """Saved entries as a DataFrame, built on access"""
+        return to_frame(self.saved_entries.values())
+
+    @saved_locally.setter
+    def saved_locally(self, entries):
+        saved_entries = {}
+        for entry in SavedEntry.from_rows(entries):
+            saved_entries.setdefault(entry_key(entry.positionId), entry)
+        self.saved_entries = saved_entries
+        self.saved_entries_loaded = True
+
+    def account_credentials(self):
+        if self.account is None:
+            return contextlib.nullcontext()
+        return use_credentials(self.account['api_key'], self.account['api_secret'])
+
+    def load_saved_locally(self, positionIds=None):
+        # Redis: HMGET of the given positions, file: JSON snapshot with the journal replayed
+        return self.saved_store.load_entries(positionIds)
 
     def save_saved_locally(self):
-        if self.redis_client:
-            # Save to Redis
-            self.redis_client.set('saved_locally', self.saved_locally.to_json())
-        else:
-            # Save to JSON file
-            with open('saved_locally.json', 'w') as f:
-                self.saved_locally.to_json(f)
+        if not self.saved_changes:
+            # Nothing was updated or removed this cycle
+            return
+        # Redis: HSET/HDEL of the changed positions, file: append to the journal.
+        # The whole table is only built when the journal is compacted
+        self.saved_store.save(self.saved_entry_dicts, self.saved_changes)
+        self.saved_changes = {}
+
+    def saved_entry_dicts(self):
+        return [entry.to_dict() for entry in self.saved_entries.values()]
+
+    def sync_saved_locally(self):
+        """Bring saved_locally in line with the freshly fetched open_positions"""
+        if not self.position_records:
+            # Nothing to decide, the store is not opened for it
+            if self.store is not None and self.store.shared:
+                self.saved_locally = []
+            return
+        if self.saved_store.shared:
+            # A shared store is read per cycle for the open positions only
+            positionIds = [position.positionId for position in self.position_records]
+            self.saved_locally = self.load_saved_locally(positionIds)
+        elif not self.saved_entries_loaded:
+            self.saved_locally = self.load_saved_locally()
+        self.collect_stale_saved_entries()
+
+    def collect_stale_saved_entries(self):
+        """
+        Drop saved_locally entries of positions that are no longer open on the exchange
+        and were last updated more than SAVED_LOCALLY_RETENTION seconds ago.
+        """
+        # get_open_positions_demo returns an empty frame on request errors as well,
+        # so an empty position list is not trusted for reconciliation
+        if not self.position_records:
+            return
+
+        open_keys = {entry_key(position.positionId) for position in self.position_records}
+        cutoff = int((time.time() - saved_locally_retention) * 1000)
+
+        # Entries without a time count as expired
+        stale = [
+            key for key, entry in self.saved_entries.items()
+            if key not in open_keys and not (entry.time is not None and entry.time >= cutoff)
+        ]
+        if stale:
+            for key in stale:
+                del self.saved_entries[key]
+                self.saved_changes[key] = None
+            self.log.info(f"{self.m}Removed {len(stale)} stale saved entries")
+
+        # A shared store only holds the open positions locally, sweep it from time to time
+        if self.saved_store.shared:
+            self.cycles_since_store_gc += 1
+            if self.cycles_since_store_gc >= saved_locally_gc_every:
+                self.cycles_since_store_gc = 0
+                removed = self.saved_store.collect_stale(open_keys, cutoff)
+                if removed:
+                    self.log.info(f"{self.m}Removed {len(removed)} stale saved entries from Redis")
 
     def get_open_positions(self):
-        return get_open_positions_demo()
+        return Position.from_rows(get_open_positions_demo(as_frame=False))
 
     def get_open_orders(self):
+        if self.order_book is not None:
+            return self.attach_position_ids(self.order_book.sync())
         response = get_full_orders(limit=30)
-        orders = response['data']['orders']
+        return self.parse_open_orders(response)
 
-        # Attach positionId to orders
-        open_positions = self.open_positions
-        if len(orders) > 0 and open_positions.shape[0] > 0:
-            for order in orders:
-                filtered_position = open_positions[
-                    (open_positions['symbol'] == order['symbol'])
-                    & (open_positions['positionSide'] == order['positionSide'])
-                ]
-                if not filtered_position.empty:
-                    order['positionId'] = filtered_position.iloc[0]['positionId']
+    def parse_open_orders(self, response):
+        return self.attach_position_ids(self.orders_from_response(response))
 
-        df = pd.DataFrame(orders)
-        if df.shape[0] > 0:
-            df = df[(df['status'] != 'CANCELLED') & (df['status'] != 'FILLED')]
+    def orders_from_response(self, response):
+        return [
+            Order.from_dict(order) for order in response['data']['orders']
+            if order['status'] not in ('CANCELLED', 'FILLED')
+        ]
 
-        return df
+    def attach_position_ids(self, orders):
+        # Attach positionId to orders
+        if orders and self.position_records:
+            position_ids = self.build_position_ids_index(self.position_records)
+            for order in orders:
+                key = (order.symbol, order.positionSide)
+                if key in position_ids:
+                    order.positionId = position_ids[key]
+
+        return orders
+
+    def build_position_ids_index(self, positions):
+        """Map (symbol, positionSide) to the positionId of the first matching position"""
+        position_ids = {}
+        for position in positions:
+            position_ids.setdefault((position['symbol'], position['positionSide']), position['positionId'])
+        return position_ids
+
+    def build_orders_index(self, open_orders):
+        """
+        Group open orders by (symbol, positionSide) in a single pass.
+        Only the first STOP/STOP_MARKET and the first TAKE_PROFIT order are kept
+        for every key, the same rows the per-position filters used to pick.
+        """
+        orders_index = {}
+        for order in Order.from_rows(open_orders):
+            key = (order.symbol, order.positionSide)
+            entry = orders_index.setdefault(key, {'stop': None, 'take_profit': None})
+            if order.type in ('STOP', 'STOP_MARKET'):
+                if entry['stop'] is None:
+                    entry['stop'] = order
+            elif order.type == 'TAKE_PROFIT':
+                if entry['take_profit'] is None:
+                    entry['take_profit'] = order
+        return orders_index
+
+    def get_indexed_orders(self, position):
+        if self.orders_index is None:
+            self.orders_index = self.build_orders_index(self.order_records)
+        return self.orders_index.get((position['symbol'], position['positionSide']))
 
     def close_position_order(self, position_row):
         self.log.info(
@@ -108,58 +354,321 @@ class OrderTracker:
         order = close_position(position_row)
         self.log.info(f"{self.m}Closed position with order {order}")
 
-    def run(self, re_raise_exception=False, mark=None):
+    def run(self, re_raise_exception=False, mark=None, near_only=False):
+        """
+        :param near_only: only evaluate positions near a threshold, the open orders
+                          of the last cycle are reused unless our requests changed them
+        """
         if not mark is None:
             self.run_with_mark = mark
+        start = time.perf_counter()
+        api_start = api_request_seconds.total_sum()
         try:
-            self.open_positions = self.get_open_positions()
-            self.open_orders = self.get_open_orders()
-            for index, position in self.open_positions.iterrows():
-                self.process_position(position)
-
-            self.save_saved_locally()
+            with self.account_credentials():
+                self.run_cycle(near_only)
         except Exception as e:
+            cycle_errors.inc()
             self.log.error(f"{self.m}Exception occurred: {e}\n{traceback.format_exc()}")
             if re_raise_exception:
                 raise
+        finally:
+            self.log_rate_limit_waits()
+            self.observe_cycle(time.perf_counter() - start, api_request_seconds.total_sum() - api_start)
+
+    def observe_cycle(self, elapsed, api_elapsed):
+        cycle_seconds.observe(elapsed)
+        cycle_api_seconds.observe(api_elapsed)
+        cycle_compute_seconds.observe(max(elapsed - api_elapsed, 0))
+        if elapsed > sleep_interval:
+            cycle_overruns.inc()
+            self.log.warning(
+                f"{self.m}Cycle took {elapsed:.2f}s, longer than SLEEP_INTERVAL {sleep_interval}s "
+                f"({api_elapsed:.2f}s in exchange requests)"
+            )
+
+    def run_cycle(self, near_only=False):
+        with phase_seconds.time(phase='get_open_positions'):
+            self.position_records = self.get_open_positions()
+        positions_open.set(len(self.position_records))
+        self.sync_saved_locally()
+        if self.needs_orders(near_only):
+            with phase_seconds.time(phase='get_open_orders'):
+                self.set_open_orders(self.get_open_orders())
+        with phase_seconds.time(phase='refresh_coefficients'):
+            self.refresh_coefficients()
+        pending = self.decide_positions(self.positions_to_evaluate(near_only))
+        if pending:
+            with phase_seconds.time(phase='dispatch_stop_losses'):
+                self.dispatch_stop_losses(pending)
+        self.end_cycle()
+
+        with phase_seconds.time(phase='save_saved_locally'):
+            self.save_saved_locally()
+
+    def needs_orders(self, near_only):
+        return not near_only or self.order_records is None or self.orders_stale
+
+    def set_open_orders(self, orders):
+        self.order_records = orders
+        self.orders_index = self.build_orders_index(orders)
+        self.orders_stale = False
+
+    def positions_to_evaluate(self, near_only):
+        if not near_only:
+            return self.position_records
+        positions = [position for position in self.position_records if self.is_near_threshold(position)]
+        self.log.info(f"{self.m}Evaluating {len(positions)} of {len(self.position_records)} positions near a threshold")
+        return positions
+
+    def decide_positions(self, positions):
+        """
+        Take the decisions of a cycle for `positions` with the DECISION_ENGINE.
+        Returns the stop-loss changes collected for dispatch_stop_losses with
+        STOP_LOSS_DISPATCH=batch, None when they were sent right away.
+        """
+        self.skipped_positions = 0
+        if stop_loss_dispatch == 'batch':
+            self.pending_stop_losses = []
+        try:
+            with phase_seconds.time(phase='process_positions'):
+                if decision_engine == 'vectorized':
+                    decisions = self.process_positions_batch(positions)
+                else:
+                    decisions = [self.process_position(position) for position in positions]
+            if any(decisions):
+                self.orders_stale = True
+            return self.pending_stop_losses
+        finally:
+            self.pending_stop_losses = None
+
+    def end_cycle(self):
+        """Bookkeeping after the decisions of a cycle were sent"""
+        self.prune_position_snapshots()
+        if self.skipped_positions:
+            positions_skipped.inc(self.skipped_positions)
+            self.log.info(
+                f"{self.m}Skipped {self.skipped_positions} of {len(self.position_records)} unchanged positions"
+            )
+
+    def refresh_coefficients(self):
+        if self.coefficient_cache is None or not self.position_records:
+            return
+        mark_prices = {position['symbol']: float(position['markPrice']) for position in self.position_records}
+        computed = self.coefficient_cache.refresh(mark_prices)
+        self.coefficient_cache.prune(mark_prices)
+        if computed:
+            self.log.info(f"{self.m}Computed coefficients for {computed} of {len(mark_prices)} symbols")
+
+    def get_sl_adjustment(self, symbol):
+        """Share of the distance to take profit the stop loss is trailed by"""
+        if self.coefficient_cache is None:
+            return SL_ADJUSTMENT
+        coefficients = self.coefficient_cache.get(symbol)
+        if coefficients is None:
+            return SL_ADJUSTMENT
+        return coefficients['stop_loss_coefficient']
+
+    def log_rate_limit_waits(self):
+        for endpoint_class, stats in get_rate_limit_stats(reset=True).items():
+            if stats['waited'] > 0.001:
+                self.log.info(
+                    f"{self.m}{endpoint_class} requests waited {stats['waited']:.3f}s for rate limit "
+                    f"(max {stats['max_wait']:.3f}s over {stats['requests']} requests)"
+                )
 
     def process_position(self, position):
+        """Returns the decision taken: 'close', 'update_stop_loss' or None"""
+        start = time.perf_counter()
+        decision = self.evaluate_position(position)
+        position_seconds.observe(time.perf_counter() - start)
+        position_decisions.inc(decision=decision or 'none')
+        return decision
+
+    def evaluate_position(self, position):
         positionSide = position['positionSide']
         positionId = position['positionId']
-        self.log.info(f"{self.m}Processing {position['symbol']}, {positionSide}")
         # Find associated orders
         stop_order, stopPrice = self.get_stop_order(position)
         # Get saved_locally entry for this position
         saved_entry = self.get_saved_entry(positionId)
 
+        # Skip the position when the last cycle did nothing and that cannot change now
+        inputs = self.get_position_inputs(position, stop_order, stopPrice, saved_entry)
+        if self.is_position_unchanged(positionId, inputs, float(position['markPrice'])):
+            self.skipped_positions += 1
+            return None
+        self.position_snapshots.pop(positionId, None)
+
+        self.log.info(f"{self.m}Processing {position['symbol']}, {positionSide}")
         # Process based on positionSide
         if positionSide == 'SHORT':
-            self.process_short_position(position, stop_order, stopPrice, saved_entry)
+            decision = self.process_short_position(position, stop_order, stopPrice, saved_entry)
         elif positionSide == 'LONG':
-            self.process_long_position(position, stop_order, stopPrice, saved_entry)
+            decision = self.process_long_position(position, stop_order, stopPrice, saved_entry)
         else:
             self.log.error(
                 f"{self.m}Unknown positionSide {positionSide} for position {positionId}"
             )
+            return None
+
+        if decision is None:
+            self.position_snapshots[positionId] = (inputs, self.get_no_action_range(inputs))
+        return decision
+
+    def process_positions_batch(self, positions):
+        """
+        Same decisions as process_position, taken for all `positions` in one
+        vectorized pass and then dispatched row by row. Unchanged positions are
+        skipped and no-action snapshots kept as in process_position.
+        """
+        if not positions:
+            return []
+
+        count = len(positions)
+        import numpy as np
+
+        is_short = np.zeros(count, dtype=bool)
+        markPrice, avgPrice, stopPrice, take_profit_price, saved_markPrice, sl_adjustment = np.full((6, count), np.nan)
+        stop_orders = [None] * count
+        position_inputs = [None] * count
+        # Rows with a known side that were not skipped
+        evaluated = np.ones(count, dtype=bool)
+        for i, position in enumerate(positions):
+            positionSide = position['positionSide']
+            positionId = position['positionId']
+            if positionSide not in ('SHORT', 'LONG'):
+                self.log.error(
+                    f"{self.m}Unknown positionSide {positionSide} for position {positionId}"
+                )
+                evaluated[i] = False
+                continue
+            stop_order, stop_price = self.get_stop_order(position)
+            saved_entry = self.get_saved_entry(positionId)
+            inputs = self.get_position_inputs(position, stop_order, stop_price, saved_entry)
+            if self.is_position_unchanged(positionId, inputs, float(position['markPrice'])):
+                self.skipped_positions += 1
+                evaluated[i] = False
+                continue
+            self.position_snapshots.pop(positionId, None)
+            position_inputs[i] = inputs
+            is_short[i] = positionSide == 'SHORT'
+            markPrice[i] = float(position['markPrice'])
+            avgPrice[i] = inputs[2]
+            stop_orders[i], stopPrice[i] = stop_order, stop_price
+            take_profit_price[i] = inputs[6]
+            sl_adjustment[i] = self.get_sl_adjustment(position['symbol'])
+            if saved_entry is not None:
+                saved_markPrice[i] = inputs[7]
+
+        actions, new_sl_price = evaluate_positions(
+            is_short, markPrice, avgPrice, stopPrice, take_profit_price, saved_markPrice, sl_adjustment
+        )
+        actions[~evaluated] = ACTION_NONE
+
+        for i in np.flatnonzero(evaluated & (actions == ACTION_NONE)):
+            inputs = position_inputs[i]
+            self.position_snapshots[positions[i]['positionId']] = (inputs, self.get_no_action_range(inputs))
+
+        decisions = [None] * count
+        for i in np.flatnonzero(actions):
+            position = positions[i]
+            positionSide = position['positionSide']
+            if actions[i] == ACTION_CLOSE:
+                self.log.info(f"{self.m}Closing {positionSide} position {position['symbol']}")
+                self.close_position_order(position)
+                self.remove_saved_entry(position['positionId'])
+                decisions[i] = 'close'
+            elif actions[i] == ACTION_UPDATE_STOP_LOSS:
+                new_sl = float(new_sl_price[i])
+                self.log.info(
+                    f"{self.m}Setting new stop loss for {positionSide} position {position['symbol']} at {new_sl}"
+                )
+                self.set_stop_loss(position, new_sl, stop_orders[i], float(markPrice[i]))
+                decisions[i] = 'update_stop_loss'
+        for decision in ('close', 'update_stop_loss'):
+            position_decisions.inc(decisions.count(decision), decision=decision)
+        position_decisions.inc(decisions.count(None), decision='none')
+        return decisions
+
+    def is_near_threshold(self, position):
+        """
+        Whether markPrice is within NEAR_THRESHOLD_DISTANCE of the range in which the
+        last cycle decided to do nothing for the position, or outside of it
+        """
+        snapshot = self.position_snapshots.get(position['positionId'])
+        if snapshot is None:
+            # New positions and positions acted on or not evaluated in the last cycle
+            return True
+        low, high = snapshot[1]
+        markPrice = float(position['markPrice'])
+        return min(markPrice - low, high - markPrice) <= markPrice * near_threshold_distance
+
+    def get_position_inputs(self, position, stop_order, stopPrice, saved_entry):
+        """Everything besides markPrice that the SHORT/LONG decisions depend on"""
+        avgPrice = float(position['avgPrice'])
+        return (
+            position['symbol'],
+            position['positionSide'],
+            avgPrice,
+            position['positionAmt'],
+            None if stop_order is None else (stop_order['orderId'], stop_order['type']),
+            stopPrice,
+            self.get_take_profit_price(position, avgPrice),
+            None if saved_entry is None else float(saved_entry['markPrice']),
+        )
+
+    def get_no_action_range(self, inputs):
+        """
+        Inclusive markPrice range in which process_short_position/process_long_position
+        neither close the position nor move its stop loss, for the given inputs
+        """
+        symbol, positionSide, avgPrice, positionAmt, stop_key, stopPrice, take_profit_price, saved_markPrice = inputs
+        if positionSide == 'SHORT':
+            stopThreshold = self.get_short_stop_threshold(avgPrice, stopPrice)
+            low = avgPrice if saved_markPrice is None else min(avgPrice, saved_markPrice)
+            return low, max(avgPrice, stopThreshold)
+        stopThreshold, profitThreshold = self.get_long_thresholds(avgPrice, stopPrice, take_profit_price)
+        if saved_markPrice is not None:
+            # The stop loss of a LONG is set once, nothing fires above profitThreshold afterwards
+            return min(avgPrice, stopThreshold), float('inf')
+        return min(avgPrice, stopThreshold), max(avgPrice, profitThreshold)
+
+    def is_position_unchanged(self, positionId, inputs, markPrice):
+        snapshot = self.position_snapshots.get(positionId)
+        if snapshot is None or snapshot[0] != inputs:
+            return False
+        low, high = snapshot[1]
+        return low <= markPrice <= high
+
+    def prune_position_snapshots(self):
+        if len(self.position_snapshots) > len(self.position_records):
+            open_ids = {position['positionId'] for position in self.position_records}
+            self.position_snapshots = {
+                positionId: snapshot for positionId, snapshot in self.position_snapshots.items()
+                if positionId in open_ids
+            }
+
+    def get_short_stop_threshold(self, avgPrice, stopPrice):
+        difference = stopPrice - avgPrice
+        return avgPrice + (difference * 0.35)
+
+    def get_long_thresholds(self, avgPrice, stopPrice, take_profit_price):
+        difference = avgPrice - stopPrice
+        profit_diff = take_profit_price - avgPrice
+        return avgPrice - (difference * 0.5), avgPrice + (profit_diff * 0.5)
 
     def get_stop_order(self, position):
-        symbol = position['symbol']
         positionSide = position['positionSide']
         avgPrice = float(position['avgPrice'])
-        if self.open_orders is None or self.open_orders.shape[0] == 0:
+        if not self.order_records:
             return None, avgPrice * 1.015 if  positionSide == 'SHORT' else avgPrice * 0.985
-            
-        stop_orders = self.open_orders[
-            (self.open_orders['symbol'] == symbol)
-            & (self.open_orders['positionSide'] == positionSide)
-            & (self.open_orders['type'].isin(['STOP', 'STOP_MARKET']))
-        ]
 
-        if not stop_orders.empty:
-            stop_order = stop_orders.iloc[0]
+        indexed_orders = self.get_indexed_orders(position)
+        stop_order = indexed_orders['stop'] if indexed_orders else None
+
+        if stop_order is not None:
             stopPrice = float(stop_order['stopPrice'])
         else:
-            stop_order = None
             # Assume a default stopPrice for calculations
             if positionSide == 'LONG':
                 stopPrice = avgPrice * 0.985  # 1.5% below avgPrice
@@ -172,20 +681,16 @@ class OrderTracker:
         return stop_order, stopPrice
 
     def get_take_profit_price(self, position, avgPrice):
-        symbol = position['symbol']
         positionSide = position['positionSide']
 
-        if self.open_orders is None or self.open_orders.shape[0] == 0:
+        if not self.order_records:
             return 0
-        
-        take_profit_orders = self.open_orders[
-            (self.open_orders['symbol'] == symbol)
-            & (self.open_orders['positionSide'] == positionSide)
-            & (self.open_orders['type'] == 'TAKE_PROFIT')
-        ]
 
-        if not take_profit_orders.empty:
-            take_profit_price = float(take_profit_orders.iloc[0]['stopPrice'])
+        indexed_orders = self.get_indexed_orders(position)
+        take_profit_order = indexed_orders['take_profit'] if indexed_orders else None
+
+        if take_profit_order is not None:
+            take_profit_price = float(take_profit_order['stopPrice'])
         else:
             # If no TAKE_PROFIT order, suppose take_profit_price is avgPrice * 1.015
             if positionSide == 'LONG':
@@ -198,15 +703,7 @@ class OrderTracker:
         return take_profit_price
 
     def get_saved_entry(self, positionId):
-        if self.saved_locally.shape[0] == 0:
-            return None
-        saved_entry = self.saved_locally[
-            self.saved_locally['positionId'] == positionId
-        ]
-        if not saved_entry.empty:
-            return saved_entry.iloc[0]
-        else:
-            return None
+        return self.saved_entries.get(entry_key(positionId))
 
     def process_short_position(self, position, stop_order, stopPrice, saved_entry):
         symbol = position['symbol']
@@ -217,9 +714,9 @@ class OrderTracker:
         # Get the take profit price
         take_profit_price = self.get_take_profit_price(position, avgPrice)
         # Condition 1: Close position if criteria met
-        difference = stopPrice - avgPrice
-        stopThreshold = avgPrice + (difference * 0.35)
-        print(f"stopThreshold {stopThreshold}, avgPrice: {avgPrice}, stopPrice {stopPrice}")
+        stopThreshold = self.get_short_stop_threshold(avgPrice, stopPrice)
+        # Formatted only when DEBUG is enabled
+        self.log.debug("%sstopThreshold %s, avgPrice: %s, stopPrice %s", self.m, stopThreshold, avgPrice, stopPrice)
         if markPrice > avgPrice and markPrice > stopThreshold:
             self.log.info(
                 f"{self.m}Closing SHORT position {symbol} as markPrice > avgPrice and markPrice > 120% of stopPrice"
@@ -227,6 +724,7 @@ class OrderTracker:
             self.close_position_order(position)
             # Remove from saved_locally
             self.remove_saved_entry(positionId)
+            return 'close'
         elif markPrice < avgPrice:
             # Determine if we should update the stop loss
             update_stop_loss = False
@@ -240,13 +738,13 @@ class OrderTracker:
             if update_stop_loss:
                 # Calculate new stop loss
                 potential_profit = markPrice - take_profit_price
-                sl_adjustment = potential_profit * 0.12
+                sl_adjustment = potential_profit * self.get_sl_adjustment(symbol)
                 new_sl_price = markPrice + sl_adjustment
                 self.log.info(
                     f"{self.m}Setting new stop loss for SHORT position {symbol} at {new_sl_price}"
                 )
-                self.update_stop_loss(position, new_sl_price, stop_order)
-                self.update_saved_entry(position, new_sl_price, stop_order, markPrice)
+                self.set_stop_loss(position, new_sl_price, stop_order, markPrice)
+                return 'update_stop_loss'
             else:
                 self.log.info(
                     f"{self.m}SHORT position {symbol} markPrice {markPrice} >= saved_markPrice {saved_markPrice}, doing nothing"
@@ -260,10 +758,7 @@ class OrderTracker:
         take_profit_price = self.get_take_profit_price(position, avgPrice)
 
         # Condition 1: Close position if criteria met
-        difference = avgPrice - stopPrice
-        profit_diff = take_profit_price - avgPrice
-        stopThreshold = avgPrice - (difference * 0.5)
-        profitThreshold = avgPrice + (profit_diff * 0.5)
+        stopThreshold, profitThreshold = self.get_long_thresholds(avgPrice, stopPrice, take_profit_price)
         if markPrice < avgPrice and markPrice < stopThreshold:
             self.log.info(
                 f"{self.m}Closing LONG position {symbol} as markPrice < avgPrice and markPrice < 80% of stopPrice"
@@ -271,6 +766,7 @@ class OrderTracker:
             self.close_position_order(position)
             # Remove from saved_locally
             self.remove_saved_entry(positionId)
+            return 'close'
         elif markPrice > avgPrice and markPrice > profitThreshold:
             # Determine if we should update the stop loss
             update_stop_loss = False
@@ -285,18 +781,49 @@ class OrderTracker:
             if update_stop_loss:
                 # Calculate new stop loss
                 potential_profit = take_profit_price - markPrice
-                sl_adjustment = potential_profit * 0.12
+                sl_adjustment = potential_profit * self.get_sl_adjustment(symbol)
                 new_sl_price = markPrice - sl_adjustment
                 self.log.info(
                     f"{self.m}Setting new stop loss for LONG position {symbol} at {new_sl_price}"
                 )
-                self.update_stop_loss(position, new_sl_price, stop_order)
-                self.update_saved_entry(position, new_sl_price, stop_order, markPrice)
+                self.set_stop_loss(position, new_sl_price, stop_order, markPrice)
+                return 'update_stop_loss'
             else:
                 self.log.info(
-                    f"{self.m}LONG position {symbol} markPrice {markPrice} <= saved_markPrice {saved_markPrice}, doing nothing"
+                    f"{self.m}LONG position {symbol} markPrice {markPrice}, stop loss already set at saved_markPrice {float(saved_entry['markPrice'])}, doing nothing"
                 )    
 
+    def set_stop_loss(self, position, new_sl_price, stop_order, markPrice):
+        if self.pending_stop_losses is not None:
+            # Sent by dispatch_stop_losses at the end of the cycle
+            self.pending_stop_losses.append((position, new_sl_price, stop_order, markPrice))
+            return
+        response = self.update_stop_loss(position, new_sl_price, stop_order)
+        self.record_stop_order(position, new_sl_price, stop_order, response)
+        self.update_saved_entry(position, new_sl_price, stop_order, markPrice)
+
+    def dispatch_stop_losses(self, pending):
+        """
+        Send the stop-loss changes collected in a cycle with submit_stop_orders.
+        saved_locally is only updated for the changes the exchange accepted, the
+        others are decided again in the next cycle.
+        """
+        responses = submit_stop_orders([
+            (position['symbol'], position['positionSide'], float(position['positionAmt']), new_sl_price, stop_order)
+            for position, new_sl_price, stop_order, markPrice in pending
+        ])
+        failed = 0
+        for (position, new_sl_price, stop_order, markPrice), response in zip(pending, responses):
+            self.record_stop_order(position, new_sl_price, stop_order, response)
+            if response.get('code') == 0:
+                self.update_saved_entry(position, new_sl_price, stop_order, markPrice)
+            else:
+                failed += 1
+                self.log.error(
+                    f"{self.m}Stop loss update for {position['symbol']}, {position['positionSide']} failed: {response}"
+                )
+        self.log.info(f"{self.m}Sent {len(pending)} stop loss updates, {failed} failed")
+
     def update_stop_loss(self, position, new_sl_price, stop_order):
         
         symbol = position['symbol']
@@ -305,7 +832,7 @@ class OrderTracker:
         
         if stop_order is not None:
             # Cancel and set new stop order
-            cancel_and_set_new(
+            return cancel_and_set_new(
                 symbol,
                 positionSide,
                 positionAmt,
@@ -314,10 +841,36 @@ class OrderTracker:
             )
         else:
             # Create new stop order
-            create_stop_order(
+            return create_stop_order(
                 symbol, positionSide, positionAmt, new_sl_price
             )
 
+    def record_stop_order(self, position, new_sl_price, stop_order, response):
+        """Apply our own stop order change to the order book, from the exchange response"""
+        if self.order_book is None:
+            return
+        if not isinstance(response, dict) or response.get('code') != 0:
+            # The change may or may not have been applied
+            self.order_book.invalidate()
+            return
+        if stop_order is not None:
+            self.order_book.remove(stop_order['orderId'])
+        data = response.get('data') or {}
+        # order: trade/order and batchOrders, newOrderResponse: cancelReplace
+        placed = data.get('order') or data.get('newOrderResponse') or {}
+        if placed.get('orderId') is None:
+            self.order_book.invalidate()
+            return
+        self.order_book.add(Order(
+            orderId=placed['orderId'],
+            symbol=position['symbol'],
+            positionSide=position['positionSide'],
+            type=stop_order['type'] if stop_order is not None else 'STOP_MARKET',
+            stopPrice=new_sl_price,
+            status='NEW',
+            positionId=position['positionId'],
+        ))
+
     def update_saved_entry(self, position, new_sl_price, stop_order, markPrice):
         positionId = position['positionId']
         symbol = position['symbol']
@@ -326,32 +879,50 @@ class OrderTracker:
         # Remove existing entry
         self.remove_saved_entry(positionId)
 
-        new_saved_entry = {
-            'symbol': symbol,
-            'orderId': stop_order['orderId'] if stop_order is not None else None,
-            'positionSide': positionSide,
-            'type': stop_order['type'] if stop_order is not None else 'STOP_MARKET',
-            'stopPrice': new_sl_price,
-            'positionId': positionId,
-            'markPrice': markPrice,
-            'time': int(time.time() * 1000),
-        }
+        new_saved_entry = SavedEntry(
+            symbol=symbol,
+            orderId=stop_order['orderId'] if stop_order is not None else None,
+            positionSide=positionSide,
+            type=stop_order['type'] if stop_order is not None else 'STOP_MARKET',
+            stopPrice=new_sl_price,
+            positionId=positionId,
+            markPrice=markPrice,
+            time=int(time.time() * 1000),
+        )
 
-        new_row_df = pd.DataFrame([new_saved_entry])
-        self.saved_locally = pd.concat([self.saved_locally, new_row_df], ignore_index=True)
+        self.saved_entries[entry_key(positionId)] = new_saved_entry
+        self.saved_changes[entry_key(positionId)] = new_saved_entry.to_dict()
 
     def remove_saved_entry(self, positionId):
-        if self.saved_locally.shape[0] == 0:
-            return None
-        self.saved_locally = self.saved_locally[
-            self.saved_locally['positionId'] != positionId
-        ]
+        if self.saved_entries.pop(entry_key(positionId), None) is not None:
+            self.saved_changes[entry_key(positionId)] = None
         
-if __name__ == '__main__':
+def main(argv=None):
+    """
+    Single-shot run by default, for cron and hooks: logs the time of the imports,
+    the tracker setup and the cycle. 'loop' runs the cycles on the scheduler.
+    """
+    parser = argparse.ArgumentParser(description="Trail the stop losses of the open positions")
+    parser.add_argument('mode', nargs='?', default='once', help="'loop' to keep running, anything else runs once")
+    # Further arguments are ignored, as they always were
+    args, _ = parser.parse_known_args(argv)
+
+    init_started = time.perf_counter()
     order_manager = OrderTracker()
-    if len(sys.argv) > 1 and sys.argv[1] == 'loop':
-        while True:
-            order_manager.run()
-            time.sleep(sleep_interval)
-    else:
-        order_manager.run()
\ No newline at end of file
+    if args.mode == 'loop':
+        start_metrics_endpoint(order_manager.log, order_manager.m)
+        create_scheduler(order_manager).run()
+        return order_manager
+
+    run_started = time.perf_counter()
+    order_manager.run()
+    finished = time.perf_counter()
+    order_manager.log.info(
+        f"{order_manager.m}Startup: imports {(init_started - import_started) * 1000:.0f} ms, "
+        f"init {(run_started - init_started) * 1000:.0f} ms, run {(finished - run_started) * 1000:.0f} ms"
+    )
+    return order_manager
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""
+Compact records for the tracker core path. Positions, orders and saved entries are
+kept as __slots__ objects with the dict-style access (position['markPrice']) the
+tracker code and the api_lib functions use, so a cycle does not build pandas frames.
+pandas is only imported by to_frame, for analytics and inspection.
+"""
+
+
+class Record:
+    __slots__ = ()
+    fields = ()
+
+    def __init__(self, **values):
+        for field in self.fields:
+            setattr(self, field, values.get(field))
+
+    @classmethod
+    def from_dict(cls, data):
+        record = cls.__new__(cls)
+        for field in cls.fields:
+            setattr(record, field, data.get(field))
+        return record
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Records from a list of dicts or records, or a DataFrame"""
+        if rows is None:
+            return []
+        if hasattr(rows, 'to_dict'):
+            rows = rows.to_dict('records')
+        return [row if isinstance(row, cls) else cls.from_dict(row) for row in rows]
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self.fields}
+
+    def __getitem__(self, field):
+        try:
+            return getattr(self, field)
+        except AttributeError:
+            raise KeyError(field) from None
+
+    def __setitem__(self, field, value):
+        try:
+            setattr(self, field, value)
+        except AttributeError:
+            raise KeyError(field) from None
+
+    def __contains__(self, field):
+        return field in self.fields
+
+    def get(self, field, default=None):
+        """`default` for names that are not fields. A field holding None returns None, as dict.get does"""
+        return getattr(self, field) if field in self.fields else default
+
+    def __eq__(self, other):
+        if type(other) is not type(self):
+            return NotImplemented
+        return all(getattr(self, field) == getattr(other, field) for field in self.fields)
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"{type(self).__name__}({', '.join(f'{field}={getattr(self, field)!r}' for field in self.fields)})"
+
+
+class Position(Record):
+    fields = ('symbol', 'positionId', 'positionSide', 'positionAmt', 'avgPrice', 'markPrice')
+    __slots__ = fields
+
+
+class Order(Record):
+    fields = ('orderId', 'symbol', 'positionSide', 'type', 'stopPrice', 'status', 'positionId')
+    __slots__ = fields
+
+
+class SavedEntry(Record):
+    fields = ('symbol', 'orderId', 'positionSide', 'type', 'stopPrice', 'positionId', 'markPrice', 'time')
+    __slots__ = fields
+
+
+def to_frame(records):
+    """DataFrame with one row per record"""
+    import pandas as pd
+
+    return pd.DataFrame([record.to_dict() for record in records])
@@ -0,0 +1,126 @@
+import math
+import time
+
+from utils import metrics
+from utils.log_config import logging_config
+
+OVERRUN_POLICIES = ('skip', 'coalesce')
+
+schedule_lateness = metrics.histogram(
+    'order_tracker_schedule_lateness_seconds', 'Delay between the slot of a job and its start', ('job',),
+)
+schedule_missed = metrics.counter(
+    'order_tracker_schedule_missed_total', 'Slots not run because the previous run overran', ('job', 'policy'),
+)
+
+
+class ScheduledJob:
+    def __init__(self, name, interval, job, supersedes=()):
+        self.name = name
+        self.interval = interval
+        self.job = job
+        self.supersedes = tuple(supersedes)
+        self.due = None
+        self.runs = 0
+        self.missed = 0
+
+
+class CycleScheduler:
+    """
+    Runs jobs on fixed cadences. Slots are start + k * interval, so the period does not
+    grow by the time a job takes and does not drift over time.
+
+    When a run ends after the next slot of its job, the missed slots are handled by `overrun`:
+    'skip' waits for the next slot in the future, 'coalesce' runs once right away in place of
+    all the missed slots and then stays on the grid.
+    A job that `supersedes` other jobs covers them: their due slots are dropped after it ran.
+    """
+
+    def __init__(self, overrun='skip', clock=time.monotonic, sleep=time.sleep, log=None):
+        if overrun not in OVERRUN_POLICIES:
+            raise ValueError(f"Unknown overrun policy {overrun}, expected one of {OVERRUN_POLICIES}")
+        self.overrun = overrun
+        self.clock = clock
+        self.sleep = sleep
+        self.jobs = []
+        self.running = False
+        self.log = log or logging_config()
+        self.m = "Scheduler: "
+
+    def add(self, name, interval, job, supersedes=()):
+        if interval <= 0:
+            raise ValueError(f"Interval of {name} must be positive, got {interval}")
+        scheduled = ScheduledJob(name, interval, job, supersedes)
+        self.jobs.append(scheduled)
+        return scheduled
+
+    def get_job(self, name):
+        for scheduled in self.jobs:
+            if scheduled.name == name:
+                return scheduled
+        raise KeyError(name)
+
+    def next_job(self):
+        # Earliest slot first, the job added first on a tie
+        return min(self.jobs, key=lambda scheduled: scheduled.due)
+
+    def run(self, max_runs=None):
+        """Run the jobs until stop() is called or `max_runs` jobs ran"""
+        start = self.clock()
+        for scheduled in self.jobs:
+            scheduled.due = start
+        self.running = True
+        runs = 0
+        while self.running and (max_runs is None or runs < max_runs):
+            scheduled = self.next_job()
+            wait = scheduled.due - self.clock()
+            if wait > 0:
+                self.sleep(wait)
+            self.run_job(scheduled)
+            runs += 1
+
+    def stop(self):
+        self.running = False
+
+    def run_job(self, scheduled):
+        started = self.clock()
+        schedule_lateness.observe(max(started - scheduled.due, 0), job=scheduled.name)
+        try:
+            scheduled.job()
+        except Exception as e:
+            # Jobs log their own errors, the cadence keeps going
+            self.log.error(f"{self.m}{scheduled.name} failed: {e}")
+        scheduled.runs += 1
+        now = self.clock()
+        self.advance(scheduled, now)
+        for name in scheduled.supersedes:
+            covered = self.get_job(name)
+            if covered.due <= now:
+                # Already done by this run, not missed
+                covered.due = self.next_slot(covered, now)
+
+    def next_slot(self, scheduled, now):
+        """First slot of the job after `now`"""
+        return scheduled.due + (math.floor((now - scheduled.due) / scheduled.interval) + 1) * scheduled.interval
+
+    def advance(self, scheduled, now):
+        """Move the job to its next slot after a run ending at `now`"""
+        next_due = scheduled.due + scheduled.interval
+        if next_due >= now:
+            scheduled.due = next_due
+            return
+        scheduled.due = self.next_slot(scheduled, now)
+        # Slots that passed while the job ran
+        missed = round((scheduled.due - next_due) / scheduled.interval)
+        if self.overrun == 'coalesce':
+            # The last passed slot runs right away and stands for the others
+            scheduled.due -= scheduled.interval
+            missed -= 1
+        if missed:
+            scheduled.missed += missed
+            schedule_missed.inc(missed, job=scheduled.name, policy=self.overrun)
+        if self.overrun == 'coalesce':
+            action = f"running once now for {missed + 1} slot(s)"
+        else:
+            action = f"skipping {missed} slot(s)"
+        self.log.warning(f"{self.m}{scheduled.name} overran its {scheduled.interval}s interval, {action}")
@@ -0,0 +1,260 @@
+import asyncio
+import os
+import traceback
+
+from dotenv import load_dotenv
+
+from api_lib.open_positions import create_listen_key, extend_listen_key
+from api_lib.stream import (
+    STREAM_URL,
+    mark_price_data_type,
+    parse_mark_price,
+    stream_messages,
+    user_stream_url,
+)
+from order_tracker import OrderTracker, start_metrics_endpoint
+from records import Position
+
+load_dotenv()
+stream_reconcile_interval = float(os.getenv('STREAM_RECONCILE_INTERVAL', 300))
+stream_reconcile_debounce = float(os.getenv('STREAM_RECONCILE_DEBOUNCE', 1))
+stream_reconnect_delay = float(os.getenv('STREAM_RECONNECT_DELAY', 5))
+listen_key_extend_interval = 30 * 60
+
+USER_STREAM_EVENTS = ('ACCOUNT_UPDATE', 'ORDER_TRADE_UPDATE')
+
+
+class StreamingOrderTracker(OrderTracker):
+    """
+    Event-driven tracking. Positions and orders are kept in memory, and a position is
+    re-evaluated by process_position when a mark price tick changes its price.
+    The REST snapshot is refreshed every STREAM_RECONCILE_INTERVAL seconds, and
+    shortly after our own requests or account/order events.
+    """
+
+    def __init__(self, market_url=None, user_url=None, use_user_stream=True, **kwargs):
+        super().__init__(**kwargs)
+        self.market_url = market_url or STREAM_URL
+        self.user_url = user_url or STREAM_URL
+        self.use_user_stream = use_user_stream
+        # positionId -> position record, symbol -> [positionId]
+        self.positions = {}
+        self.positions_by_symbol = {}
+        # Latest markPrice tick per symbol since the last reconciliation
+        self.mark_prices = {}
+        # markPrice each position was last evaluated with
+        self.evaluated_prices = {}
+        # Positions with a request in flight, left alone until the next reconciliation
+        self.pending_positions = set()
+        self.dirty_symbols = set()
+        self.evaluations = 0
+        self.reconciliations = 0
+        self.loop = None
+        self.state_lock = None
+        self.dirty_event = None
+        self.reconcile_event = None
+        self.stop_event = None
+        self.market_task = None
+
+    async def run_stream(self):
+        # Tasks and worker threads started below inherit the account credentials
+        with self.account_credentials():
+            await self.run_stream_tasks()
+
+    async def run_stream_tasks(self):
+        self.loop = asyncio.get_running_loop()
+        self.state_lock = asyncio.Lock()
+        self.dirty_event = asyncio.Event()
+        self.reconcile_event = asyncio.Event()
+        self.stop_event = asyncio.Event()
+
+        await self.reconcile_async()
+        tasks = [
+            asyncio.create_task(self.evaluate_loop()),
+            asyncio.create_task(self.reconcile_loop()),
+        ]
+        if self.use_user_stream:
+            tasks.append(asyncio.create_task(self.user_stream()))
+        try:
+            await self.stop_event.wait()
+        finally:
+            if self.market_task:
+                tasks.append(self.market_task)
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.stop_event.set)
+
+    def reconcile(self):
+        """Full REST refresh of positions, orders and saved_locally"""
+        self.position_records = self.get_open_positions()
+        self.sync_saved_locally()
+        self.order_records = self.get_open_orders()
+        self.orders_index = self.build_orders_index(self.order_records)
+        self.refresh_coefficients()
+
+        positions = {}
+        positions_by_symbol = {}
+        for position in self.position_records:
+            positions[position['positionId']] = position
+            positions_by_symbol.setdefault(position['symbol'], []).append(position['positionId'])
+        self.positions = positions
+        self.positions_by_symbol = positions_by_symbol
+        self.evaluated_prices = {
+            positionId: price for positionId, price in self.evaluated_prices.items() if positionId in positions
+        }
+        self.pending_positions.clear()
+        self.save_saved_locally()
+        self.reconciliations += 1
+
+    async def reconcile_async(self):
+        async with self.state_lock:
+            symbols_before = set(self.positions_by_symbol)
+            # Ticks from now on are newer than the REST prices
+            self.mark_prices = {}
+            try:
+                await asyncio.to_thread(self.reconcile)
+            except Exception as e:
+                self.log.error(f"{self.m}Reconciliation failed: {e}\n{traceback.format_exc()}")
+                return
+            symbols = set(self.positions_by_symbol)
+
+        if symbols != symbols_before or self.market_task is None:
+            self.restart_market_stream(symbols)
+        # REST prices may differ from the last tick, evaluate everything once
+        self.mark_dirty(symbols)
+
+    async def reconcile_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.reconcile_event.wait(), stream_reconcile_interval)
+                # Coalesce bursts of account/order events into one refresh
+                await asyncio.sleep(stream_reconcile_debounce)
+            except asyncio.TimeoutError:
+                pass
+            self.reconcile_event.clear()
+            await self.reconcile_async()
+
+    def request_reconcile(self):
+        # Called from worker threads as well
+        self.loop.call_soon_threadsafe(self.reconcile_event.set)
+
+    def mark_dirty(self, symbols):
+        self.dirty_symbols.update(symbols)
+        if self.dirty_symbols:
+            self.dirty_event.set()
+
+    def on_market_message(self, message):
+        tick = parse_mark_price(message)
+        if tick is None:
+            return
+        symbol, markPrice = tick
+        if not self.positions_by_symbol.get(symbol):
+            return
+        # The position records are read by the evaluation thread, they are not changed here
+        self.mark_prices[symbol] = markPrice
+        self.mark_dirty([symbol])
+
+    async def evaluate_loop(self):
+        while True:
+            await self.dirty_event.wait()
+            self.dirty_event.clear()
+            symbols, self.dirty_symbols = self.dirty_symbols, set()
+            async with self.state_lock:
+                # Prices as of scheduling, later ticks are evaluated in the next round
+                prices = {symbol: self.mark_prices.get(symbol) for symbol in symbols}
+                await asyncio.to_thread(self.evaluate_symbols, prices)
+
+    def evaluate_symbols(self, prices):
+        """
+        :param prices: symbol -> markPrice to evaluate its positions with,
+                       None for the price of the last reconciliation
+        """
+        try:
+            for symbol, markPrice in prices.items():
+                for positionId in self.positions_by_symbol.get(symbol, ()):
+                    if positionId in self.pending_positions:
+                        continue
+                    position = self.positions[positionId]
+                    if markPrice is not None:
+                        # A copy, ticks keep arriving while this thread evaluates
+                        position = Position.from_dict(position)
+                        position['markPrice'] = markPrice
+                    if self.evaluated_prices.get(positionId) == position['markPrice']:
+                        continue
+                    self.evaluated_prices[positionId] = position['markPrice']
+                    self.evaluations += 1
+                    self.process_position(position)
+            self.save_saved_locally()
+        except Exception as e:
+            self.log.error(f"{self.m}Exception occurred: {e}\n{traceback.format_exc()}")
+
+    def close_position_order(self, position_row):
+        self.pending_positions.add(position_row['positionId'])
+        super().close_position_order(position_row)
+        self.request_reconcile()
+
+    def update_stop_loss(self, position, new_sl_price, stop_order):
+        # The local stop order is stale until the exchange state is fetched again
+        self.pending_positions.add(position['positionId'])
+        response = super().update_stop_loss(position, new_sl_price, stop_order)
+        self.request_reconcile()
+        return response
+
+    def restart_market_stream(self, symbols):
+        if self.market_task:
+            self.market_task.cancel()
+            self.market_task = None
+        if symbols:
+            self.market_task = asyncio.create_task(self.market_stream(sorted(symbols)))
+
+    async def market_stream(self, symbols):
+        data_types = [mark_price_data_type(symbol) for symbol in symbols]
+        while True:
+            try:
+                async for message in stream_messages(self.market_url, data_types):
+                    self.on_market_message(message)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.log.error(f"{self.m}Market stream error: {e}")
+            await asyncio.sleep(stream_reconnect_delay)
+
+    async def user_stream(self):
+        while True:
+            try:
+                listenKey = await asyncio.to_thread(create_listen_key)
+                if not listenKey:
+                    self.log.error(f"{self.m}No listen key, relying on periodic reconciliation")
+                    return
+                keepalive = asyncio.create_task(self.keep_listen_key_alive(listenKey))
+                try:
+                    async for message in stream_messages(user_stream_url(listenKey, self.user_url)):
+                        if message.get('e') in USER_STREAM_EVENTS:
+                            self.reconcile_event.set()
+                        elif message.get('e') == 'listenKeyExpired':
+                            break
+                finally:
+                    keepalive.cancel()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.log.error(f"{self.m}User stream error: {e}")
+            await asyncio.sleep(stream_reconnect_delay)
+
+
+    async def keep_listen_key_alive(self, listenKey):
+        while True:
+            await asyncio.sleep(listen_key_extend_interval)
+            try:
+                await asyncio.to_thread(extend_listen_key, listenKey)
+            except Exception as e:
+                self.log.error(f"{self.m}Failed to extend listen key: {e}")
+
+
+if __name__ == '__main__':
+    order_manager = StreamingOrderTracker()
+    start_metrics_endpoint(order_manager.log, order_manager.m)
+    asyncio.run(order_manager.run_stream())
@@ -0,0 +1,180 @@
+import json
+import multiprocessing
+import os
+import queue
+import sys
+import time
+
+from dotenv import load_dotenv
+
+from utils.log_config import logging_config
+
+load_dotenv()
+accounts_file = os.getenv('ACCOUNTS_FILE', 'accounts.json')
+worker_processes = int(os.getenv('WORKER_PROCESSES', os.cpu_count() or 1))
+metrics_interval = int(os.getenv('METRICS_INTERVAL', 60))
+sleep_interval = int(os.getenv('SLEEP_INTERVAL', 60))
+
+
+def load_accounts(path):
+    """
+    Read [{"name": ..., "api_key": ..., "api_secret": ...}] from `path`.
+    "api_key_env"/"api_secret_env" name environment variables to read the credentials from instead.
+    """
+    with open(path, 'r') as f:
+        accounts = json.load(f)
+
+    loaded = []
+    names = set()
+    for account in accounts:
+        name = account['name']
+        if name in names:
+            raise ValueError(f"Duplicate account name {name}")
+        names.add(name)
+        loaded.append({
+            'name': name,
+            'api_key': account.get('api_key') or os.getenv(account.get('api_key_env', '')),
+            'api_secret': account.get('api_secret') or os.getenv(account.get('api_secret_env', '')),
+        })
+    return loaded
+
+
+def shard_accounts(accounts, shards):
+    """Spread accounts round-robin over at most `shards` non-empty shards"""
+    shards = max(1, min(shards, len(accounts)))
+    return [accounts[i::shards] for i in range(shards)]
+
+
+def worker_main(worker_id, accounts, loop_mode, interval, results):
+    """
+    Run the trackers of one shard in this process, one account after another.
+    Every run reports {'worker', 'account', 'ok', 'duration', 'positions'} to `results`.
+    """
+    # Imported here so that the supervisor process stays light, every worker
+    # has its own HTTP session, logger and a single Redis connection for its accounts
+    from order_tracker import OrderTracker, connect_redis, schedule_overrun
+    from scheduler import CycleScheduler
+
+    log = logging_config()
+    m = f"Worker {worker_id}: "
+    redis_client = connect_redis(log, m)
+
+    trackers = []
+    for account in accounts:
+        try:
+            trackers.append(OrderTracker(account=account, redis_client=redis_client))
+        except Exception as e:
+            log.error(f"{m}Failed to start tracker for {account['name']}: {e}")
+            results.put({'worker': worker_id, 'account': account['name'], 'ok': False,
+                         'duration': 0.0, 'positions': 0})
+
+    def run_accounts():
+        for tracker in trackers:
+            start = time.monotonic()
+            ok = True
+            try:
+                tracker.run(re_raise_exception=True)
+            except Exception:
+                # Already logged by run, the other accounts keep going
+                ok = False
+            positions = 0 if tracker.position_records is None else len(tracker.position_records)
+            results.put({'worker': worker_id, 'account': tracker.account['name'], 'ok': ok,
+                         'duration': time.monotonic() - start, 'positions': positions})
+
+    if not loop_mode:
+        run_accounts()
+        return
+    scheduler = CycleScheduler(overrun=schedule_overrun, log=log)
+    scheduler.add('accounts', interval, run_accounts)
+    scheduler.run()
+
+
+class ThroughputMetrics:
+    """Aggregates the per-account run reports of all workers"""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.accounts = {}
+
+    def add(self, result):
+        stats = self.accounts.setdefault(
+            result['account'], {'runs': 0, 'failures': 0, 'duration': 0.0, 'positions': 0}
+        )
+        stats['runs'] += 1
+        stats['failures'] += 0 if result['ok'] else 1
+        stats['duration'] += result['duration']
+        stats['positions'] += result['positions']
+
+    def summary(self):
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        runs = sum(stats['runs'] for stats in self.accounts.values())
+        duration = sum(stats['duration'] for stats in self.accounts.values())
+        return {
+            'accounts': len(self.accounts),
+            'runs': runs,
+            'failures': sum(stats['failures'] for stats in self.accounts.values()),
+            'failing_accounts': sorted(name for name, stats in self.accounts.items() if stats['failures']),
+            'runs_per_second': runs / elapsed,
+            'positions_per_second': sum(stats['positions'] for stats in self.accounts.values()) / elapsed,
+            'mean_run_seconds': duration / runs if runs else 0.0,
+        }
+
+
+def start_worker(context, worker_id, accounts, loop_mode, interval, results):
+    process = context.Process(
+        target=worker_main,
+        args=(worker_id, accounts, loop_mode, interval, results),
+        name=f"order-tracker-worker-{worker_id}",
+        daemon=True,
+    )
+    process.start()
+    return process
+
+
+def supervise(accounts, processes=worker_processes, loop_mode=False, interval=sleep_interval):
+    log = logging_config()
+    m = "Supervisor: "
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    shards = shard_accounts(accounts, processes)
+    workers = {
+        worker_id: start_worker(context, worker_id, shard, loop_mode, interval, results)
+        for worker_id, shard in enumerate(shards)
+    }
+    log.info(f"{m}Tracking {len(accounts)} accounts in {len(shards)} worker processes")
+
+    metrics = ThroughputMetrics()
+    next_report = time.monotonic() + metrics_interval
+    while workers:
+        try:
+            metrics.add(results.get(timeout=1))
+        except queue.Empty:
+            pass
+
+        for worker_id, process in list(workers.items()):
+            if process.is_alive():
+                continue
+            if loop_mode:
+                log.error(f"{m}Worker {worker_id} exited with {process.exitcode}, restarting")
+                workers[worker_id] = start_worker(context, worker_id, shards[worker_id], loop_mode, interval, results)
+            else:
+                workers.pop(worker_id)
+
+        if time.monotonic() >= next_report:
+            log.info(f"{m}{metrics.summary()}")
+            next_report = time.monotonic() + metrics_interval
+
+    while True:
+        try:
+            metrics.add(results.get(timeout=0.1))
+        except queue.Empty:
+            break
+    log.info(f"{m}{metrics.summary()}")
+    return metrics
+
+
+if __name__ == '__main__':
+    supervise(
+        load_accounts(accounts_file),
+        loop_mode=len(sys.argv) > 1 and sys.argv[1] == 'loop',
+    )
@@ -0,0 +1,152 @@
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from backtest import DEFAULT_PARAMS, load_klines
+from decision_engine import ACTION_CLOSE, ACTION_UPDATE_STOP_LOSS, evaluate_positions
+from indicators import atr_series, rsi_series
+
+SWEEP_DEFAULTS = dict(
+    DEFAULT_PARAMS,
+    # 1 trails by the CoefficientCalculator rules below instead of sl_adjustment
+    adaptive=0,
+    threshold=0.01,
+    high_volatility_coefficient=0.15,
+    overbought_coefficient=0.10,
+    normal_coefficient=0.20,
+)
+
+DEFAULT_GRID = {
+    'side': ['LONG', 'SHORT'],
+    'short_stop_factor': [0.2, 0.35, 0.5, 0.65, 0.8],
+    'long_stop_factor': [0.3, 0.5, 0.7, 0.9],
+    'long_profit_factor': [0.3, 0.5, 0.7],
+    'sl_adjustment': [0.06, 0.12, 0.2, 0.3],
+    'stop_distance': [0.01, 0.015, 0.02],
+    'take_profit_distance': [0.01, 0.015, 0.02, 0.03],
+    'adaptive': [0, 1],
+    'threshold': [0.005, 0.01],
+}
+
+
+def expand_grid(grid):
+    """Every combination of the grid values as flat arrays, SWEEP_DEFAULTS for the missing parameters"""
+    names = list(grid)
+    shape = [len(grid[name]) for name in names]
+    indices = np.indices(shape).reshape(len(shape), -1)
+    params = {name: np.asarray(grid[name])[index] for name, index in zip(names, indices)}
+    count = indices.shape[1]
+    for name, value in SWEEP_DEFAULTS.items():
+        if name not in params:
+            params[name] = np.full(count, value)
+    return params
+
+
+def sweep(high, low, close, grid=None, atr_period=14, rsi_period=14):
+    """
+    Simulate the trailing rules of backtest.replay for every parameter combination at once.
+    Combinations are array elements, the bars are stepped through in a loop.
+    :return: DataFrame with the parameters, pnl, max_drawdown, trades, win_rate and mutations per combination
+    """
+    params = expand_grid(DEFAULT_GRID if grid is None else grid)
+    high, low, close = (np.asarray(values, dtype=np.float64) for values in (high, low, close))
+    count = len(params['side'])
+
+    is_short = params['side'] == 'SHORT'
+    direction = np.where(is_short, -1.0, 1.0)
+    factors = {
+        name: params[name].astype(np.float64)
+        for name in ('short_stop_factor', 'long_stop_factor', 'long_profit_factor')
+    }
+    stop_distance = params['stop_distance'].astype(np.float64)
+    take_profit_distance = params['take_profit_distance'].astype(np.float64)
+    fee = params['fee'].astype(np.float64)
+    sl_adjustment = params['sl_adjustment'].astype(np.float64)
+    adaptive = params['adaptive'].astype(bool)
+    threshold = params['threshold'].astype(np.float64)
+    atr = atr_series(high, low, close, atr_period)
+    rsi = rsi_series(close, rsi_period)
+
+    is_open = np.zeros(count, dtype=bool)
+    avgPrice, stopPrice, take_profit_price, saved_markPrice = np.full((4, count), np.nan)
+    equity, peak, max_drawdown = np.zeros((3, count))
+    trades, wins, mutations = np.zeros((3, count), dtype=np.int64)
+
+    def settle(mask, price):
+        pnl = direction[mask] * (price[mask] - avgPrice[mask]) / avgPrice[mask] - 2 * fee[mask]
+        equity[mask] += pnl
+        np.maximum(peak, equity, out=peak)
+        np.maximum(max_drawdown, peak - equity, out=max_drawdown)
+        trades[mask] += 1
+        wins[mask] += pnl > 0
+        is_open[mask] = False
+
+    for t in range(len(close)):
+        was_open = is_open.copy()
+        if was_open.any():
+            # Orders placed on earlier bars, a bar touching both counts as stopped out
+            stop_hit = was_open & np.where(is_short, high[t] >= stopPrice, low[t] <= stopPrice)
+            take_profit_hit = was_open & ~stop_hit & np.where(is_short, low[t] <= take_profit_price, high[t] >= take_profit_price)
+            settle(stop_hit, stopPrice)
+            settle(take_profit_hit, take_profit_price)
+
+            if np.isnan(atr[t]):
+                trail = sl_adjustment
+            else:
+                coefficient = np.where(
+                    atr[t] / close[t] > threshold,
+                    params['high_volatility_coefficient'],
+                    np.where(rsi[t] > 70, params['overbought_coefficient'], params['normal_coefficient']),
+                )
+                trail = np.where(adaptive, coefficient, sl_adjustment)
+
+            actions, new_sl_price = evaluate_positions(
+                is_short, np.full(count, close[t]), avgPrice, stopPrice, take_profit_price, saved_markPrice,
+                trail, **factors,
+            )
+            evaluated = is_open.copy()
+            close_now = evaluated & (actions == ACTION_CLOSE)
+            settle(close_now, np.full(count, close[t]))
+            update = evaluated & (actions == ACTION_UPDATE_STOP_LOSS)
+            stopPrice[update] = new_sl_price[update]
+            saved_markPrice[update] = close[t]
+            mutations += close_now | update
+
+        # Positions are opened at the close of the bar after the previous one ended
+        opening = ~was_open
+        if opening.any():
+            avgPrice[opening] = close[t]
+            stopPrice[opening] = close[t] * (1 - direction[opening] * stop_distance[opening])
+            take_profit_price[opening] = close[t] * (1 + direction[opening] * take_profit_distance[opening])
+            saved_markPrice[opening] = np.nan
+            is_open[opening] = True
+
+    if len(close):
+        settle(is_open.copy(), np.full(count, close[-1]))
+
+    results = pd.DataFrame({name: values for name, values in params.items()})
+    results['bars'] = len(close)
+    results['trades'] = trades
+    results['pnl'] = equity
+    results['max_drawdown'] = max_drawdown
+    results['win_rate'] = np.divide(wins, trades, out=np.zeros(count), where=trades > 0)
+    results['mutations'] = mutations
+    return results
+
+
+if __name__ == '__main__':
+    symbols = sys.argv[1].split(',') if len(sys.argv) > 1 else ['BTC-USDT']
+    interval = sys.argv[2] if len(sys.argv) > 2 else '5m'
+    start = time.monotonic()
+    results = []
+    for symbol in symbols:
+        df = load_klines(symbol, interval)
+        results.append(sweep(df['high'].to_numpy(), df['low'].to_numpy(), df['close'].to_numpy()))
+    columns = list(DEFAULT_GRID) + ['fee']
+    summary = pd.concat(results).groupby(columns, as_index=False).agg(
+        trades=('trades', 'sum'), pnl=('pnl', 'sum'), max_drawdown=('max_drawdown', 'max'), mutations=('mutations', 'sum'),
+    )
+    print(summary.sort_values('pnl', ascending=False).head(20).to_string())
+    print(f"{len(summary)} combinations over {len(symbols)} symbols in {time.monotonic() - start:.1f}s")
@@ -0,0 +1,164 @@
+import unittest
+from unittest.mock import patch, MagicMock
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import pandas as pd
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import async_order_tracker
+import order_tracker
+from async_order_tracker import AsyncOrderTracker
+from order_tracker import OrderTracker
+from benchmarks.bench_cycle import fake_exchange_api
+from benchmarks.fake_exchange import FakeExchange, FakeExchangeServer
+from utils.saved_store import MemoryStore, SavedLocallyJournal
+
+
+def make_positions(count):
+    # Alternate closing LONGs and trailing SHORTs
+    rows = []
+    for i in range(count):
+        if i % 2 == 0:
+            rows.append({'symbol': f'S{i}-USDT', 'positionSide': 'LONG', 'positionId': i,
+                         'positionAmt': 1, 'markPrice': 90, 'avgPrice': 100})
+        else:
+            rows.append({'symbol': f'S{i}-USDT', 'positionSide': 'SHORT', 'positionId': i,
+                         'positionAmt': 2, 'markPrice': 80, 'avgPrice': 100})
+    return pd.DataFrame(rows)
+
+
+class TestAsyncOrderTracker(unittest.TestCase):
+    def make_tracker(self, tracker_class, **kwargs):
+        tracker = tracker_class(**kwargs)
+        tracker.saved_locally = pd.DataFrame()
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        tracker.saved_store = SavedLocallyJournal(os.path.join(tmp_dir.name, 'saved_locally.json'))
+        return tracker
+
+    def patch_api(self, positions_df, delay=0):
+        calls = []
+
+        def record(name):
+            def call(*args):
+                time.sleep(delay)
+                calls.append((name, args, time.monotonic()))
+                return {'code': 0}
+            return call
+
+        patches = {
+            'api_lib.open_positions.get_open_positions_demo': MagicMock(return_value=positions_df),
+            'api_lib.open_positions.get_full_orders': MagicMock(return_value={'data': {'orders': []}}),
+            'api_lib.open_positions.close_position': record('close'),
+            'api_lib.open_positions.create_stop_order': record('create'),
+            'api_lib.open_positions.cancel_and_set_new': record('replace'),
+            'order_tracker.get_open_positions_demo': MagicMock(return_value=positions_df),
+            'order_tracker.get_full_orders': MagicMock(return_value={'data': {'orders': []}}),
+            'order_tracker.close_position': record('close'),
+            'order_tracker.create_stop_order': record('create'),
+            'order_tracker.cancel_and_set_new': record('replace'),
+        }
+        for target, mock in patches.items():
+            patcher = patch(target, mock)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        return calls
+
+    def test_decisions_match_sync_run(self):
+        positions_df = make_positions(6)
+        calls = self.patch_api(positions_df)
+
+        sync_tracker = self.make_tracker(OrderTracker)
+        sync_tracker.run(re_raise_exception=True)
+        sync_calls = sorted((name, str(args)) for name, args, _ in calls)
+        calls.clear()
+
+        async_tracker = self.make_tracker(AsyncOrderTracker, rate_limit=0)
+        asyncio.run(async_tracker.run_async(re_raise_exception=True))
+        async_calls = sorted((name, str(args)) for name, args, _ in calls)
+
+        self.assertEqual(len(sync_calls), 6)
+        self.assertEqual(async_calls, sync_calls)
+        # Entries are saved as the concurrent requests complete
+        def saved(tracker):
+            return tracker.saved_locally.drop(columns='time').sort_values('positionId').reset_index(drop=True)
+        pd.testing.assert_frame_equal(saved(async_tracker), saved(sync_tracker))
+
+    def test_order_requests_are_sent_concurrently(self):
+        calls = self.patch_api(make_positions(8), delay=0.2)
+
+        tracker = self.make_tracker(AsyncOrderTracker, concurrency=8, rate_limit=0)
+        start = time.monotonic()
+        asyncio.run(tracker.run_async(re_raise_exception=True))
+
+        self.assertEqual(len(calls), 8)
+        self.assertLess(time.monotonic() - start, 8 * 0.2 / 2)
+
+    def test_close_requests_go_first(self):
+        calls = self.patch_api(make_positions(6))
+
+        tracker = self.make_tracker(AsyncOrderTracker, concurrency=1, rate_limit=0)
+        asyncio.run(tracker.run_async(re_raise_exception=True))
+
+        self.assertEqual([name for name, _, _ in calls], ['close'] * 3 + ['create'] * 3)
+
+    def test_rate_limit_spaces_requests(self):
+        calls = self.patch_api(make_positions(4))
+
+        tracker = self.make_tracker(AsyncOrderTracker, concurrency=4, rate_limit=20)
+        asyncio.run(tracker.run_async(re_raise_exception=True))
+
+        times = sorted(sent_at for _, _, sent_at in calls)
+        self.assertGreaterEqual(times[-1] - times[0], 3 * 0.05 * 0.9)
+
+    def test_cycle_bookkeeping_is_shared(self):
+        self.patch_api(make_positions(4))
+        tracker = self.make_tracker(AsyncOrderTracker, rate_limit=0)
+        tracker.position_snapshots = {positionId: None for positionId in range(90, 100)}
+        tracker.skipped_positions = 5
+        asyncio.run(tracker.run_async(re_raise_exception=True))
+
+        self.assertEqual(tracker.position_snapshots, {})
+        self.assertEqual(tracker.skipped_positions, 0)
+
+    def test_loop_mode_uses_the_scheduler(self):
+        with patch.object(async_order_tracker, 'AsyncOrderTracker') as mock_tracker, \
+                patch.object(async_order_tracker, 'create_scheduler') as mock_create_scheduler:
+            async_order_tracker.main(True)
+        mock_create_scheduler.assert_called_once_with(mock_tracker.return_value)
+        mock_create_scheduler.return_value.run.assert_called_once_with()
+
+
+class TestAsyncTrackerModes(unittest.TestCase):
+    def run_cycles(self, tracker_class, cycles=3):
+        exchange = FakeExchange(20, seed=1)
+        with FakeExchangeServer(exchange) as server, fake_exchange_api(server.url), \
+                patch.object(order_tracker, 'decision_engine', 'vectorized'), \
+                patch.object(order_tracker, 'stop_loss_dispatch', 'batch'), \
+                patch.object(order_tracker, 'orders_sync', 'book'):
+            tracker = tracker_class(saved_store=MemoryStore())
+            tracker.log = MagicMock()
+            for _ in range(cycles):
+                tracker.run(re_raise_exception=True)
+        return exchange, tracker
+
+    def test_vectorized_batch_and_book_match_sync_run(self):
+        sync_exchange, sync_tracker = self.run_cycles(OrderTracker)
+        async_exchange, async_tracker = self.run_cycles(AsyncOrderTracker)
+
+        self.assertEqual(async_exchange.requests, sync_exchange.requests)
+        self.assertGreater(async_exchange.requests['batchOrders'] + async_exchange.requests['cancelReplace'], 0)
+        self.assertEqual(async_exchange.requests['openOrders'], 1)
+        self.assertEqual(async_tracker.saved_entries.keys(), sync_tracker.saved_entries.keys())
+        # orderIds follow the order the concurrent requests arrived in
+        self.assertEqual(
+            sorted((order.symbol, order.positionSide, order.type) for order in async_tracker.order_book.open_orders()),
+            sorted((order.symbol, order.positionSide, order.type) for order in sync_tracker.order_book.open_orders()),
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
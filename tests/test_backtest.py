@@ -0,0 +1,71 @@
+import unittest
+from unittest.mock import patch
+import os
+import sys
+import tempfile
+import numpy as np
+import pandas as pd
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from backtest import (
+    DEFAULT_PARAMS,
+    BacktestTracker,
+    SimulatedExchange,
+    kline_cache_path,
+    parameter_grid,
+    replay,
+    run_backtests,
+)
+from order_tracker import OrderTracker
+
+
+def random_bars(count, seed):
+    rng = np.random.default_rng(seed)
+    close = 100 * np.cumprod(rng.normal(1, 0.003, count))
+    return close * (1 + abs(rng.normal(0, 0.001, count))), close * (1 - abs(rng.normal(0, 0.001, count))), close
+
+
+class TestBacktest(unittest.TestCase):
+    def test_long_stop_loss_is_trailed_and_filled(self):
+        # Entry at 100, take profit 101.5, profit threshold 100.75
+        close = [100, 100.5, 101, 101.2, 100.7]
+        high = [price + 0.05 for price in close]
+        low = [price - 0.05 for price in close]
+        low[-1] = 100.5
+
+        result = replay('BTC-USDT', high, low, close, {'side': 'LONG', 'fee': 0})
+
+        # Stop loss set once at 101 - (101.5 - 101) * 0.12 = 100.94, filled by the last bar
+        self.assertEqual(result['trades'], 1)
+        self.assertEqual(result['mutations'], 1)
+        self.assertAlmostEqual(result['pnl'], 0.0094)
+
+    def test_default_params_decide_like_order_tracker(self):
+        tracker = BacktestTracker(SimulatedExchange('X'), DEFAULT_PARAMS)
+        reference = OrderTracker(saved_store=tracker.saved_store)
+        self.assertAlmostEqual(tracker.get_short_stop_threshold(100, 101.5), reference.get_short_stop_threshold(100, 101.5))
+        np.testing.assert_allclose(tracker.get_long_thresholds(100, 98.5, 101.5), reference.get_long_thresholds(100, 98.5, 101.5))
+        self.assertEqual(tracker.get_sl_adjustment('X'), reference.get_sl_adjustment('X'))
+
+    def test_jobs_run_in_worker_processes_from_the_file_cache(self):
+        high, low, close = random_bars(3000, 1)
+        with tempfile.TemporaryDirectory() as data_dir, \
+                patch.dict(os.environ, {'BACKTEST_DATA_DIR': data_dir}), \
+                patch('backtest.backtest_data_dir', data_dir):
+            pd.DataFrame(
+                {'open': close, 'high': high, 'low': low, 'close': close, 'volume': 1},
+                index=pd.date_range('2024-01-01', periods=len(close), freq='5min', name='time'),
+            ).to_csv(kline_cache_path('BTC-USDT', '5m'))
+
+            jobs = [('BTC-USDT', '5m', params) for params in parameter_grid(side=['LONG', 'SHORT'], sl_adjustment=[0.12, 0.2])]
+            results = run_backtests(jobs, processes=2)
+
+        self.assertEqual(len(results), 4)
+        for result in results:
+            expected = replay('BTC-USDT', high, low, close, {key: result[key] for key in DEFAULT_PARAMS})
+            self.assertEqual(result['trades'], expected['trades'])
+            self.assertAlmostEqual(result['pnl'], expected['pnl'], places=6)
+
+
+if __name__ == '__main__':
+    unittest.main()
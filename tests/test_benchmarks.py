@@ -0,0 +1,49 @@
+import unittest
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from api_lib import open_positions
+from benchmarks.bench_cycle import bench_scale, compare, fake_exchange_api
+from benchmarks.fake_exchange import FakeExchange, FakeExchangeServer
+
+
+class TestFakeExchange(unittest.TestCase):
+    def test_serves_the_api_lib_endpoints(self):
+        exchange = FakeExchange(4)
+        with FakeExchangeServer(exchange) as server, fake_exchange_api(server.url):
+            positions = open_positions.get_open_positions_demo()
+            orders = open_positions.get_full_orders(limit=30)['data']['orders']
+            position = positions.iloc[0]
+            stop_order = next(order for order in orders if order['symbol'] == position['symbol']
+                              and order['positionSide'] == position['positionSide'] and order['type'] == 'STOP_MARKET')
+            replaced = open_positions.cancel_and_set_new(position['symbol'], position['positionSide'], 1, 99, stop_order)
+            created = open_positions.submit_stop_orders([(position['symbol'], position['positionSide'], 1, 98, None)])
+            closed = open_positions.close_position(position)
+
+        self.assertEqual(len(positions), 4)
+        self.assertEqual(len(orders), 8)
+        self.assertEqual([replaced['code'], created[0]['code'], closed['code']], [0, 0, 0])
+        self.assertEqual(len(exchange.positions), 4)
+        self.assertEqual(exchange.requests['batchOrders'], 1)
+
+
+class TestBenchCycle(unittest.TestCase):
+    def test_bench_scale_reports_latency_and_requests(self):
+        result = bench_scale(10, cycles=2)
+        self.assertEqual(result['cycles'], 2)
+        self.assertLessEqual(result['p50'], result['max'])
+        self.assertGreater(result['peak_alloc_bytes'], 0)
+        self.assertEqual(result['requests_per_cycle']['positions'], 1)
+        self.assertEqual(result['requests_per_cycle']['fullOrder'], 1)
+
+    def test_compare_flags_regressions(self):
+        baseline = {'10': {'p50': 0.01, 'p95': 0.02, 'cpu_per_cycle': 0.01, 'requests_per_cycle': {'positions': 1}}}
+        same = {'10': dict(baseline['10'], p50=0.011)}
+        slower = {'10': dict(baseline['10'], p50=0.02, requests_per_cycle={'positions': 2})}
+        self.assertEqual(compare(same, baseline), [])
+        self.assertEqual(len(compare(slower, baseline)), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+import unittest
+from unittest.mock import patch
+import math
+import os
+import random
+import sys
+import threading
+import numpy as np
+import pandas as pd
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from coefficient_calculator import CoefficientCalculator
+from kline_cache import CoefficientCache, KlineCache, interval_seconds
+
+
+def random_klines(count, start=0, seed=1):
+    rng = random.Random(seed)
+    close = 100.0
+    klines = []
+    for i in range(count):
+        open_ = close
+        close = open_ * rng.uniform(0.98, 1.02)
+        high = max(open_, close) * rng.uniform(1, 1.01)
+        low = min(open_, close) * rng.uniform(0.99, 1)
+        klines.append({'time': start + i * 60000, 'open': str(open_), 'close': str(close),
+                       'high': str(high), 'low': str(low), 'volume': '1'})
+    return klines
+
+
+def klines_frame(klines):
+    df = pd.DataFrame(klines)
+    for col in ['close', 'open', 'high', 'low']:
+        df[col] = df[col].astype(float)
+    return df
+
+
+class TestIndicatorState(unittest.TestCase):
+    def test_incremental_indicators_match_full_recalculation(self):
+        calculator = CoefficientCalculator()
+        klines = random_klines(200)
+        state = calculator.new_indicator_state()
+        rng = random.Random(2)
+        position = 0
+        while position < len(klines):
+            end = min(len(klines), position + rng.randint(1, 5))
+            # The forming candle is fetched again with a different close
+            forming = dict(klines[end - 1], close=str(float(klines[end - 1]['close']) * 1.001))
+            chunk = klines[max(0, position - 1):end - 1] + [forming]
+            state.update([(k['time'], float(k['high']), float(k['low']), float(k['close'])) for k in chunk])
+            df = klines_frame(klines[:end - 1] + [forming])
+
+            for expected, actual in ((calculator.calculate_atr(df), state.atr()),
+                                     (calculator.calculate_rsi(df), state.rsi())):
+                if math.isnan(expected):
+                    self.assertTrue(math.isnan(actual), end)
+                else:
+                    self.assertAlmostEqual(expected, actual, places=9)
+            position = end
+
+        self.assertFalse(np.isnan(state.atr()))
+
+
+class TestKlineCache(unittest.TestCase):
+    @patch('kline_cache.get_klines_data')
+    def test_only_new_candles_are_fetched(self, mock_get_klines_data):
+        klines = random_klines(40)
+        available = {'count': 30}
+
+        def get_klines_data(symbol, interval, limit, startTime=None):
+            data = klines[:available['count']]
+            if startTime is not None:
+                data = [k for k in data if k['time'] >= startTime]
+            return {'code': 0, 'data': list(reversed(data[-limit:] if startTime is None else data[:limit]))}
+
+        mock_get_klines_data.side_effect = get_klines_data
+        cache = KlineCache(backfill=1000, page_limit=4)
+        first = cache.coefficients('BTC-USDT', '5m', 100)
+        self.assertEqual(mock_get_klines_data.call_args.kwargs['startTime'], None)
+
+        available['count'] = 40
+        coefficients = cache.coefficients('BTC-USDT', '5m', 100)
+        calls = mock_get_klines_data.call_args_list[1:]
+        self.assertEqual(calls[0].kwargs['startTime'], klines[29]['time'])
+        # 11 candles from the forming one on, in pages of 4 that start at the last candle of the previous page
+        self.assertEqual(len(calls), 4)
+
+        expected = CoefficientCalculator().calculate_coefficients(klines_frame(klines), 100)
+        self.assertAlmostEqual(coefficients['atr'], expected['atr'], places=9)
+        self.assertAlmostEqual(coefficients['rsi'], expected['rsi'], places=9)
+        self.assertNotEqual(first['atr'], coefficients['atr'])
+
+
+class TestCoefficientCache(unittest.TestCase):
+    @patch('kline_cache.get_klines_data')
+    def test_symbols_are_computed_once_per_interval_and_concurrently(self, mock_get_klines_data):
+        klines = random_klines(100)
+        active = {'now': 0, 'max': 0}
+        lock = threading.Lock()
+
+        def get_klines_data(symbol, interval, limit, startTime=None):
+            with lock:
+                active['now'] += 1
+                active['max'] = max(active['max'], active['now'])
+            threading.Event().wait(0.02)
+            with lock:
+                active['now'] -= 1
+            return {'code': 0, 'data': klines if symbol != 'BAD-USDT' else []}
+
+        mock_get_klines_data.side_effect = get_klines_data
+        cache = CoefficientCache(interval='5m', max_workers=4)
+        self.assertEqual(cache.ttl, interval_seconds('5m'))
+        # 50 positions on 10 symbols
+        mark_prices = {f'S{i % 10}-USDT': 100.0 for i in range(50)}
+        mark_prices['BAD-USDT'] = 1.0
+
+        self.assertEqual(cache.refresh(mark_prices), 11)
+        self.assertEqual(mock_get_klines_data.call_count, 11)
+        self.assertGreater(active['max'], 1)
+        self.assertIsNone(cache.get('BAD-USDT'))
+        self.assertIn(cache.get('S3-USDT')['stop_loss_coefficient'], (0.10, 0.15, 0.20))
+
+        # Within the interval only the failed symbol is tried again
+        self.assertEqual(cache.refresh(mark_prices), 1)
+
+        cache.prune(['S1-USDT'])
+        self.assertEqual(list(cache.entries), ['S1-USDT'])
+        self.assertEqual(list(cache.kline_cache.states), [('S1-USDT', '5m')])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+import unittest
+from unittest.mock import patch, MagicMock
+import os
+import random
+import sys
+import numpy as np
+import pandas as pd
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from decision_engine import ACTION_CLOSE, ACTION_NONE, ACTION_UPDATE_STOP_LOSS, evaluate_positions
+from order_tracker import OrderTracker
+
+
+class TestEvaluatePositions(unittest.TestCase):
+    def test_known_cases(self):
+        actions, new_sl_price = evaluate_positions(
+            is_short=[False, False, True, True, True],
+            markPrice=[70, 120, 80, 95, 101],
+            avgPrice=[100, 100, 100, 100, 100],
+            stopPrice=[90, 98.5, 101.5, 101.5, 101.5],
+            take_profit_price=[101.5, 130, 98.5, 98.5, 98.5],
+            saved_markPrice=[np.nan, np.nan, np.nan, 90, np.nan],
+        )
+        self.assertEqual(
+            list(actions),
+            [ACTION_CLOSE, ACTION_UPDATE_STOP_LOSS, ACTION_UPDATE_STOP_LOSS, ACTION_NONE, ACTION_CLOSE],
+        )
+        self.assertEqual(new_sl_price[1], 120 - (130 - 120) * 0.12)
+        self.assertEqual(new_sl_price[2], 80 + (80 - 98.5) * 0.12)
+        self.assertTrue(np.isnan(new_sl_price[[0, 3, 4]]).all())
+
+
+class TestBatchMatchesRows(unittest.TestCase):
+    """Differential test: the vectorized path takes exactly the per-row decisions"""
+
+    def setUp(self):
+        self.tracker = OrderTracker()
+        self.tracker.log = MagicMock()
+
+    def random_state(self, rng, count):
+        positions, orders, saved = [], [], []
+        for i in range(count):
+            side = rng.choice(['LONG', 'SHORT'])
+            symbol = f'S{i}-USDT'
+            avgPrice = rng.uniform(0.01, 1000)
+            positions.append({'symbol': symbol, 'positionSide': side, 'positionId': i, 'positionAmt': rng.randint(1, 9),
+                              'avgPrice': avgPrice, 'markPrice': avgPrice * rng.uniform(0.9, 1.1)})
+            if rng.random() < 0.6:
+                orders.append({'symbol': symbol, 'positionSide': side, 'type': rng.choice(['STOP', 'STOP_MARKET']),
+                               'stopPrice': avgPrice * rng.uniform(0.9, 1.1), 'orderId': 10 * i, 'status': 'NEW'})
+            if rng.random() < 0.6:
+                orders.append({'symbol': symbol, 'positionSide': side, 'type': 'TAKE_PROFIT',
+                               'stopPrice': avgPrice * rng.uniform(0.9, 1.1), 'orderId': 10 * i + 1, 'status': 'NEW'})
+            if rng.random() < 0.5:
+                saved.append({'positionId': i, 'markPrice': avgPrice * rng.uniform(0.9, 1.1)})
+        return positions, pd.DataFrame(orders), pd.DataFrame(saved)
+
+    def decide(self, positions, orders, saved, batch):
+        tracker = self.tracker
+        tracker.open_orders = orders
+        tracker.orders_index = tracker.build_orders_index(orders)
+        tracker.saved_locally = saved
+        tracker.position_snapshots = {}
+        calls = []
+        with patch.object(tracker, 'close_position_order', lambda p: calls.append(('close', p['positionId']))), \
+                patch.object(tracker, 'update_stop_loss',
+                             lambda p, sl, order: calls.append(('update', p['positionId'], sl, order))), \
+                patch.object(tracker, 'update_saved_entry'), \
+                patch.object(tracker, 'remove_saved_entry'):
+            if batch:
+                decisions = tracker.process_positions_batch(positions)
+            else:
+                decisions = [tracker.process_position(position) for position in positions]
+        return decisions, calls
+
+    def test_batch_matches_rows(self):
+        rng = random.Random(11)
+        for count in (1, 10, 300):
+            positions, orders, saved = self.random_state(rng, count)
+            self.assertEqual(
+                self.decide(positions, orders, saved, batch=True),
+                self.decide(positions, orders, saved, batch=False),
+            )
+
+    def test_no_open_orders_uses_zero_take_profit(self):
+        rng = random.Random(3)
+        positions, _, saved = self.random_state(rng, 50)
+        self.assertEqual(
+            self.decide(positions, pd.DataFrame(), saved, batch=True),
+            self.decide(positions, pd.DataFrame(), saved, batch=False),
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
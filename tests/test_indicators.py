@@ -0,0 +1,87 @@
+import unittest
+import os
+import sys
+import numpy as np
+import pandas as pd
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from coefficient_calculator import CoefficientCalculator
+from indicators import atr_last, atr_series, rsi_last, rsi_series
+
+
+def reference_atr(df, period):
+    # The former pandas implementation
+    tr = np.maximum(df['high'] - df['low'],
+                    np.maximum(abs(df['high'] - df['close'].shift(1)),
+                               abs(df['low'] - df['close'].shift(1))))
+    return tr.rolling(period).mean().iloc[-1]
+
+
+def reference_rsi(df, period):
+    delta = df['close'].diff()
+    gain = np.where(delta > 0, delta, 0)
+    loss = np.where(delta < 0, -delta, 0)
+    rs = pd.Series(gain).rolling(period).mean() / pd.Series(loss).rolling(period).mean()
+    return (100 - (100 / (1 + rs))).iloc[-1]
+
+
+def random_frame(rng, count):
+    close = 100 * np.cumprod(rng.uniform(0.98, 1.02, count))
+    return pd.DataFrame({
+        'high': close * rng.uniform(1, 1.01, count),
+        'low': close * rng.uniform(0.99, 1, count),
+        'close': close,
+    })
+
+
+class TestIndicators(unittest.TestCase):
+    def test_match_the_pandas_implementation(self):
+        rng = np.random.default_rng(3)
+        for count in (5, 14, 15, 16, 300):
+            df = random_frame(rng, count)
+            np.testing.assert_allclose(atr_last(df['high'], df['low'], df['close'], 14), reference_atr(df, 14), rtol=1e-9)
+            np.testing.assert_allclose(rsi_last(df['close'], 14), reference_rsi(df, 14), rtol=1e-9)
+
+        flat = pd.Series([100.0] * 20)
+        self.assertTrue(np.isnan(rsi_last(flat)))
+        self.assertEqual(rsi_last(pd.Series(np.arange(20.0))), 100)
+
+    def test_stacked_symbols_and_float32(self):
+        rng = np.random.default_rng(4)
+        frames = [random_frame(rng, 100) for _ in range(4)]
+        high, low, close = (np.stack([df[col].to_numpy() for df in frames]) for col in ('high', 'low', 'close'))
+
+        atr = atr_last(high, low, close)
+        rsi = rsi_last(close)
+        self.assertEqual(atr.shape, (4,))
+        for i, df in enumerate(frames):
+            self.assertAlmostEqual(atr[i], reference_atr(df, 14), places=9)
+            self.assertAlmostEqual(rsi[i], reference_rsi(df, 14), places=9)
+
+        atr32 = atr_last(high.astype(np.float32), low.astype(np.float32), close.astype(np.float32))
+        self.assertEqual(atr32.dtype, np.float32)
+        np.testing.assert_allclose(atr32, atr, rtol=1e-4)
+
+        coefficients = CoefficientCalculator().calculate_coefficients_stacked(high, low, close, close[:, -1])
+        for i, df in enumerate(frames):
+            expected = CoefficientCalculator().calculate_coefficients(df, close[i, -1])
+            self.assertEqual(coefficients['stop_loss_coefficient'][i], expected['stop_loss_coefficient'])
+
+    def test_series_match_the_last_values(self):
+        df = random_frame(np.random.default_rng(6), 60)
+        high, low, close = (df[col].to_numpy() for col in ('high', 'low', 'close'))
+        atr = atr_series(high, low, close)
+        rsi = rsi_series(close)
+        for end in range(1, 61):
+            np.testing.assert_allclose(atr[end - 1], atr_last(high[:end], low[:end], close[:end]), rtol=1e-9)
+            np.testing.assert_allclose(rsi[end - 1], rsi_last(close[:end]), rtol=1e-9)
+
+    def test_caller_frame_is_not_modified(self):
+        df = random_frame(np.random.default_rng(5), 50)
+        before = df.copy()
+        CoefficientCalculator().calculate_coefficients(df, 100)
+        pd.testing.assert_frame_equal(df, before)
+
+
+if __name__ == '__main__':
+    unittest.main()
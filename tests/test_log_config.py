@@ -0,0 +1,116 @@
+import unittest
+from unittest.mock import patch
+from datetime import datetime
+import json
+import logging
+import logging.handlers
+import tempfile
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils import log_config
+from utils.log_config import ColorFormatter, DailyFileHandler, JsonFormatter
+
+
+def make_record(message, level=logging.INFO, created=None):
+    record = logging.LogRecord('main_log', level, __file__, 1, message, None, None)
+    if created is not None:
+        record.created = created
+    return record
+
+
+class FakeDatetime(datetime):
+    current = None
+
+    @classmethod
+    def now(cls, tz=None):
+        return cls.current
+
+
+class TestFormatters(unittest.TestCase):
+    def test_color_formatter_reuses_its_formatters(self):
+        formatter = ColorFormatter()
+        formatters = dict(formatter.formatters)
+        text = formatter.format(make_record('Closing BTCUSDT', logging.WARNING))
+        self.assertIn('WARNING', text)
+        self.assertTrue(text.endswith('Closing BTCUSDT'))
+        self.assertEqual(formatter.formatters, formatters)
+        self.assertIn('Custom', formatter.format(make_record('Custom', 25)))
+
+    def test_json_lines(self):
+        try:
+            raise ValueError('boom')
+        except ValueError:
+            record = logging.LogRecord('main_log', logging.ERROR, __file__, 1, 'Failed %s', ('BTCUSDT',), sys.exc_info())
+        entry = json.loads(JsonFormatter().format(record))
+        self.assertEqual((entry['level'], entry['logger'], entry['message']), ('ERROR', 'main_log', 'Failed BTCUSDT'))
+        self.assertIn('ValueError: boom', entry['exception'])
+
+
+class TestDailyFileHandler(unittest.TestCase):
+    def test_switches_file_at_midnight(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            with patch.object(log_config, 'datetime', FakeDatetime):
+                FakeDatetime.current = datetime(2026, 3, 1, 23, 59, 30)
+                handler = DailyFileHandler(tmp_dir)
+                handler.setFormatter(logging.Formatter('%(message)s'))
+                handler.handle(make_record('before', created=FakeDatetime.current.timestamp()))
+
+                FakeDatetime.current = datetime(2026, 3, 2, 0, 0, 5)
+                handler.handle(make_record('after', created=FakeDatetime.current.timestamp()))
+            handler.close()
+
+            with open(os.path.join(tmp_dir, '2026-01-03_log.log')) as f:
+                self.assertEqual(f.read(), 'before\n')
+            with open(os.path.join(tmp_dir, '2026-02-03_log.log')) as f:
+                self.assertEqual(f.read(), 'after\n')
+
+
+class TestQueueLogging(unittest.TestCase):
+    def setUp(self):
+        self.logger = logging.getLogger('main_log')
+        # Handlers and listener of other tests, put back in tearDown
+        self.saved = (self.logger.handlers[:], log_config.listener)
+        self.logger.handlers.clear()
+        log_config.listener = None
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.env = patch.dict(os.environ, {'LOG_DIR': self.tmp_dir.name})
+        self.env.start()
+
+    def tearDown(self):
+        log_config.stop_listener()
+        for handler in self.logger.handlers:
+            handler.close()
+        self.logger.handlers[:], log_config.listener = self.saved
+        self.env.stop()
+        self.tmp_dir.cleanup()
+
+    def written(self):
+        file_handler = log_config.listener.handlers[0]
+        # stop() drains the queue
+        log_config.stop_listener()
+        file_handler.close()
+        with open(file_handler.baseFilename) as f:
+            return f.read()
+
+    def test_records_are_written_by_the_listener(self):
+        logger = log_config.logging_config()
+        self.assertIsInstance(logger.handlers[0], logging.handlers.QueueHandler)
+        logger.info('queued record')
+        self.assertIn('queued record', self.written())
+
+    def test_json_exception_survives_the_queue(self):
+        with patch.object(log_config, 'log_format', 'json'):
+            logger = log_config.logging_config()
+        try:
+            raise ValueError('boom')
+        except ValueError:
+            logger.exception('Failed %s', 'BTCUSDT')
+        entry = json.loads(self.written())
+        self.assertEqual(entry['message'], 'Failed BTCUSDT')
+        self.assertIn('ValueError: boom', entry['exception'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import unittest
+from unittest.mock import patch, MagicMock
+import urllib.request
+import pandas as pd
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import order_tracker
+from order_tracker import OrderTracker
+from utils import metrics
+from utils.saved_store import MemoryStore
+
+
+class TestRegistry(unittest.TestCase):
+    def test_render_counters_and_histograms(self):
+        registry = metrics.Registry()
+        requests = registry.register(metrics.Counter('requests_total', 'Requests', ('endpoint',)))
+        latency = registry.register(metrics.Histogram('latency_seconds', 'Latency', buckets=(0.1, 1)))
+        requests.inc(endpoint='/a')
+        requests.inc(2, endpoint='/a')
+        requests.inc(endpoint='/b"c')
+        for value in (0.05, 0.1, 0.5, 3):
+            latency.observe(value)
+
+        text = registry.render()
+        self.assertIn('# TYPE requests_total counter', text)
+        self.assertIn('requests_total{endpoint="/a"} 3.0', text)
+        self.assertIn('requests_total{endpoint="/b\\"c"} 1.0', text)
+        self.assertIn('latency_seconds_bucket{le="0.1"} 2', text)
+        self.assertIn('latency_seconds_bucket{le="1.0"} 3', text)
+        self.assertIn('latency_seconds_bucket{le="+Inf"} 4', text)
+        self.assertIn('latency_seconds_count 4', text)
+        total, count = latency.get()
+        self.assertAlmostEqual(total, 3.65)
+        self.assertEqual(count, 4)
+        # Registering the same name again returns the first metric
+        self.assertIs(registry.register(metrics.Counter('requests_total', 'Requests', ('endpoint',))), requests)
+        with self.assertRaises(ValueError):
+            requests.inc(symbol='BTCUSDT')
+
+    def test_metrics_endpoint(self):
+        registry = metrics.Registry()
+        registry.register(metrics.Gauge('open_positions', 'Open positions')).set(3)
+        server = metrics.start_metrics_server(0, registry=registry)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        url = f"http://127.0.0.1:{server.server_address[1]}/metrics"
+        with urllib.request.urlopen(url, timeout=5) as response:
+            self.assertTrue(response.headers['Content-Type'].startswith('text/plain'))
+            self.assertIn('open_positions 3', response.read().decode())
+
+
+class TestTrackerInstrumentation(unittest.TestCase):
+    @patch('order_tracker.create_stop_order')
+    @patch('order_tracker.get_full_orders')
+    @patch('order_tracker.get_open_positions_demo')
+    def test_cycle_is_timed(self, mock_get_open_positions_demo, mock_get_full_orders, mock_create_stop_order):
+        tracker = OrderTracker(saved_store=MemoryStore())
+        tracker.log = MagicMock()
+        mock_get_open_positions_demo.return_value = pd.DataFrame({
+            'symbol': ['BTCUSDT'], 'positionSide': ['SHORT'], 'positionId': [1],
+            'positionAmt': [1], 'markPrice': [95], 'avgPrice': [100],
+        })
+        mock_get_full_orders.return_value = {'data': {'orders': []}}
+        cycles = order_tracker.cycle_seconds.get()[1]
+        positions = order_tracker.position_seconds.get()[1]
+        updates = order_tracker.position_decisions.get(decision='update_stop_loss')
+        fetches = order_tracker.phase_seconds.get(phase='get_open_positions')[1]
+
+        tracker.run(re_raise_exception=True)
+
+        self.assertEqual(order_tracker.cycle_seconds.get()[1], cycles + 1)
+        self.assertEqual(order_tracker.position_seconds.get()[1], positions + 1)
+        self.assertEqual(order_tracker.position_decisions.get(decision='update_stop_loss'), updates + 1)
+        self.assertEqual(order_tracker.phase_seconds.get(phase='get_open_positions')[1], fetches + 1)
+        self.assertEqual(order_tracker.positions_open.get(), 1)
+        tracker.log.warning.assert_not_called()
+
+    def test_overrun_warning(self):
+        tracker = OrderTracker(saved_store=MemoryStore())
+        tracker.log = MagicMock()
+        overruns = order_tracker.cycle_overruns.get()
+        with patch.object(order_tracker, 'sleep_interval', 0), patch.object(tracker, 'run_cycle'):
+            tracker.run()
+
+        self.assertEqual(order_tracker.cycle_overruns.get(), overruns + 1)
+        self.assertIn('longer than SLEEP_INTERVAL', tracker.log.warning.call_args.args[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
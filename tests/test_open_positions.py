@@ -0,0 +1,151 @@
+import unittest
+from unittest.mock import patch
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import sys
+import os
+import threading
+import requests
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from api_lib import open_positions
+from api_lib.rate_limiter import RequestBudget
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.requests.append((self.command, self.path, self.client_address))
+        if self.server.failures > 0:
+            self.server.failures -= 1
+            self.reply(503, {'code': 1, 'msg': 'busy'})
+        else:
+            self.reply(200, {'code': 0, 'data': {'price': '101.5'}})
+
+    do_POST = do_GET
+
+    def reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestSendRequest(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+        self.server.requests = []
+        self.server.failures = 0
+        thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+        url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        for name, value in (('APIURL', url), ('API_KEY', 'key'), ('API_SECRET', 'secret')):
+            patcher = patch.object(open_positions, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        patcher = patch.object(open_positions, 'session', open_positions.create_session(backoff=0))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_connection_is_reused_between_requests(self):
+        for _ in range(3):
+            self.assertEqual(open_positions.get_price('BTC-USDT'), 101.5)
+
+        client_addresses = {client_address for _, _, client_address in self.server.requests}
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(len(client_addresses), 1)
+
+    def test_get_is_retried_on_server_errors(self):
+        self.server.failures = 2
+        self.assertEqual(open_positions.get_price('BTC-USDT'), 101.5)
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_post_is_not_retried(self):
+        self.server.failures = 1
+        response = open_positions.close_position({
+            'positionId': '1', 'symbol': 'BTC-USDT', 'positionSide': 'LONG', 'positionAmt': 1,
+        })
+        self.assertEqual(response['code'], 1)
+        self.assertEqual(len(self.server.requests), 1)
+
+    @patch.object(open_positions, 'HTTP_READ_TIMEOUT', 0.2)
+    def test_stalled_response_times_out(self):
+        stalled = threading.Event()
+        self.addCleanup(stalled.set)
+
+        def stall(handler):
+            stalled.wait(5)
+
+        with patch.object(StubHandler, 'do_GET', stall):
+            with self.assertRaises(requests.exceptions.RequestException):
+                open_positions.send_request_demo(
+                    open_positions.GET, '/openApi/swap/v1/ticker/price', 'symbol=BTC-USDT', {}
+                )
+
+    def test_requests_are_counted_against_their_budget(self):
+        with patch.object(open_positions, 'request_budget', RequestBudget(read_rate=100, trade_rate=100)):
+            open_positions.get_price('BTC-USDT')
+            open_positions.create_stop_order('BTC-USDT', 'LONG', 1, 99)
+            stats = open_positions.get_rate_limit_stats(reset=True)
+
+        self.assertEqual(stats['read']['requests'], 1)
+        self.assertEqual(stats['trade']['requests'], 1)
+
+
+class TestSubmitStopOrders(unittest.TestCase):
+    def setUp(self):
+        self.requests = []
+        self.lock = threading.Lock()
+        patcher = patch.object(open_positions, 'send_request_demo', self.send_request)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def send_request(self, method, path, urlpa, payload, priority=None):
+        params = dict(param.split('=', 1) for param in urlpa.split('&'))
+        with self.lock:
+            self.requests.append((path, params, open_positions.get_credentials()))
+        if path.endswith('/batchOrders'):
+            orders = json.loads(params['batchOrders'])
+            return {'code': 0, 'data': {'orders': [
+                {'code': 101204, 'msg': 'Insufficient margin'} if order['symbol'] == 'BAD-USDT'
+                else {'orderId': i + 1, 'symbol': order['symbol']}
+                for i, order in enumerate(orders)
+            ]}}
+        if params['symbol'] == 'BAD-USDT':
+            raise requests.exceptions.ConnectionError('reset')
+        return {'code': 0, 'data': {'newOrderResponse': {'orderId': 99}}}
+
+    def test_creates_are_batched_and_results_mapped_per_order(self):
+        stop_order = {'orderId': 5, 'type': 'STOP_MARKET'}
+        mutations = [(f'C{i}-USDT', 'LONG', 1, 90 + i, None) for i in range(6)]
+        mutations[2] = ('BAD-USDT', 'LONG', 1, 90, None)
+        mutations += [('R-USDT', 'SHORT', 1, 110, stop_order), ('BAD-USDT', 'SHORT', 1, 110, stop_order)]
+
+        with open_positions.use_credentials('sub-key', 'sub-secret'):
+            responses = open_positions.submit_stop_orders(mutations)
+
+        self.assertEqual([response['code'] for response in responses], [0, 0, 101204, 0, 0, 0, 0, -1])
+        self.assertEqual(responses[5]['data']['order']['symbol'], 'C5-USDT')
+        batches = [params for path, params, _ in self.requests if path.endswith('/batchOrders')]
+        self.assertEqual([len(json.loads(params['batchOrders'])) for params in batches], [5, 1])
+        self.assertEqual(len(self.requests), 4)
+        self.assertEqual({credentials for _, _, credentials in self.requests}, {('sub-key', 'sub-secret')})
+
+    def test_failed_batch_fails_every_order_of_it(self):
+        with patch.object(open_positions, 'send_request_demo', return_value={'code': 100001, 'msg': 'signature'}):
+            responses = open_positions.create_stop_orders_batch([('A-USDT', 'LONG', 1, 90), ('B-USDT', 'LONG', 1, 90)])
+        self.assertEqual([response['code'] for response in responses], [100001, 100001])
+
+
+if __name__ == '__main__':
+    unittest.main()
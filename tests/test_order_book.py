@@ -0,0 +1,155 @@
+import unittest
+from unittest.mock import patch, MagicMock
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import order_tracker
+from order_book import OrderBook
+from order_tracker import OrderTracker
+from records import Order, Position
+from benchmarks.bench_cycle import fake_exchange_api
+from benchmarks.fake_exchange import FakeExchange, FakeExchangeServer
+from utils.saved_store import MemoryStore
+
+
+def order(orderId, updateTime, status='NEW', symbol='BTC-USDT', type='STOP_MARKET'):
+    return {
+        'orderId': orderId, 'symbol': symbol, 'positionSide': 'LONG', 'type': type,
+        'stopPrice': '99', 'status': status, 'updateTime': updateTime,
+    }
+
+
+def response(orders):
+    return {'code': 0, 'data': {'orders': orders}}
+
+
+class TestOrderBook(unittest.TestCase):
+    def setUp(self):
+        self.book = OrderBook(page_limit=2, full_sync_every=10, overlap=1000)
+        self.book.log = MagicMock()
+
+    @patch('order_book.time.time', return_value=100.0)
+    @patch('order_book.get_full_orders')
+    @patch('order_book.get_all_open_orders')
+    def test_incremental_sync_pages_back_to_the_cursor(self, mock_get_all_open_orders, mock_get_full_orders, mock_time):
+        mock_get_all_open_orders.return_value = response([order(1, 50), order(2, 60)])
+        self.assertEqual([o.orderId for o in self.book.sync()], [1, 2])
+        self.assertEqual(self.book.cursor, 99000)
+
+        # Newest first, pages continue from the oldest update of the last one
+        pages = {
+            None: [order(2, 99700, status='FILLED'), order(3, 99500)],
+            99500: [order(3, 99500), order(1, 99400, status='CANCELLED')],
+            99400: [order(1, 99400, status='CANCELLED')],
+        }
+        mock_get_full_orders.side_effect = lambda limit, startTime, endTime=None: response(pages[endTime])
+        self.assertEqual([o.orderId for o in self.book.sync()], [3])
+        self.assertEqual([call.kwargs['startTime'] for call in mock_get_full_orders.call_args_list], [99000] * 3)
+        self.assertEqual(
+            [call.kwargs.get('endTime') for call in mock_get_full_orders.call_args_list], [None, 99500, 99400],
+        )
+        self.assertEqual(self.book.cursor, 99700)
+        self.assertEqual(self.book.transferred, 5)
+        mock_get_all_open_orders.assert_called_once()
+
+    @patch('order_book.time.time', return_value=100.0)
+    @patch('order_book.get_full_orders')
+    @patch('order_book.get_all_open_orders')
+    def test_newest_first_history_is_applied_in_update_order(
+        self, mock_get_all_open_orders, mock_get_full_orders, mock_time,
+    ):
+        history = [order(orderId, 99000 + orderId * 100) for orderId in range(1, 6)]
+        history += [order(2, 99600, status='CANCELLED'), order(4, 99800, status='FILLED'), order(6, 99900)]
+
+        def get_full_orders(limit, startTime, endTime=float('inf')):
+            window = [o for o in history if startTime <= o['updateTime'] <= endTime]
+            return response(sorted(window, key=lambda o: o['updateTime'], reverse=True)[:limit])
+
+        mock_get_all_open_orders.return_value = response([])
+        self.book.sync()
+        mock_get_full_orders.side_effect = get_full_orders
+        self.assertEqual(sorted(o.orderId for o in self.book.sync()), [1, 3, 5, 6])
+        self.assertEqual(self.book.cursor, 99900)
+        self.assertFalse(self.book.needs_full_sync)
+
+        # Nothing changed, the next sync only reads the last update again
+        mock_get_full_orders.reset_mock()
+        self.assertEqual(sorted(o.orderId for o in self.book.sync()), [1, 3, 5, 6])
+        self.assertEqual(mock_get_full_orders.call_count, 1)
+
+    @patch('order_book.get_full_orders')
+    @patch('order_book.get_all_open_orders')
+    def test_page_within_one_millisecond_reloads(self, mock_get_all_open_orders, mock_get_full_orders):
+        mock_get_all_open_orders.return_value = response([])
+        self.book.sync()
+        mock_get_full_orders.return_value = response([order(1, 99500), order(2, 99500)])
+        self.book.sync()
+        self.assertEqual(mock_get_all_open_orders.call_count, 2)
+        self.assertEqual(mock_get_full_orders.call_count, 2)
+
+    @patch('order_book.get_full_orders')
+    @patch('order_book.get_all_open_orders')
+    def test_failed_sync_reloads_next_time(self, mock_get_all_open_orders, mock_get_full_orders):
+        mock_get_all_open_orders.return_value = response([order(1, 50)])
+        self.book.sync()
+        mock_get_full_orders.return_value = {'code': 100001, 'msg': 'signature'}
+        with self.assertRaises(RuntimeError):
+            self.book.sync()
+        self.assertTrue(self.book.needs_full_sync)
+        self.book.sync()
+        self.assertEqual(mock_get_all_open_orders.call_count, 2)
+
+    @patch('order_book.get_full_orders')
+    @patch('order_book.get_all_open_orders')
+    def test_periodic_full_sync(self, mock_get_all_open_orders, mock_get_full_orders):
+        self.book.full_sync_every = 2
+        mock_get_all_open_orders.return_value = response([])
+        mock_get_full_orders.return_value = response([])
+        for _ in range(6):
+            self.book.sync()
+        self.assertEqual(mock_get_all_open_orders.call_count, 2)
+        self.assertEqual(mock_get_full_orders.call_count, 4)
+
+
+class TestTrackerOrderBook(unittest.TestCase):
+    def test_stop_orders_beyond_the_last_30_are_found(self):
+        exchange = FakeExchange(40, volatility=0)
+        with FakeExchangeServer(exchange) as server, fake_exchange_api(server.url), \
+                patch.object(order_tracker, 'orders_sync', 'book'):
+            tracker = OrderTracker(saved_store=MemoryStore())
+            tracker.log = MagicMock()
+            tracker.run(re_raise_exception=True)
+            tracker.run(re_raise_exception=True)
+
+        self.assertEqual(len(tracker.order_records), 80)
+        for position in tracker.position_records:
+            self.assertIsNotNone(tracker.get_stop_order(position)[0])
+        self.assertEqual(exchange.requests['openOrders'], 1)
+        self.assertEqual(exchange.requests['fullOrder'], 1)
+        self.assertEqual(exchange.requests['order'], 0)
+        self.assertEqual(tracker.order_book.transferred, 0)
+
+    def test_own_stop_orders_update_the_book(self):
+        with patch.object(order_tracker, 'orders_sync', 'book'):
+            tracker = OrderTracker(saved_store=MemoryStore())
+        book = tracker.order_book
+        book.needs_full_sync = False
+        position = Position(symbol='BTC-USDT', positionId=7, positionSide='LONG', positionAmt='1')
+        stop_order = Order(orderId=11, symbol='BTC-USDT', positionSide='LONG', type='STOP_MARKET', stopPrice=98)
+        book.add(stop_order)
+
+        tracker.record_stop_order(position, 99, stop_order, {'code': 0, 'data': {'newOrderResponse': {'orderId': 12}}})
+        self.assertEqual(list(book.orders), ['12'])
+        self.assertEqual((book.orders['12'].stopPrice, book.orders['12'].positionId), (99, 7))
+
+        tracker.record_stop_order(position, 100, None, {'code': 0, 'data': {'order': {'orderId': 13}}})
+        self.assertEqual(list(book.orders), ['12', '13'])
+        self.assertFalse(book.needs_full_sync)
+
+        tracker.record_stop_order(position, 101, book.orders['13'], {'code': 109400, 'msg': 'Order not found'})
+        self.assertTrue(book.needs_full_sync)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,14 +3,24 @@ from unittest.mock import patch, MagicMock
 import pandas as pd
 import sys
 import os
+import random
+import tempfile
+import time
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from order_tracker import OrderTracker
+from utils.saved_store import SavedLocallyJournal
 
 class TestOrderTracker(unittest.TestCase):
     def setUp(self):
         self.tracker = OrderTracker()
         self.tracker.saved_locally = pd.DataFrame()
+        # Keep the tests away from the real saved_locally.json
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.tracker.saved_store = SavedLocallyJournal(
+            os.path.join(self.tmp_dir.name, 'saved_locally.json')
+        )
     
     @patch('order_tracker.create_stop_order')
     @patch('order_tracker.cancel_and_set_new')
@@ -255,6 +265,335 @@ class TestOrderTracker(unittest.TestCase):
         mock_create_stop_order.assert_not_called()
         mock_close_position_order.assert_not_called()
         mock_cancel_and_set_new.assert_not_called()
+
+    @patch('order_tracker.create_stop_order')
+    @patch('order_tracker.cancel_and_set_new')
+    @patch('order_tracker.close_position')
+    @patch('order_tracker.get_full_orders')
+    @patch('order_tracker.get_open_positions_demo')
+    @patch('order_tracker.logging_config')
+    def test_run_matches_orders_by_symbol_and_position_side(
+        self,
+        mock_logging_config,
+        mock_get_open_positions_demo,
+        mock_get_full_orders,
+        mock_close_position,
+        mock_cancel_and_set_new,
+        mock_create_stop_order,
+    ):
+        """
+        Test that every position picks the first open stop and take profit order of its own symbol and side
+        """
+        mock_logging_config.return_value = MagicMock()
+
+        positions_df = pd.DataFrame({
+            'symbol': ['BTCUSDT', 'ETHUSDT'],
+            'positionSide': ['LONG', 'LONG'],
+            'positionId': [1, 2],
+            'positionAmt': [0.5, 2],
+            'markPrice': [120, 230],
+            'avgPrice': [100, 200],
+        })
+        mock_get_open_positions_demo.return_value = positions_df
+
+        orders_df = pd.DataFrame({
+            'symbol': ['ETHUSDT', 'BTCUSDT', 'BTCUSDT', 'BTCUSDT', 'ETHUSDT', 'BTCUSDT'],
+            'positionSide': ['LONG', 'SHORT', 'LONG', 'LONG', 'LONG', 'LONG'],
+            'type': ['TAKE_PROFIT', 'STOP_MARKET', 'STOP_MARKET', 'STOP_MARKET', 'STOP', 'TAKE_PROFIT'],
+            'stopPrice': [240, 140, 95, 90, 190, 130],
+            'orderId': [10, 11, 12, 13, 14, 15],
+            'status': ['NEW', 'NEW', 'CANCELLED', 'NEW', 'NEW', 'NEW'],
+        })
+        mock_get_full_orders.return_value = {'data': {'orders': orders_df.to_dict('records')}}
+
+        self.tracker.run(re_raise_exception=True)
+
+        mock_close_position.assert_not_called()
+        mock_create_stop_order.assert_not_called()
+        self.assertEqual(mock_cancel_and_set_new.call_count, 2)
+
+        btc_call, eth_call = mock_cancel_and_set_new.call_args_list
+        self.assertEqual(btc_call.args[:3], ('BTCUSDT', 'LONG', 0.5))
+        self.assertAlmostEqual(btc_call.args[3], 120 - (130 - 120) * 0.12)
+        self.assertEqual(btc_call.args[4]['orderId'], 13)
+        self.assertEqual(eth_call.args[:3], ('ETHUSDT', 'LONG', 2))
+        self.assertAlmostEqual(eth_call.args[3], 230 - (240 - 230) * 0.12)
+        self.assertEqual(eth_call.args[4]['orderId'], 14)
+
+    @patch('order_tracker.create_stop_order')
+    @patch('order_tracker.cancel_and_set_new')
+    @patch('order_tracker.close_position')
+    @patch('order_tracker.get_full_orders')
+    @patch('order_tracker.get_open_positions_demo')
+    @patch('order_tracker.logging_config')
+    def test_run_removes_saved_entries_of_closed_positions(
+        self,
+        mock_logging_config,
+        mock_get_open_positions_demo,
+        mock_get_full_orders,
+        mock_close_position,
+        mock_cancel_and_set_new,
+        mock_create_stop_order,
+    ):
+        """
+        Test that saved entries of positions gone from the exchange are dropped once older than the retention window
+        """
+        mock_logging_config.return_value = MagicMock()
+
+        positions_df = pd.DataFrame({
+            'symbol': ['BTCUSDT'],
+            'positionSide': ['LONG'],
+            'positionId': [1],
+            'positionAmt': [0.5],
+            'markPrice': [99.5],
+            'avgPrice': [100],
+        })
+        mock_get_open_positions_demo.return_value = positions_df
+        mock_get_full_orders.return_value = {'data': {'orders': []}}
+
+        now = int(time.time() * 1000)
+        self.tracker.saved_locally = pd.DataFrame({
+            'symbol': ['BTCUSDT', 'ETHUSDT', 'SOLUSDT'],
+            'positionSide': ['LONG', 'LONG', 'SHORT'],
+            'positionId': [1, 2, 3],
+            'markPrice': [110, 200, 20],
+            'time': [now - 10 ** 9, now - 10 ** 9, now],
+        })
+
+        self.tracker.run(re_raise_exception=True)
+
+        # Open position 1 is kept even though it is old, closed position 3 is still within retention
+        self.assertEqual(list(self.tracker.saved_locally['positionId']), [1, 3])
+        mock_create_stop_order.assert_not_called()
+        reloaded = self.tracker.saved_store.load()
+        self.assertTrue(reloaded.empty)
+        with open(self.tracker.saved_store.journal_path) as f:
+            self.assertIn('"delete"', f.read())
+
+    @patch('order_tracker.create_stop_order')
+    @patch('order_tracker.cancel_and_set_new')
+    @patch('order_tracker.close_position')
+    @patch('order_tracker.get_full_orders')
+    @patch('order_tracker.get_open_positions_demo')
+    @patch('order_tracker.logging_config')
+    def test_run_skips_positions_that_cannot_change_decision(
+        self,
+        mock_logging_config,
+        mock_get_open_positions_demo,
+        mock_get_full_orders,
+        mock_close_position,
+        mock_cancel_and_set_new,
+        mock_create_stop_order,
+    ):
+        """
+        Test that a position is skipped while its markPrice stays between the thresholds and is processed once it crosses one
+        """
+        mock_logging_config.return_value = MagicMock()
+        orders = pd.DataFrame({
+            'symbol': ['BTCUSDT', 'BTCUSDT'],
+            'positionSide': ['LONG', 'LONG'],
+            'type': ['STOP_MARKET', 'TAKE_PROFIT'],
+            'stopPrice': [90, 130],
+            'orderId': [123, 124],
+            'status': ['NEW', 'NEW'],
+        }).to_dict('records')
+        mock_get_full_orders.side_effect = lambda limit: {'data': {'orders': [dict(order) for order in orders]}}
+
+        def positions(markPrice):
+            return pd.DataFrame({
+                'symbol': ['BTCUSDT'],
+                'positionSide': ['LONG'],
+                'positionId': [1],
+                'positionAmt': [0.5],
+                'markPrice': [markPrice],
+                'avgPrice': [100],
+            })
+
+        # Close below 95, new stop loss above 115
+        for markPrice, skipped in ((100, 0), (101, 1), (96, 1), (100, 1)):
+            mock_get_open_positions_demo.return_value = positions(markPrice)
+            self.tracker.run(re_raise_exception=True)
+            self.assertEqual(self.tracker.skipped_positions, skipped)
+        mock_cancel_and_set_new.assert_not_called()
+
+        mock_get_open_positions_demo.return_value = positions(116)
+        self.tracker.run(re_raise_exception=True)
+        self.assertEqual(self.tracker.skipped_positions, 0)
+        mock_cancel_and_set_new.assert_called_once()
+
+        # The saved entry changed the inputs, the position is evaluated again
+        mock_get_open_positions_demo.return_value = positions(100)
+        self.tracker.run(re_raise_exception=True)
+        self.assertEqual(self.tracker.skipped_positions, 0)
+        mock_close_position.assert_not_called()
+
+    @patch('order_tracker.stop_loss_dispatch', 'batch')
+    @patch('order_tracker.submit_stop_orders')
+    @patch('order_tracker.create_stop_order')
+    @patch('order_tracker.cancel_and_set_new')
+    @patch('order_tracker.close_position')
+    @patch('order_tracker.get_full_orders')
+    @patch('order_tracker.get_open_positions_demo')
+    def test_run_batches_stop_loss_updates(
+        self,
+        mock_get_open_positions_demo,
+        mock_get_full_orders,
+        mock_close_position,
+        mock_cancel_and_set_new,
+        mock_create_stop_order,
+        mock_submit_stop_orders,
+    ):
+        """
+        Test that the stop loss updates of a cycle are sent together and only the accepted ones are saved
+        """
+        mock_get_open_positions_demo.return_value = pd.DataFrame({
+            'symbol': ['BTCUSDT', 'ETHUSDT', 'SOLUSDT'],
+            'positionSide': ['SHORT', 'SHORT', 'LONG'],
+            'positionId': [1, 2, 3],
+            'positionAmt': [0.5, 2, 10],
+            'markPrice': [95, 95, 120],
+            'avgPrice': [100, 100, 100],
+        })
+        mock_get_full_orders.return_value = {'data': {'orders': [
+            {'symbol': 'SOLUSDT', 'positionSide': 'LONG', 'type': 'STOP_MARKET',
+             'stopPrice': 90, 'orderId': 7, 'status': 'NEW'},
+        ]}}
+        mock_submit_stop_orders.return_value = [
+            {'code': 0, 'data': {'order': {'orderId': 11}}},
+            {'code': 101204, 'msg': 'Insufficient margin'},
+            {'code': 0, 'data': {'order': {'orderId': 12}}},
+        ]
+
+        self.tracker.run(re_raise_exception=True)
+
+        mock_create_stop_order.assert_not_called()
+        mock_cancel_and_set_new.assert_not_called()
+        mock_submit_stop_orders.assert_called_once()
+        mutations = mock_submit_stop_orders.call_args.args[0]
+        self.assertEqual([mutation[0] for mutation in mutations], ['BTCUSDT', 'ETHUSDT', 'SOLUSDT'])
+        self.assertIsNone(mutations[0][4])
+        self.assertEqual(mutations[2][4]['orderId'], 7)
+
+        # ETHUSDT was rejected and is decided again in the next cycle
+        self.assertEqual(sorted(self.tracker.saved_locally['positionId']), [1, 3])
+        self.assertEqual(sorted(self.tracker.saved_store.load()['positionId']), [1, 3])
+        self.assertIsNone(self.tracker.pending_stop_losses)
+
+    @patch('order_tracker.create_stop_order')
+    @patch('order_tracker.cancel_and_set_new')
+    @patch('order_tracker.close_position')
+    @patch('order_tracker.get_full_orders')
+    @patch('order_tracker.get_open_positions_demo')
+    def test_run_with_adaptive_trailing(
+        self,
+        mock_get_open_positions_demo,
+        mock_get_full_orders,
+        mock_close_position,
+        mock_cancel_and_set_new,
+        mock_create_stop_order,
+    ):
+        """
+        Test that the stop loss is trailed by the coefficient of the symbol, and by the fixed factor without one
+        """
+        mock_get_open_positions_demo.return_value = pd.DataFrame({
+            'symbol': ['BTCUSDT', 'BTCUSDT', 'ETHUSDT'],
+            'positionSide': ['SHORT', 'SHORT', 'SHORT'],
+            'positionId': [1, 2, 3],
+            'positionAmt': [0.5, 1, 2],
+            'markPrice': [95, 95, 95],
+            'avgPrice': [100, 100, 100],
+        })
+        mock_get_full_orders.return_value = {'data': {'orders': []}}
+        coefficient_cache = MagicMock()
+        coefficient_cache.get.side_effect = lambda symbol: {'stop_loss_coefficient': 0.2} if symbol == 'BTCUSDT' else None
+        self.tracker.coefficient_cache = coefficient_cache
+
+        self.tracker.run(re_raise_exception=True)
+
+        coefficient_cache.refresh.assert_called_once_with({'BTCUSDT': 95.0, 'ETHUSDT': 95.0})
+        sl_prices = [call.args[3] for call in mock_create_stop_order.call_args_list]
+        # take_profit_price is 0 without orders
+        self.assertEqual(sl_prices, [95 + 95 * 0.2, 95 + 95 * 0.2, 95 + 95 * 0.12])
+
+    @patch('order_tracker.create_stop_order')
+    @patch('order_tracker.cancel_and_set_new')
+    @patch('order_tracker.close_position')
+    @patch('order_tracker.get_full_orders')
+    @patch('order_tracker.get_open_positions_demo')
+    def test_trailed_long_in_profit_is_skipped(
+        self, mock_get_open_positions_demo, mock_get_full_orders, mock_close_position,
+        mock_cancel_and_set_new, mock_create_stop_order,
+    ):
+        self.tracker.log = MagicMock()
+        orders = [
+            {'symbol': 'BTCUSDT', 'positionSide': 'LONG', 'type': 'STOP_MARKET', 'stopPrice': 90, 'orderId': 123, 'status': 'NEW'},
+            {'symbol': 'BTCUSDT', 'positionSide': 'LONG', 'type': 'TAKE_PROFIT', 'stopPrice': 130, 'orderId': 124, 'status': 'NEW'},
+        ]
+        mock_get_full_orders.side_effect = lambda limit: {'data': {'orders': [dict(order) for order in orders]}}
+
+        def positions(markPrice):
+            return pd.DataFrame({
+                'symbol': ['BTCUSDT'], 'positionSide': ['LONG'], 'positionId': [1],
+                'positionAmt': [0.5], 'markPrice': [markPrice], 'avgPrice': [100],
+            })
+
+        # Trailed once above profitThreshold, then evaluated once with the saved entry
+        for markPrice in (120, 120):
+            mock_get_open_positions_demo.return_value = positions(markPrice)
+            self.tracker.run(re_raise_exception=True)
+        mock_cancel_and_set_new.assert_called_once()
+
+        for markPrice in (120, 120.5, 121, 121.5, 120):
+            mock_get_open_positions_demo.return_value = positions(markPrice)
+            self.tracker.run(re_raise_exception=True)
+            self.assertEqual(self.tracker.skipped_positions, 1)
+        mock_cancel_and_set_new.assert_called_once()
+        mock_close_position.assert_not_called()
+
+    def test_skipped_positions_would_have_done_nothing(self):
+        """
+        Differential check: whenever the snapshot says a position can be skipped, processing it does nothing
+        """
+        tracker = self.tracker
+        tracker.log = MagicMock()
+        rng = random.Random(7)
+        with patch.object(tracker, 'close_position_order'), \
+                patch.object(tracker, 'update_stop_loss'), \
+                patch.object(tracker, 'update_saved_entry'):
+
+            def decide(position):
+                tracker.position_snapshots = {}
+                return tracker.process_position(position)
+
+            for _ in range(1000):
+                side = rng.choice(['LONG', 'SHORT'])
+                avgPrice = rng.uniform(50, 150)
+                orders = []
+                if rng.random() < 0.7:
+                    orders.append({'symbol': 'X', 'positionSide': side, 'type': 'STOP_MARKET',
+                                   'stopPrice': avgPrice * rng.uniform(0.8, 1.2), 'orderId': 1, 'status': 'NEW'})
+                if rng.random() < 0.7:
+                    orders.append({'symbol': 'X', 'positionSide': side, 'type': 'TAKE_PROFIT',
+                                   'stopPrice': avgPrice * rng.uniform(0.8, 1.2), 'orderId': 2, 'status': 'NEW'})
+                tracker.open_orders = pd.DataFrame(orders)
+                tracker.orders_index = tracker.build_orders_index(tracker.open_orders)
+                if rng.random() < 0.5:
+                    tracker.saved_locally = pd.DataFrame({'positionId': [1], 'markPrice': [avgPrice * rng.uniform(0.8, 1.2)]})
+                else:
+                    tracker.saved_locally = pd.DataFrame()
+
+                position = {'symbol': 'X', 'positionSide': side, 'positionId': 1, 'positionAmt': 1,
+                            'avgPrice': avgPrice, 'markPrice': avgPrice * rng.uniform(0.8, 1.2)}
+                if decide(position) is not None:
+                    continue
+                snapshots = tracker.position_snapshots
+
+                position['markPrice'] *= rng.uniform(0.97, 1.03)
+                tracker.position_snapshots = snapshots
+                tracker.skipped_positions = 0
+                tracker.process_position(position)
+                if tracker.skipped_positions:
+                    self.assertIsNone(decide(position), position)
     
 
 if __name__ == '__main__':
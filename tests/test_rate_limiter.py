@@ -0,0 +1,69 @@
+import unittest
+import os
+import sys
+import threading
+import time
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from api_lib.rate_limiter import PRIORITY_PROTECTIVE, PRIORITY_ROUTINE, RequestBudget, TokenBucket
+
+
+class TestTokenBucket(unittest.TestCase):
+    def test_burst_is_free_then_requests_are_paced(self):
+        bucket = TokenBucket(rate=20, capacity=3)
+        for _ in range(3):
+            self.assertLess(bucket.acquire(), 0.01)
+
+        waited = bucket.acquire()
+        self.assertGreater(waited, 0.03)
+        self.assertLess(waited, 0.2)
+
+        stats = bucket.stats(reset=True)
+        self.assertEqual(stats['requests'], 4)
+        self.assertAlmostEqual(stats['waited'], waited, places=3)
+        self.assertEqual(bucket.stats()['requests'], 0)
+
+    def test_zero_rate_disables_the_limit(self):
+        bucket = TokenBucket(rate=0)
+        for _ in range(100):
+            self.assertEqual(bucket.acquire(), 0.0)
+
+    def test_capacity_below_one_is_rejected(self):
+        with self.assertRaises(ValueError):
+            TokenBucket(rate=10, capacity=0.5)
+
+    def test_protective_requests_are_served_first(self):
+        bucket = TokenBucket(rate=10, capacity=1)
+        bucket.acquire()
+        served = []
+
+        def take(name, priority):
+            bucket.acquire(priority)
+            served.append(name)
+
+        threads = [threading.Thread(target=take, args=(f'routine{i}', PRIORITY_ROUTINE)) for i in range(2)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.02)
+        threads.append(threading.Thread(target=take, args=('close', PRIORITY_PROTECTIVE)))
+        threads[-1].start()
+        for thread in threads:
+            thread.join(2)
+
+        self.assertEqual(served[0], 'close')
+        self.assertEqual(sorted(served[1:]), ['routine0', 'routine1'])
+
+
+class TestRequestBudget(unittest.TestCase):
+    def test_read_and_trade_budgets_are_separate(self):
+        budget = RequestBudget(read_rate=1, trade_rate=1)
+        self.assertLess(budget.acquire('GET'), 0.01)
+        self.assertLess(budget.acquire('POST'), 0.01)
+
+        stats = budget.stats()
+        self.assertEqual(stats['read']['requests'], 1)
+        self.assertEqual(stats['trade']['requests'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+import unittest
+from unittest.mock import MagicMock
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import pandas as pd
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from order_tracker import OrderTracker
+from records import Order, Position, SavedEntry, to_frame
+from utils.saved_store import MemoryStore, SavedLocallyJournal
+
+
+class TestRecords(unittest.TestCase):
+    def test_dict_style_access(self):
+        position = Position.from_dict({'symbol': 'BTCUSDT', 'positionId': '1', 'markPrice': '100', 'leverage': 5})
+        self.assertEqual(position['symbol'], 'BTCUSDT')
+        self.assertEqual(position.markPrice, '100')
+        self.assertIsNone(position['avgPrice'])
+        position['markPrice'] = 101
+        self.assertEqual(position.markPrice, 101)
+        with self.assertRaises(KeyError):
+            position['leverage']
+        self.assertEqual(position.get('leverage', 0), 0)
+        self.assertIsNone(position.get('avgPrice', 0))
+        self.assertIsNone(position.get('to_dict'))
+        self.assertFalse(hasattr(position, '__dict__'))
+        self.assertEqual(Position.from_dict(position.to_dict()), position)
+
+    def test_from_rows_and_frames(self):
+        frame = pd.DataFrame({'orderId': [1, 2], 'symbol': ['A', 'B'], 'type': ['STOP', 'TAKE_PROFIT']})
+        orders = Order.from_rows(frame)
+        self.assertEqual([order['orderId'] for order in orders], [1, 2])
+        self.assertIs(Order.from_rows(orders)[0], orders[0])
+        self.assertEqual(Order.from_rows(None), [])
+        self.assertEqual(list(to_frame(orders)['symbol']), ['A', 'B'])
+        self.assertTrue(to_frame([]).empty)
+
+
+class TestTrackerRecords(unittest.TestCase):
+    def test_frame_views(self):
+        tracker = OrderTracker(saved_store=MemoryStore())
+        tracker.saved_locally = pd.DataFrame({'positionId': [1, 1, 2], 'markPrice': [100, 110, 200]})
+        # The first entry of a position wins, as with the former frame lookup
+        self.assertEqual(tracker.get_saved_entry(1)['markPrice'], 100)
+        self.assertEqual(tracker.get_saved_entry('2')['markPrice'], 200)
+        self.assertIsNone(tracker.get_saved_entry(3))
+        self.assertEqual(list(tracker.saved_locally['positionId']), [1, 2])
+
+        tracker.open_positions = pd.DataFrame({'symbol': ['BTCUSDT'], 'positionId': [1]})
+        self.assertIsInstance(tracker.position_records[0], Position)
+        self.assertEqual(tracker.open_positions.shape[0], 1)
+
+    def test_saved_entries_are_updated_in_place(self):
+        tracker = OrderTracker(saved_store=MemoryStore())
+        tracker.log = MagicMock()
+        position = Position(symbol='BTCUSDT', positionId=1, positionSide='LONG', positionAmt='1')
+        tracker.update_saved_entry(position, 99.0, None, 101.0)
+        tracker.update_saved_entry(position, 99.5, Order(orderId=7, type='STOP'), 102.0)
+
+        entry = tracker.get_saved_entry(1)
+        self.assertIsInstance(entry, SavedEntry)
+        self.assertEqual((entry.orderId, entry.type, entry.markPrice), (7, 'STOP', 102.0))
+        self.assertEqual(tracker.saved_changes['1']['stopPrice'], 99.5)
+
+        tracker.remove_saved_entry(1)
+        tracker.remove_saved_entry(2)
+        self.assertEqual(tracker.saved_entries, {})
+        self.assertEqual(tracker.saved_changes, {'1': None})
+
+    def test_core_path_does_not_import_pandas(self):
+        root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+        code = "import sys, order_tracker; print('pandas' in sys.modules)"
+        result = subprocess.run([sys.executable, '-c', code], cwd=root, capture_output=True, text=True, check=True)
+        self.assertEqual(result.stdout.strip(), 'False')
+
+
+class TestSnapshotFormat(unittest.TestCase):
+    def test_pandas_snapshots_load_and_compaction_writes_the_same_layout(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'saved_locally.json')
+            entries = [{'positionId': i, 'markPrice': 100.0 + i, 'orderId': None} for i in range(12)]
+            with open(path, 'w') as f:
+                pd.DataFrame(entries).to_json(f)
+
+            store = SavedLocallyJournal(path)
+            self.assertEqual(store.load_entries(), entries)
+
+            store.compact(entries[:3])
+            with open(path) as f:
+                self.assertEqual(json.load(f)['markPrice'], {'0': 100.0, '1': 101.0, '2': 102.0})
+            self.assertEqual(list(pd.read_json(path)['positionId']), [0, 1, 2])
+
+
+if __name__ == '__main__':
+    unittest.main()
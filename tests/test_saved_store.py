@@ -0,0 +1,176 @@
+import unittest
+from unittest.mock import patch, MagicMock
+import json
+import os
+import sys
+import tempfile
+import numpy as np
+import pandas as pd
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import order_tracker
+from api_lib.open_positions import use_credentials
+from order_tracker import OrderTracker
+from records import Position
+from utils.saved_store import RedisHashStore, SavedLocallyJournal
+
+
+def make_entry(positionId, markPrice):
+    return {
+        'symbol': 'BTCUSDT',
+        'orderId': None,
+        'positionSide': 'LONG',
+        'type': 'STOP_MARKET',
+        'stopPrice': markPrice * 0.99,
+        'positionId': positionId,
+        'markPrice': markPrice,
+        'time': 1729616475202,
+    }
+
+
+class TestSavedLocallyJournal(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.snapshot_path = os.path.join(self.tmp_dir.name, 'saved_locally.json')
+        self.store = SavedLocallyJournal(self.snapshot_path, compact_every=100)
+
+    def test_load_without_files_returns_empty_frame(self):
+        self.assertTrue(self.store.load().empty)
+
+    def test_save_skips_write_when_nothing_changed(self):
+        self.assertFalse(self.store.save(pd.DataFrame(), {}))
+        self.assertFalse(os.path.exists(self.store.journal_path))
+
+    def test_journal_is_replayed_over_snapshot(self):
+        snapshot = pd.DataFrame([make_entry(1, 100), make_entry(2, 200)])
+        with open(self.snapshot_path, 'w') as f:
+            snapshot.to_json(f)
+
+        changes = {'1': make_entry(np.int64(1), 110.0), '2': None, '3': make_entry('3', 300.0)}
+        self.assertTrue(self.store.save(snapshot, changes))
+        with open(self.store.journal_path) as f:
+            self.assertEqual(len(f.readlines()), 3)
+
+        loaded = SavedLocallyJournal(self.snapshot_path).load()
+        self.assertEqual([str(p) for p in loaded['positionId']], ['1', '3'])
+        self.assertEqual(loaded.iloc[0]['markPrice'], 110.0)
+
+    def test_table_is_built_only_for_compaction(self):
+        self.store.compact_every = 2
+        saved_locally = MagicMock(return_value=[make_entry(1, 100), make_entry(2, 200)])
+        self.store.save(saved_locally, {'1': make_entry(1, 100)})
+        saved_locally.assert_not_called()
+
+        self.store.save(saved_locally, {'2': make_entry(2, 200)})
+        saved_locally.assert_called_once_with()
+        self.assertEqual(len(SavedLocallyJournal(self.snapshot_path).load()), 2)
+
+    def test_compaction_rewrites_snapshot_and_truncates_journal(self):
+        self.store.compact_every = 2
+        saved_locally = pd.DataFrame([make_entry(1, 100), make_entry(2, 200)])
+        self.store.save(saved_locally, {'1': make_entry(1, 100)})
+        self.assertTrue(os.path.exists(self.store.journal_path))
+
+        self.store.save(saved_locally, {'2': make_entry(2, 200)})
+        self.assertFalse(os.path.exists(self.store.journal_path))
+        self.assertEqual(self.store.journal_size, 0)
+        with open(self.snapshot_path) as f:
+            self.assertEqual(len(json.load(f)['positionId']), 2)
+        self.assertEqual(len(SavedLocallyJournal(self.snapshot_path).load()), 2)
+
+    def test_torn_last_line_is_ignored(self):
+        self.store.save(pd.DataFrame(), {'1': make_entry(1, 100)})
+        with open(self.store.journal_path, 'a') as f:
+            f.write('{"op": "upsert", "positionId"')
+
+        loaded = SavedLocallyJournal(self.snapshot_path).load()
+        self.assertEqual(len(loaded), 1)
+
+    def test_appends_after_a_torn_line_are_kept(self):
+        self.store.save(pd.DataFrame(), {'1': make_entry(1, 100)})
+        with open(self.store.journal_path, 'a') as f:
+            f.write('{"op": "upsert", "positionId"')
+
+        store = SavedLocallyJournal(self.snapshot_path)
+        self.assertEqual(len(store.load()), 1)
+        store.save(pd.DataFrame(), {'2': make_entry(2, 200)})
+
+        loaded = SavedLocallyJournal(self.snapshot_path).load()
+        self.assertEqual([str(p) for p in loaded['positionId']], ['1', '2'])
+
+
+@unittest.skipIf(fakeredis is None, "fakeredis is not installed")
+class TestRedisHashStore(unittest.TestCase):
+    def setUp(self):
+        self.redis_client = fakeredis.FakeRedis()
+        self.store = RedisHashStore(self.redis_client, chunk_size=2)
+
+    def test_load_reads_only_requested_positions(self):
+        self.store.save(None, {str(i): make_entry(i, 100 + i) for i in range(5)})
+
+        loaded = self.store.load(['4', 1, '3', '42'])
+        self.assertEqual(sorted(loaded['positionId']), [1, 3, 4])
+        self.assertTrue(self.store.load([]).empty)
+        self.assertEqual(len(self.store.load()), 5)
+
+    def test_save_writes_only_changed_fields(self):
+        self.store.save(None, {'1': make_entry(1, 100), '2': make_entry(2, 200)})
+        self.assertFalse(self.store.save(None, {}))
+
+        self.store.save(None, {'1': None, '3': make_entry(3, 300)})
+        self.assertEqual(
+            sorted(self.redis_client.hkeys(self.store.key)), [b'2', b'3']
+        )
+
+    def test_trackers_sharing_the_hash_keep_each_others_entries(self):
+        other_store = RedisHashStore(self.redis_client)
+        self.store.save(None, {'1': make_entry(1, 100)})
+        other_store.save(None, {'2': make_entry(2, 200)})
+        self.store.save(None, {'1': make_entry(1, 110)})
+
+        loaded = other_store.load(['1', '2'])
+        self.assertEqual(sorted(loaded['markPrice']), [110, 200])
+
+    def test_collect_stale_keeps_open_and_recent_entries(self):
+        old_entry = dict(make_entry(1, 100), time=1000)
+        recent_entry = dict(make_entry(2, 200), time=2000)
+        open_entry = dict(make_entry(3, 300), time=1000)
+        self.store.save(None, {'1': old_entry, '2': recent_entry, '3': open_entry})
+
+        removed = self.store.collect_stale({'3'}, cutoff=1500)
+        self.assertEqual(removed, ['1'])
+        self.assertEqual(
+            sorted(self.redis_client.hkeys(self.store.key)), [b'2', b'3']
+        )
+
+    def test_sweep_keeps_the_live_entries_of_other_trackers(self):
+        trackers = []
+        for api_key, positionId in (('key-a', 1), ('key-b', 2)):
+            with use_credentials(api_key, 'secret'):
+                tracker = OrderTracker(redis_client=self.redis_client)
+                tracker.saved_store
+            tracker.log = MagicMock()
+            tracker.position_records = [Position(symbol='BTCUSDT', positionId=positionId, positionSide='LONG')]
+            trackers.append(tracker)
+        tracker_a, tracker_b = trackers
+        # A trailed position keeps the time of its last stop change, older than the retention
+        tracker_a.saved_store.save(None, {'1': dict(make_entry(1, 100), time=1000)})
+        tracker_b.saved_store.save(None, {'3': dict(make_entry(3, 300), time=1000)})
+
+        with patch.object(order_tracker, 'saved_locally_gc_every', 1):
+            tracker_b.collect_stale_saved_entries()
+
+        # B's closed position is gone, A's open one is still there
+        self.assertEqual(self.redis_client.hkeys(tracker_a.saved_store.key), [b'1'])
+        self.assertEqual(tracker_a.saved_store.load_entries(['1'])[0]['markPrice'], 100)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,238 @@
+import unittest
+from unittest.mock import patch, MagicMock
+import pandas as pd
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import order_tracker
+from order_tracker import OrderTracker
+from scheduler import CycleScheduler
+from utils.saved_store import MemoryStore
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def scheduler_with(clock, overrun='skip'):
+    return CycleScheduler(overrun=overrun, clock=clock, sleep=clock.sleep, log=MagicMock())
+
+
+class TestCycleScheduler(unittest.TestCase):
+    def test_cadence_does_not_drift(self):
+        clock = FakeClock()
+        scheduler = scheduler_with(clock)
+        starts = []
+
+        def job():
+            starts.append(clock.now)
+            clock.now += 3
+
+        scheduler.add('cycle', 10, job)
+        scheduler.run(max_runs=5)
+        self.assertEqual(starts, [0, 10, 20, 30, 40])
+
+    def test_overrun_skip(self):
+        clock = FakeClock()
+        scheduler = scheduler_with(clock, 'skip')
+        starts = []
+        durations = iter([25, 1, 1])
+
+        def job():
+            starts.append(clock.now)
+            clock.now += next(durations)
+
+        scheduled = scheduler.add('cycle', 10, job)
+        scheduler.run(max_runs=3)
+        # The slots at 10 and 20 passed while the first run took 25s
+        self.assertEqual(starts, [0, 30, 40])
+        self.assertEqual(scheduled.missed, 2)
+        scheduler.log.warning.assert_called_once()
+
+    def test_overrun_coalesce(self):
+        clock = FakeClock()
+        scheduler = scheduler_with(clock, 'coalesce')
+        starts = []
+        durations = iter([25, 1, 1])
+
+        def job():
+            starts.append(clock.now)
+            clock.now += next(durations)
+
+        scheduled = scheduler.add('cycle', 10, job)
+        scheduler.run(max_runs=3)
+        # One run right away for the slots at 10 and 20, then back on the grid
+        self.assertEqual(starts, [0, 25, 30])
+        self.assertEqual(scheduled.missed, 1)
+
+    def test_separate_cadences(self):
+        clock = FakeClock()
+        scheduler = scheduler_with(clock)
+        runs = []
+
+        def job(name):
+            def run():
+                runs.append((clock.now, name))
+                clock.now += 1
+            return run
+
+        scheduler.add('cycle', 30, job('cycle'), supersedes=('near',))
+        scheduler.add('near', 10, job('near'))
+        scheduler.run(max_runs=7)
+        # The full cycle covers the near slots at 0 and 30
+        self.assertEqual(runs, [
+            (0, 'cycle'), (10, 'near'), (20, 'near'), (30, 'cycle'), (40, 'near'), (50, 'near'), (60, 'cycle'),
+        ])
+
+    def test_failing_job_keeps_the_cadence(self):
+        clock = FakeClock()
+        scheduler = scheduler_with(clock)
+        scheduled = scheduler.add('cycle', 10, MagicMock(side_effect=RuntimeError('boom')))
+        scheduler.run(max_runs=3)
+        self.assertEqual(scheduled.runs, 3)
+        self.assertEqual(clock.now, 20)
+
+    def test_invalid_settings(self):
+        with self.assertRaises(ValueError):
+            CycleScheduler(overrun='queue')
+        with self.assertRaises(ValueError):
+            scheduler_with(FakeClock()).add('cycle', 0, MagicMock())
+
+
+class TestNearThresholdCycles(unittest.TestCase):
+    @patch('order_tracker.cancel_and_set_new')
+    @patch('order_tracker.close_position')
+    @patch('order_tracker.get_full_orders')
+    @patch('order_tracker.get_open_positions_demo')
+    def test_near_only_cycle(
+        self, mock_get_open_positions_demo, mock_get_full_orders, mock_close_position, mock_cancel_and_set_new,
+    ):
+        tracker = OrderTracker(saved_store=MemoryStore())
+        tracker.log = MagicMock()
+        orders = [
+            {'orderId': 11, 'symbol': 'BTCUSDT', 'positionSide': 'LONG', 'type': 'STOP_MARKET', 'stopPrice': 98.5, 'status': 'NEW'},
+            {'orderId': 12, 'symbol': 'BTCUSDT', 'positionSide': 'LONG', 'type': 'TAKE_PROFIT', 'stopPrice': 101.5, 'status': 'NEW'},
+            {'orderId': 21, 'symbol': 'ETHUSDT', 'positionSide': 'LONG', 'type': 'STOP_MARKET', 'stopPrice': 98.5, 'status': 'NEW'},
+            {'orderId': 22, 'symbol': 'ETHUSDT', 'positionSide': 'LONG', 'type': 'TAKE_PROFIT', 'stopPrice': 101.5, 'status': 'NEW'},
+        ]
+        mock_get_full_orders.side_effect = lambda limit: {'data': {'orders': [dict(order) for order in orders]}}
+
+        def positions(markPrices):
+            return pd.DataFrame({
+                'symbol': ['BTCUSDT', 'ETHUSDT'], 'positionSide': ['LONG', 'LONG'], 'positionId': [1, 2],
+                'positionAmt': [1, 1], 'markPrice': markPrices, 'avgPrice': [100, 100],
+            })
+
+        # No-action range of both positions is [99.25, 100.75]
+        mock_get_open_positions_demo.return_value = positions([100, 100.7])
+        tracker.run(re_raise_exception=True)
+        self.assertEqual(mock_get_full_orders.call_count, 1)
+        self.assertFalse(tracker.is_near_threshold(positions([100, 100.7]).iloc[0]))
+        self.assertTrue(tracker.is_near_threshold(positions([100, 100.7]).iloc[1]))
+
+        # Orders are reused, only ETHUSDT is evaluated and moves past the profit threshold
+        mock_get_open_positions_demo.return_value = positions([100, 100.8])
+        with patch.object(tracker, 'process_position', wraps=tracker.process_position) as process_position:
+            tracker.run(re_raise_exception=True, near_only=True)
+        self.assertEqual([call.args[0]['symbol'] for call in process_position.call_args_list], ['ETHUSDT'])
+        self.assertEqual(mock_get_full_orders.call_count, 1)
+        mock_cancel_and_set_new.assert_called_once()
+        self.assertTrue(tracker.orders_stale)
+
+        # Our stop loss update changed the orders, the next near cycle fetches them again
+        tracker.run(re_raise_exception=True, near_only=True)
+        self.assertEqual(mock_get_full_orders.call_count, 2)
+
+    @patch('order_tracker.cancel_and_set_new')
+    @patch('order_tracker.get_full_orders')
+    @patch('order_tracker.get_open_positions_demo')
+    def test_trailed_long_in_profit_stays_on_the_full_cadence(
+        self, mock_get_open_positions_demo, mock_get_full_orders, mock_cancel_and_set_new,
+    ):
+        tracker = OrderTracker(saved_store=MemoryStore())
+        tracker.log = MagicMock()
+        orders = [
+            {'orderId': 11, 'symbol': 'BTCUSDT', 'positionSide': 'LONG', 'type': 'STOP_MARKET', 'stopPrice': 90, 'status': 'NEW'},
+            {'orderId': 12, 'symbol': 'BTCUSDT', 'positionSide': 'LONG', 'type': 'TAKE_PROFIT', 'stopPrice': 130, 'status': 'NEW'},
+        ]
+        mock_get_full_orders.side_effect = lambda limit: {'data': {'orders': [dict(order) for order in orders]}}
+
+        def positions(markPrice):
+            return pd.DataFrame({
+                'symbol': ['BTCUSDT'], 'positionSide': ['LONG'], 'positionId': [1],
+                'positionAmt': [1], 'markPrice': [markPrice], 'avgPrice': [100],
+            })
+
+        # The stop loss is set above profitThreshold (115), the next full cycle does nothing
+        for markPrice in (120, 120):
+            mock_get_open_positions_demo.return_value = positions(markPrice)
+            tracker.run(re_raise_exception=True)
+        mock_cancel_and_set_new.assert_called_once()
+        self.assertFalse(tracker.is_near_threshold(positions(121).iloc[0]))
+
+        mock_get_open_positions_demo.return_value = positions(121)
+        with patch.object(tracker, 'process_position') as process_position:
+            tracker.run(re_raise_exception=True, near_only=True)
+        process_position.assert_not_called()
+
+    @patch('order_tracker.decision_engine', 'vectorized')
+    @patch('order_tracker.near_interval', 5)
+    @patch('order_tracker.sleep_interval', 60)
+    @patch('order_tracker.get_full_orders')
+    @patch('order_tracker.get_open_positions_demo')
+    def test_vectorized_engine_keeps_the_near_cadence(self, mock_get_open_positions_demo, mock_get_full_orders):
+        tracker = OrderTracker(saved_store=MemoryStore())
+        tracker.log = MagicMock()
+        orders = [
+            {'orderId': 11, 'symbol': 'BTCUSDT', 'positionSide': 'LONG', 'type': 'STOP_MARKET', 'stopPrice': 90, 'status': 'NEW'},
+            {'orderId': 12, 'symbol': 'BTCUSDT', 'positionSide': 'LONG', 'type': 'TAKE_PROFIT', 'stopPrice': 130, 'status': 'NEW'},
+            {'orderId': 21, 'symbol': 'ETHUSDT', 'positionSide': 'LONG', 'type': 'STOP_MARKET', 'stopPrice': 90, 'status': 'NEW'},
+            {'orderId': 22, 'symbol': 'ETHUSDT', 'positionSide': 'LONG', 'type': 'TAKE_PROFIT', 'stopPrice': 130, 'status': 'NEW'},
+        ]
+        mock_get_full_orders.side_effect = lambda limit: {'data': {'orders': [dict(order) for order in orders]}}
+        # No-action range of both positions is [95, 115], ETHUSDT is near its profit threshold
+        mock_get_open_positions_demo.return_value = pd.DataFrame({
+            'symbol': ['BTCUSDT', 'ETHUSDT'], 'positionSide': ['LONG', 'LONG'], 'positionId': [1, 2],
+            'positionAmt': [1, 1], 'markPrice': [100, 114.9], 'avgPrice': [100, 100],
+        })
+
+        scheduler = order_tracker.create_scheduler(tracker)
+        clock = FakeClock()
+        scheduler.clock, scheduler.sleep = clock, clock.sleep
+        evaluated = []
+        skipped = []
+
+        def process_positions_batch(positions):
+            evaluated.append([position['symbol'] for position in positions])
+            decisions = batch(positions)
+            skipped.append(tracker.skipped_positions)
+            return decisions
+
+        batch = tracker.process_positions_batch
+        with patch.object(tracker, 'process_positions_batch', side_effect=process_positions_batch):
+            scheduler.run(max_runs=4)
+
+        # A full cycle, then near cycles that only look at ETHUSDT and skip it while unchanged
+        self.assertEqual(evaluated, [['BTCUSDT', 'ETHUSDT'], ['ETHUSDT'], ['ETHUSDT'], ['ETHUSDT']])
+        self.assertEqual(skipped, [0, 1, 1, 1])
+        self.assertEqual([job.runs for job in scheduler.jobs], [1, 3])
+
+    def test_create_scheduler(self):
+        tracker = MagicMock()
+        with patch.object(order_tracker, 'near_interval', 5), patch.object(order_tracker, 'sleep_interval', 60):
+            scheduler = order_tracker.create_scheduler(tracker)
+        self.assertEqual([(job.name, job.interval) for job in scheduler.jobs], [('cycle', 60), ('near', 5)])
+        scheduler.jobs[1].job()
+        tracker.run.assert_called_once_with(near_only=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+import unittest
+from unittest.mock import patch, MagicMock
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import sha256
+from urllib.parse import parse_qsl, urlsplit
+import hmac
+import json
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from api_lib import open_positions
+from api_lib.signer import RequestSigner, encode_params, get_signer
+from benchmarks.bench_signing import run_benchmarks
+
+
+def reference_sign(secret, payload):
+    return hmac.new(secret.encode('utf-8'), payload.encode('utf-8'), digestmod=sha256).hexdigest()
+
+
+class TestEncodeParams(unittest.TestCase):
+    def test_timestamp_is_added_once(self):
+        self.assertEqual(encode_params({'symbol': 'BTC-USDT', 'limit': 30}, timestamp=5), 'limit=30&symbol=BTC-USDT&timestamp=5')
+        self.assertEqual(encode_params({'timestamp': '7', 'limit': 30}, timestamp=5), 'limit=30&timestamp=7')
+        self.assertEqual(encode_params({}, timestamp=5), 'timestamp=5')
+        query = open_positions.parseParam({'timestamp': '7', 'limit': 30})
+        self.assertEqual(query.count('timestamp='), 1)
+
+    def test_values_are_escaped_for_the_url(self):
+        batch = json.dumps([{'symbol': 'BTC-USDT', 'stopPrice': 99.5}], separators=(',', ':'))
+        query = encode_params({'batchOrders': batch, 'note': 'a&b=c d+é'}, timestamp=5)
+        # The signature covers the unescaped query, the escaped one decodes to the same params
+        self.assertEqual(query, f'batchOrders={batch}&note=a&b=c d+é&timestamp=5')
+        self.assertNotIn('"', query.encoded)
+        self.assertEqual(query.encoded.count('&'), 2)
+        self.assertEqual(dict(parse_qsl(query.encoded)), {'batchOrders': batch, 'note': 'a&b=c d+é', 'timestamp': '5'})
+
+
+class TestRequestSigner(unittest.TestCase):
+    def test_signature_matches_a_fresh_hmac(self):
+        signer = RequestSigner('secret')
+        for payload in ('timestamp=1', 'limit=30&timestamp=2', ''):
+            self.assertEqual(signer.sign(payload), reference_sign('secret', payload))
+        self.assertIs(get_signer('secret'), get_signer('secret'))
+        self.assertEqual(open_positions.get_sign('secret', 'timestamp=1'), reference_sign('secret', 'timestamp=1'))
+
+    def test_concurrent_signing(self):
+        signer = RequestSigner('secret')
+        payloads = [f'orderId={i}&timestamp={i}' for i in range(200)]
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            signatures = list(executor.map(signer.sign, payloads))
+        self.assertEqual(signatures, [reference_sign('secret', payload) for payload in payloads])
+
+    def test_request_url(self):
+        session = MagicMock()
+        session.request.return_value.json.return_value = {'code': 0, 'data': {'orders': []}}
+        with patch.object(open_positions, 'session', session), \
+                patch.object(open_positions, 'APIURL', 'https://api.test'), \
+                open_positions.use_credentials('key', 'secret'):
+            open_positions.create_stop_orders_batch([('BTC-USDT', 'LONG', 1, 99)])
+
+        url = urlsplit(session.request.call_args.args[1])
+        query, signature = url.query.split('&signature=')
+        params = dict(parse_qsl(query))
+        self.assertEqual(json.loads(params['batchOrders'])[0]['symbol'], 'BTC-USDT')
+        unescaped = '&'.join(f'{key}={value}' for key, value in params.items())
+        self.assertEqual(signature, reference_sign('secret', unescaped))
+
+
+class TestBenchSigning(unittest.TestCase):
+    def test_reports_throughput(self):
+        results = run_benchmarks(50)
+        self.assertEqual(set(results), {'fullOrder', 'cancelReplace', 'batchOrders'})
+        self.assertGreater(results['fullOrder']['signer_per_s'], 0)
+        self.assertGreater(results['batchOrders']['signer_sent_per_s'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import unittest
+from unittest.mock import patch, MagicMock
+import subprocess
+import tempfile
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import order_tracker
+from order_tracker import OrderTracker
+from utils.saved_store import SavedLocallyJournal
+
+
+class TestStartup(unittest.TestCase):
+    def test_import_defers_heavy_modules(self):
+        root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+        heavy = ['pandas', 'numpy', 'redis', 'requests', 'colorama', 'http.server', 'kline_cache']
+        code = f"import sys, order_tracker; print([name for name in {heavy!r} if name in sys.modules])"
+        result = subprocess.run([sys.executable, '-c', code], cwd=root, capture_output=True, text=True, check=True)
+        self.assertEqual(result.stdout.strip(), '[]')
+
+    @patch('order_tracker.connect_redis')
+    @patch('order_tracker.get_full_orders')
+    @patch('order_tracker.get_open_positions_demo')
+    def test_no_positions_does_not_open_the_store(
+        self, mock_get_open_positions_demo, mock_get_full_orders, mock_connect_redis,
+    ):
+        mock_get_open_positions_demo.return_value = []
+        mock_get_full_orders.return_value = {'data': {'orders': []}}
+        tracker = OrderTracker()
+        tracker.log = MagicMock()
+        tracker.run(re_raise_exception=True)
+
+        mock_connect_redis.assert_not_called()
+        self.assertIsNone(tracker.store)
+
+    @patch('order_tracker.connect_redis')
+    def test_file_backend_opens_the_journal(self, mock_connect_redis):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'saved_locally.json')
+            with patch.object(order_tracker, 'saved_locally_backend', 'file'), \
+                    patch.object(order_tracker, 'saved_locally_file', path):
+                tracker = OrderTracker()
+                self.assertIsInstance(tracker.saved_store, SavedLocallyJournal)
+        mock_connect_redis.assert_not_called()
+
+    @patch('order_tracker.connect_redis', return_value=None)
+    def test_redis_backend_requires_redis(self, mock_connect_redis):
+        with patch.object(order_tracker, 'saved_locally_backend', 'redis'):
+            tracker = OrderTracker()
+            with self.assertRaises(RuntimeError):
+                tracker.saved_store
+
+    def test_missing_redis_port_means_no_redis(self):
+        log = MagicMock()
+        with patch.dict(os.environ):
+            os.environ.pop('REDIS_PORT', None)
+            self.assertIsNone(order_tracker.connect_redis(log))
+            os.environ['REDIS_PORT'] = 'not-a-port'
+            self.assertIsNone(order_tracker.connect_redis(log))
+        log.error.assert_called()
+
+    def test_unknown_arguments_run_once(self):
+        with patch.object(order_tracker, 'OrderTracker'), \
+                patch.object(order_tracker, 'create_scheduler') as mock_create_scheduler:
+            order_manager = order_tracker.main(['now', '--verbose', 'extra'])
+        order_manager.run.assert_called_once_with()
+        mock_create_scheduler.assert_not_called()
+
+    def test_single_shot_reports_timing(self):
+        with patch.object(order_tracker, 'OrderTracker') as mock_tracker:
+            order_manager = order_tracker.main([])
+        order_manager.run.assert_called_once_with()
+        message = order_manager.log.info.call_args.args[0]
+        self.assertIn('imports', message)
+        self.assertIn('init', message)
+        self.assertIn('run', message)
+        mock_tracker.assert_called_once_with()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,157 @@
+import unittest
+from unittest.mock import patch, MagicMock
+import asyncio
+import gzip
+import json
+import os
+import sys
+import tempfile
+import pandas as pd
+
+try:
+    import websockets
+except ImportError:
+    websockets = None
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from stream_tracker import StreamingOrderTracker
+from utils.saved_store import SavedLocallyJournal
+
+
+def mark_price_frame(symbol, price):
+    message = {'dataType': f'{symbol}@markPrice', 'data': {'e': 'markPriceUpdate', 's': symbol, 'p': str(price)}}
+    return gzip.compress(json.dumps(message).encode())
+
+
+class ReplayServer:
+    """Local WebSocket server that records subscriptions and replays the given frames"""
+
+    def __init__(self, frames, subscriptions_expected=0):
+        self.frames = frames
+        self.subscriptions_expected = subscriptions_expected
+        self.received = []
+        self.server = None
+
+    async def handler(self, ws):
+        for _ in range(self.subscriptions_expected):
+            self.received.append(json.loads(await ws.recv()))
+        await ws.send('Ping')
+        self.received.append(await ws.recv())
+        for frame in self.frames:
+            await ws.send(frame)
+            await asyncio.sleep(0.01)
+        await ws.wait_closed()
+
+    async def start(self):
+        self.server = await websockets.serve(self.handler, '127.0.0.1', 0)
+        return f"ws://127.0.0.1:{self.server.sockets[0].getsockname()[1]}"
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+
+@unittest.skipIf(websockets is None, "websockets is not installed")
+class TestStreamingOrderTracker(unittest.TestCase):
+    def setUp(self):
+        self.positions_df = pd.DataFrame({
+            'symbol': ['BTC-USDT', 'ETH-USDT'],
+            'positionSide': ['LONG', 'SHORT'],
+            'positionId': [1, 2],
+            'positionAmt': [0.5, 1],
+            'markPrice': [100.0, 100.2],
+            'avgPrice': [100.0, 100.0],
+        })
+        self.mocks = {}
+        targets = {
+            'order_tracker.get_open_positions_demo': MagicMock(return_value=self.positions_df),
+            'order_tracker.get_full_orders': MagicMock(return_value={'data': {'orders': []}}),
+            'order_tracker.close_position': MagicMock(return_value={'code': 0}),
+            'order_tracker.create_stop_order': MagicMock(return_value={'code': 0}),
+            'order_tracker.cancel_and_set_new': MagicMock(return_value={'code': 0}),
+            'stream_tracker.create_listen_key': MagicMock(return_value='listen-key'),
+            'stream_tracker.stream_reconcile_debounce': 0.01,
+        }
+        for target, mock in targets.items():
+            patcher = patch(target, mock)
+            self.mocks[target.split('.')[-1]] = patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def make_tracker(self, market_url, user_url=None):
+        tracker = StreamingOrderTracker(market_url, user_url, use_user_stream=user_url is not None)
+        tracker.saved_locally = pd.DataFrame()
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        tracker.saved_store = SavedLocallyJournal(os.path.join(tmp_dir.name, 'saved_locally.json'))
+        return tracker
+
+    async def run_until(self, tracker, condition, timeout=5):
+        task = asyncio.create_task(tracker.run_stream())
+        deadline = asyncio.get_running_loop().time() + timeout
+        while not condition() and asyncio.get_running_loop().time() < deadline:
+            await asyncio.sleep(0.01)
+        tracker.stop_event.set()
+        await task
+
+    def test_mark_price_ticks_reevaluate_only_the_affected_position(self):
+        async def scenario():
+            server = ReplayServer([
+                mark_price_frame('BTC-USDT', 99.5),
+                mark_price_frame('BTC-USDT', 99.0),
+                mark_price_frame('SOL-USDT', 10),
+            ], subscriptions_expected=2)
+            url = await server.start()
+            tracker = self.make_tracker(url)
+            close_position = self.mocks['close_position']
+            await self.run_until(tracker, lambda: close_position.called and tracker.reconciliations >= 2)
+            await server.stop()
+            return tracker, server
+
+        tracker, server = asyncio.run(scenario())
+
+        self.assertEqual(
+            sorted(message['dataType'] for message in server.received[:2]),
+            ['BTC-USDT@markPrice', 'ETH-USDT@markPrice'],
+        )
+        self.assertEqual(server.received[2], 'Pong')
+        self.mocks['close_position'].assert_called_once()
+        self.assertEqual(self.mocks['close_position'].call_args.args[0]['symbol'], 'BTC-USDT')
+        self.mocks['create_stop_order'].assert_not_called()
+        # Initial pass over both positions, then only BTC ticks and the REST price after the close
+        self.assertLessEqual(tracker.evaluations, 5)
+        self.assertEqual(self.mocks['get_open_positions_demo'].call_count, tracker.reconciliations)
+
+    def test_ticks_are_evaluated_on_a_copy(self):
+        tracker = self.make_tracker('ws://unused')
+        tracker.reconcile()
+        tracker.dirty_event = MagicMock()
+        record = tracker.positions[1]
+        tracker.on_market_message({'data': {'e': 'markPriceUpdate', 's': 'BTC-USDT', 'p': '99.5'}})
+        self.assertEqual(record['markPrice'], 100.0)
+
+        evaluated = []
+        with patch.object(tracker, 'process_position', side_effect=evaluated.append):
+            tracker.evaluate_symbols({'BTC-USDT': tracker.mark_prices['BTC-USDT']})
+        self.assertEqual(evaluated[0]['markPrice'], 99.5)
+        self.assertIsNot(evaluated[0], record)
+        self.assertEqual(record['markPrice'], 100.0)
+
+    def test_account_events_trigger_reconciliation(self):
+        async def scenario():
+            market = ReplayServer([], subscriptions_expected=2)
+            event = gzip.compress(json.dumps({'e': 'ORDER_TRADE_UPDATE', 'o': {'s': 'ETH-USDT'}}).encode())
+            user = ReplayServer([event])
+            tracker = self.make_tracker(await market.start(), await user.start())
+            await self.run_until(tracker, lambda: tracker.reconciliations >= 2)
+            await market.stop()
+            await user.stop()
+            return tracker
+
+        tracker = asyncio.run(scenario())
+        self.assertGreaterEqual(tracker.reconciliations, 2)
+        self.mocks['create_listen_key'].assert_called_once()
+
+
+if __name__ == '__main__':
+    unittest.main()
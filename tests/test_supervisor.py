@@ -0,0 +1,83 @@
+import unittest
+from unittest.mock import patch, MagicMock
+import json
+import os
+import queue
+import sys
+import tempfile
+import pandas as pd
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from api_lib import open_positions
+from order_tracker import OrderTracker
+from supervisor import ThroughputMetrics, load_accounts, shard_accounts, worker_main
+
+
+class TestSupervisor(unittest.TestCase):
+    def test_load_accounts_reads_credentials_from_env(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'accounts.json')
+            with open(path, 'w') as f:
+                json.dump([
+                    {'name': 'main', 'api_key': 'k1', 'api_secret': 's1'},
+                    {'name': 'sub1', 'api_key_env': 'SUB1_KEY', 'api_secret_env': 'SUB1_SECRET'},
+                ], f)
+            with patch.dict(os.environ, {'SUB1_KEY': 'k2', 'SUB1_SECRET': 's2'}):
+                accounts = load_accounts(path)
+
+        self.assertEqual(accounts[1], {'name': 'sub1', 'api_key': 'k2', 'api_secret': 's2'})
+
+    def test_shard_accounts(self):
+        accounts = [{'name': str(i)} for i in range(5)]
+        shards = shard_accounts(accounts, 2)
+        self.assertEqual([[a['name'] for a in shard] for shard in shards], [['0', '2', '4'], ['1', '3']])
+        self.assertEqual(len(shard_accounts(accounts[:1], 8)), 1)
+
+    def test_worker_isolates_failing_accounts(self):
+        accounts = [{'name': 'good', 'api_key': 'k', 'api_secret': 's'},
+                    {'name': 'bad', 'api_key': 'k', 'api_secret': 's'}]
+
+        def make_tracker(account, redis_client):
+            tracker = MagicMock()
+            tracker.account = account
+            tracker.open_positions = pd.DataFrame({'positionId': [1, 2]})
+            if account['name'] == 'bad':
+                tracker.run.side_effect = RuntimeError('banned')
+            return tracker
+
+        results = queue.Queue()
+        with patch('order_tracker.OrderTracker', side_effect=make_tracker), \
+                patch('order_tracker.connect_redis', return_value=None):
+            worker_main(0, accounts, False, 0, results)
+
+        metrics = ThroughputMetrics()
+        while not results.empty():
+            metrics.add(results.get())
+        summary = metrics.summary()
+        self.assertEqual(summary['runs'], 2)
+        self.assertEqual(summary['failures'], 1)
+        self.assertEqual(summary['failing_accounts'], ['bad'])
+
+
+class TestAccountTracker(unittest.TestCase):
+    def test_account_gets_own_state_and_credentials(self):
+        account = {'name': 'sub1', 'api_key': 'sub-key', 'api_secret': 'sub-secret'}
+        # The file journal whether or not Redis is reachable here
+        with patch('order_tracker.saved_locally_backend', 'file'):
+            tracker = OrderTracker(account=account)
+            self.assertTrue(tracker.saved_store.snapshot_path.endswith('saved_locally_sub1.json'))
+
+        session = MagicMock()
+        session.request.return_value.json.return_value = {'code': 0, 'data': {'price': '1'}}
+        with patch.object(open_positions, 'session', session):
+            with tracker.account_credentials():
+                open_positions.get_price('BTC-USDT')
+            self.assertEqual(session.request.call_args.kwargs['headers']['X-BX-APIKEY'], 'sub-key')
+            self.assertIn(
+                open_positions.get_sign('sub-secret', session.request.call_args.args[1].split('?')[1].split('&signature=')[0]),
+                session.request.call_args.args[1],
+            )
+
+
+if __name__ == '__main__':
+    unittest.main()
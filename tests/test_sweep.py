@@ -0,0 +1,53 @@
+import unittest
+import os
+import sys
+import numpy as np
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from backtest import DEFAULT_PARAMS, replay
+from sweep import expand_grid, sweep
+
+
+def random_bars(count, seed):
+    rng = np.random.default_rng(seed)
+    close = 100 * np.cumprod(rng.normal(1, 0.003, count))
+    return close * (1 + abs(rng.normal(0, 0.001, count))), close * (1 - abs(rng.normal(0, 0.001, count))), close
+
+
+class TestSweep(unittest.TestCase):
+    def test_expand_grid(self):
+        params = expand_grid({'side': ['LONG', 'SHORT'], 'sl_adjustment': [0.1, 0.2, 0.3]})
+        self.assertEqual(list(zip(params['side'], params['sl_adjustment']))[:4],
+                         [('LONG', 0.1), ('LONG', 0.2), ('LONG', 0.3), ('SHORT', 0.1)])
+        self.assertTrue((params['fee'] == DEFAULT_PARAMS['fee']).all())
+
+    def test_matches_the_replay_of_every_combination(self):
+        high, low, close = random_bars(1500, 1)
+        results = sweep(high, low, close, {
+            'side': ['LONG', 'SHORT'],
+            'short_stop_factor': [0.2, 0.35],
+            'long_profit_factor': [0.3, 0.5],
+            'sl_adjustment': [0.12, 0.3],
+            'stop_distance': [0.01, 0.015],
+        })
+
+        self.assertEqual(len(results), 32)
+        for row in results.to_dict('records'):
+            expected = replay('X', high, low, close, {name: row[name] for name in DEFAULT_PARAMS})
+            self.assertEqual(row['trades'], expected['trades'])
+            self.assertEqual(row['mutations'], expected['mutations'])
+            self.assertAlmostEqual(row['pnl'], expected['pnl'], places=9)
+            self.assertAlmostEqual(row['max_drawdown'], expected['max_drawdown'], places=9)
+
+    def test_adaptive_trailing_uses_the_coefficients(self):
+        high, low, close = random_bars(1000, 2)
+        # Every bar counts as high volatility
+        adaptive = sweep(high, low, close, {'side': ['LONG', 'SHORT'], 'adaptive': [1], 'threshold': [0],
+                                            'high_volatility_coefficient': [0.25], 'sl_adjustment': [0.25]})
+        fixed = sweep(high, low, close, {'side': ['LONG', 'SHORT'], 'sl_adjustment': [0.25]})
+        np.testing.assert_allclose(adaptive['pnl'], fixed['pnl'])
+        np.testing.assert_array_equal(adaptive['mutations'], fixed['mutations'])
+
+
+if __name__ == '__main__':
+    unittest.main()
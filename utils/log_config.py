@@ -1,45 +1,145 @@
+import atexit
+import copy
+import json
 import logging
-from datetime import datetime
+import logging.handlers
+import queue
+from datetime import datetime, timedelta
 import os
-from colorama import Fore, Style, init
 from dotenv import load_dotenv
 
-init(autoreset=True)
 load_dotenv()
+# 'text' or 'json' (one JSON object per line) for the log file
+log_format = os.getenv('LOG_FORMAT', 'text')
+# Handlers write from a background thread, the logging call only puts the record on a queue
+log_queue = os.getenv('LOG_QUEUE', '1') == '1'
+
+DATEFMT = '%Y-%m-%d %H:%M:%S'
+listener = None
+exception_formatter = logging.Formatter()
 
 class ColorFormatter(logging.Formatter):
-    COLORS = {
-        logging.DEBUG: Fore.CYAN + Style.BRIGHT,
-        logging.INFO: Fore.GREEN + Style.BRIGHT,
-        logging.WARNING: Fore.YELLOW + Style.BRIGHT,
-        logging.ERROR: Fore.RED + Style.BRIGHT,
-        logging.CRITICAL: Fore.RED + Style.BRIGHT + Style.BRIGHT
-    }
+    def __init__(self):
+        super().__init__()
+        # colorama is loaded with the console handler, not on import
+        from colorama import Fore, Style, init
+
+        init(autoreset=True)
+        colors = {
+            logging.DEBUG: Fore.CYAN + Style.BRIGHT,
+            logging.INFO: Fore.GREEN + Style.BRIGHT,
+            logging.WARNING: Fore.YELLOW + Style.BRIGHT,
+            logging.ERROR: Fore.RED + Style.BRIGHT,
+            logging.CRITICAL: Fore.RED + Style.BRIGHT + Style.BRIGHT
+        }
+        # One formatter per level, built once
+        self.formatters = {
+            level: logging.Formatter(f"%(asctime)s: {color}%(levelname)s{Style.RESET_ALL}: %(message)s", datefmt=DATEFMT)
+            for level, color in colors.items()
+        }
+        self.default_formatter = logging.Formatter("%(asctime)s: %(levelname)s: %(message)s", datefmt=DATEFMT)
+
+    def format(self, record):
+        return self.formatters.get(record.levelno, self.default_formatter).format(record)
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record: time, level, logger, message and the exception if any"""
 
     def format(self, record):
-        log_fmt = f"%(asctime)s: {self.COLORS.get(record.levelno, '')}%(levelname)s{Style.RESET_ALL}: %(message)s"
-        formatter = logging.Formatter(log_fmt, datefmt='%Y-%m-%d %H:%M:%S')
-        return formatter.format(record)
+        entry = {
+            'time': self.formatTime(record, DATEFMT),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+class RecordQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queues a copy of the record with the message merged and the traceback kept in exc_text,
+    the stock prepare() folds the traceback into the message and the JSON file loses it.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            # Formatted here, the traceback frames are not kept alive on the queue
+            record.exc_text = record.exc_text or exception_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+class DailyFileHandler(logging.handlers.BaseRotatingHandler):
+    """
+    Writes to {log_dir}/{date}_log.log and switches to the file of the new day
+    on the first record after midnight.
+    """
+
+    def __init__(self, log_dir):
+        self.log_dir = log_dir
+        now = datetime.now()
+        self.rollover_at = self.next_midnight(now)
+        super().__init__(self.file_name(now), 'a', delay=True)
+
+    def file_name(self, now):
+        return f"{self.log_dir}/{now.strftime('%Y-%d-%m')}_log.log"
+
+    @staticmethod
+    def next_midnight(now):
+        midnight = datetime.combine(now.date() + timedelta(days=1), datetime.min.time())
+        return midnight.timestamp()
+
+    def shouldRollover(self, record):
+        return record.created >= self.rollover_at
+
+    def doRollover(self):
+        if self.stream:
+            self.stream.close()
+            self.stream = None
+        now = datetime.now()
+        self.baseFilename = os.path.abspath(self.file_name(now))
+        self.rollover_at = self.next_midnight(now)
+
+def stop_listener():
+    """Write out the queued records and stop the background thread"""
+    global listener
+    if listener is not None:
+        listener.stop()
+        listener = None
 
 def logging_config():
+    global listener
     level = logging.INFO
     log_dir = os.getenv('LOG_DIR')
-    now = datetime.now()
-    date_time = now.strftime("%Y-%d-%m")
-    log_file = f"{log_dir}/{date_time}_log.log"
 
-    file_formatter = logging.Formatter('%(asctime)s:%(levelname)s:%(message)s', datefmt='%Y-%m-%d %H:%M:%S')
-    
     logger = logging.getLogger('main_log')
     logger.setLevel(level)
-    
+
     if not logger.handlers:
-        file_handler = logging.FileHandler(log_file)
-        file_handler.setFormatter(file_formatter)
-        logger.addHandler(file_handler)
+        file_handler = DailyFileHandler(log_dir)
+        if log_format == 'json':
+            file_handler.setFormatter(JsonFormatter())
+        else:
+            file_handler.setFormatter(logging.Formatter('%(asctime)s:%(levelname)s:%(message)s', datefmt=DATEFMT))
 
         console_handler = logging.StreamHandler()
         console_handler.setFormatter(ColorFormatter())
-        logger.addHandler(console_handler)
-    
+
+        if log_queue:
+            listener = logging.handlers.QueueListener(
+                queue.SimpleQueue(), file_handler, console_handler, respect_handler_level=True,
+            )
+            logger.addHandler(RecordQueueHandler(listener.queue))
+            listener.start()
+            atexit.register(stop_listener)
+        else:
+            logger.addHandler(file_handler)
+            logger.addHandler(console_handler)
+
     return logger
@@ -0,0 +1,228 @@
+import json
+import os
+
+
+def entry_key(positionId):
+    # positionId comes back as int from the pandas snapshot and as str from the exchange
+    return str(positionId)
+
+
+def entries_frame(entries):
+    # pandas is only needed by callers that want a frame, the tracker reads load_entries
+    import pandas as pd
+
+    return pd.DataFrame(entries)
+
+
+def snapshot_rows(snapshot):
+    """Rows of a snapshot written as a list of entries or, as pandas does, as {column: {index: value}}"""
+    if isinstance(snapshot, list):
+        return snapshot
+    index = sorted({key for values in snapshot.values() for key in values}, key=int)
+    return [{column: values.get(key) for column, values in snapshot.items()} for key in index]
+
+
+def to_builtin(value):
+    # numpy scalars from pandas rows are not JSON serializable
+    if hasattr(value, 'item'):
+        return value.item()
+    return str(value)
+
+
+class SavedLocallyJournal:
+    """
+    File store for saved_locally: a full snapshot (the usual saved_locally.json)
+    plus an append-only journal with the upserts and deletes made since the
+    snapshot was written. The journal is folded into a new snapshot every
+    `compact_every` records.
+    """
+    shared = False
+
+    def __init__(self, snapshot_path='saved_locally.json', journal_path=None, compact_every=500):
+        self.snapshot_path = snapshot_path
+        self.journal_path = journal_path or f"{os.path.splitext(snapshot_path)[0]}.journal"
+        self.compact_every = compact_every
+        self.journal_size = 0
+
+    def load(self, positionIds=None):
+        return entries_frame(self.load_entries(positionIds))
+
+    def load_entries(self, positionIds=None):
+        # The whole file is local, positionIds is accepted for parity with RedisHashStore
+        entries = {}
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, 'r') as f:
+                snapshot = json.load(f)
+            for entry in snapshot_rows(snapshot):
+                entries.setdefault(entry_key(entry['positionId']), entry)
+
+        self.journal_size = 0
+        if os.path.exists(self.journal_path):
+            # Bytes up to the end of the last complete record
+            committed = 0
+            with open(self.journal_path, 'rb') as f:
+                for line in f:
+                    # A record is committed by its newline
+                    if not line.endswith(b'\n'):
+                        break
+                    if line.strip():
+                        try:
+                            record = json.loads(line)
+                        except ValueError:
+                            # Torn write at the end of the journal, nothing after it was committed
+                            break
+                        self.apply(entries, record)
+                        self.journal_size += 1
+                    committed += len(line)
+            if committed < os.path.getsize(self.journal_path):
+                # Drop the torn tail, the next save would otherwise append to the fragment
+                with open(self.journal_path, 'r+b') as f:
+                    f.truncate(committed)
+
+        return list(entries.values())
+
+    def apply(self, entries, record):
+        key = entry_key(record['positionId'])
+        entries.pop(key, None)
+        if record['op'] == 'upsert':
+            entries[key] = record['entry']
+
+    def save(self, saved_locally, changes):
+        """
+        Append `changes` ({positionId: entry or None for a delete}) to the journal.
+        `saved_locally` is the full table for a compaction, or a function returning it
+        so that it is only built when the journal is compacted.
+        Returns False when there was nothing to write.
+        """
+        if not changes:
+            return False
+
+        with open(self.journal_path, 'a') as f:
+            for positionId, entry in changes.items():
+                if entry is None:
+                    record = {'op': 'delete', 'positionId': positionId}
+                else:
+                    record = {'op': 'upsert', 'positionId': positionId, 'entry': entry}
+                f.write(json.dumps(record, default=to_builtin) + '\n')
+        self.journal_size += len(changes)
+
+        if self.journal_size >= self.compact_every:
+            self.compact(saved_locally() if callable(saved_locally) else saved_locally)
+        return True
+
+    def compact(self, saved_locally):
+        """Write `saved_locally` (entries or a DataFrame) as the new snapshot"""
+        entries = saved_locally.to_dict('records') if hasattr(saved_locally, 'to_dict') else list(saved_locally)
+        columns = list(dict.fromkeys(column for entry in entries for column in entry))
+        # Same layout as DataFrame.to_json, so older snapshots and tools keep reading it
+        snapshot = {
+            column: {str(i): entry.get(column) for i, entry in enumerate(entries)} for column in columns
+        }
+        tmp_path = f"{self.snapshot_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(snapshot, f, default=to_builtin)
+        os.replace(tmp_path, self.snapshot_path)
+        # Replaying the journal over the new snapshot is idempotent, so losing it here is safe
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+        self.journal_size = 0
+
+
+class RedisHashStore:
+    """
+    Redis store for saved_locally: one field per positionId in a single hash,
+    so several trackers can share the state and only touch their own entries.
+    """
+    shared = True
+
+    def __init__(self, redis_client, key='saved_locally:positions', chunk_size=500, owner=None):
+        """
+        :param owner: id of the tracker's API key, stored with every entry it writes so that
+                      collect_stale only removes its own entries from a hash shared with others
+        """
+        self.redis_client = redis_client
+        self.key = key
+        self.chunk_size = chunk_size
+        self.owner = owner
+
+    def load(self, positionIds=None):
+        return entries_frame(self.load_entries(positionIds))
+
+    def load_entries(self, positionIds=None):
+        """Load the entries for `positionIds`, or the whole hash when it is None"""
+        if positionIds is None:
+            values = self.redis_client.hgetall(self.key).values()
+        else:
+            fields = list(dict.fromkeys(entry_key(p) for p in positionIds))
+            if not fields:
+                return []
+            pipe = self.redis_client.pipeline(transaction=False)
+            for i in range(0, len(fields), self.chunk_size):
+                pipe.hmget(self.key, fields[i:i + self.chunk_size])
+            values = [value for chunk in pipe.execute() for value in chunk]
+
+        entries = [json.loads(value) for value in values if value is not None]
+        for entry in entries:
+            entry.pop('owner', None)
+        return entries
+
+    def save(self, saved_locally, changes):
+        if not changes:
+            return False
+
+        upserts = {
+            positionId: json.dumps(entry if self.owner is None else dict(entry, owner=self.owner), default=to_builtin)
+            for positionId, entry in changes.items() if entry is not None
+        }
+        deletes = [positionId for positionId, entry in changes.items() if entry is None]
+
+        pipe = self.redis_client.pipeline(transaction=True)
+        if upserts:
+            pipe.hset(self.key, mapping=upserts)
+        if deletes:
+            pipe.hdel(self.key, *deletes)
+        pipe.execute()
+        return True
+
+    def collect_stale(self, open_keys, cutoff):
+        """
+        Delete the fields of positions missing from `open_keys` whose entry time
+        is older than `cutoff` (ms). Returns the deleted fields.
+        Only entries of this store's owner are considered, `open_keys` says nothing
+        about the positions of the other trackers sharing the hash.
+        """
+        stale = []
+        for field, value in self.redis_client.hscan_iter(self.key, count=self.chunk_size):
+            field = field.decode() if isinstance(field, bytes) else field
+            if field in open_keys:
+                continue
+            entry = json.loads(value)
+            if entry.get('owner') != self.owner:
+                continue
+            if (entry.get('time') or 0) < cutoff:
+                stale.append(field)
+
+        for i in range(0, len(stale), self.chunk_size):
+            self.redis_client.hdel(self.key, *stale[i:i + self.chunk_size])
+        return stale
+
+
+class MemoryStore:
+    """saved_locally kept in memory only, for replays and benchmarks"""
+    shared = False
+
+    def __init__(self):
+        self.entries = {}
+
+    def load(self, positionIds=None):
+        return entries_frame(self.load_entries(positionIds))
+
+    def load_entries(self, positionIds=None):
+        return list(self.entries.values())
+
+    def save(self, saved_locally, changes):
+        for key, entry in changes.items():
+            if entry is None:
+                self.entries.pop(key, None)
+            else:
+                self.entries[key] = entry